@@ -0,0 +1,53 @@
+"""Benchmark of bond perception backends.
+
+The native backend is compared with Open Babel on a random frame of C, H and O
+atoms, and the fraction of atoms with the same bonds is reported.
+
+Run ``python benchmarks/bench_bond.py -n 20000``.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from ase import Atoms
+
+from mddatasetbuilder.detect import DetectDump
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--natoms", type=int, default=20000)
+    parser.add_argument(
+        "--density", type=float, default=0.11, help="Number density (1/Å^3)"
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    box = (args.natoms / args.density) ** (1 / 3)
+    atoms = Atoms(
+        numbers=rng.choice([1, 6, 8], size=args.natoms, p=[0.6, 0.2, 0.2]),
+        positions=rng.random((args.natoms, 3)) * box,
+        cell=np.diag([box, box, box]),
+        pbc=True,
+    )
+    print(f"atoms per frame: {args.natoms}")
+    results = {}
+    for readlevel in (False, True):
+        for backend in ("openbabel", "native"):
+            t = time.perf_counter()
+            results[backend] = DetectDump._crd2bond(atoms, readlevel, backend=backend)
+            print(
+                f"{backend:>9} readlevel={readlevel!s:<5}: {time.perf_counter() - t:.3f} s/frame"
+            )
+        agreement = np.mean(
+            [
+                sorted(x) == sorted(y)
+                for x, y in zip(results["openbabel"], results["native"])
+            ]
+        )
+        print(f"agreement readlevel={readlevel!s:<5}: {agreement:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark of DetectDump.readcrd.
+
+The vectorized parser is compared with the legacy parser, which creates an
+``ase.Atom`` object for each line.
+
+Run ``python benchmarks/bench_readcrd.py -n 200000``.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from ase import Atom, Atoms
+
+from mddatasetbuilder.detect import DetectDump
+
+
+def write_frame(f, natoms, box=100.0, seed=0):
+    """Write a random frame of the LAMMPS dump file."""
+    rng = np.random.default_rng(seed)
+    f.write(f"ITEM: TIMESTEP\n0\nITEM: NUMBER OF ATOMS\n{natoms}\n")
+    f.write("ITEM: BOX BOUNDS pp pp pp\n" + f"0.0 {box}\n" * 3)
+    f.write("ITEM: ATOMS id type x y z\n")
+    positions = rng.random((natoms, 3)) * box
+    types = rng.integers(1, 4, size=natoms)
+    for i in rng.permutation(natoms):
+        f.write("{} {} {:.6f} {:.6f} {:.6f}\n".format(i + 1, types[i], *positions[i]))
+
+
+def legacy_readcrd(detector, lines):
+    """Read coordinates by creating an ase.Atom object for each line."""
+    ss = []
+    step_atoms = []
+    ids = []
+    linecontent = None
+    for line in lines:
+        if line:
+            if line.startswith("ITEM:"):
+                linecontent = detector.LineType.linecontent(line)
+            elif linecontent == detector.LineType.ATOMS:
+                s = line.split()
+                ids.append(int(s[detector.id_idx]))
+                step_atoms.append(
+                    Atom(
+                        detector.atomname[int(s[detector.tidx]) - 1],
+                        (
+                            float(s[detector.xidx]),
+                            float(s[detector.yidx]),
+                            float(s[detector.zidx]),
+                        ),
+                    )
+                )
+            elif linecontent == detector.LineType.BOX:
+                ss.append(list(map(float, line.split())))
+    ss = np.array(ss)
+    boxsize = np.diag(ss[:, 1] - ss[:, 0])
+    step_atoms = [x for (y, x) in sorted(zip(ids, step_atoms))]
+    return Atoms(step_atoms, cell=boxsize, pbc=detector.pbc), ids
+
+
+def _timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t)
+    return min(times), result
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--natoms", type=int, default=200000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "dump")
+        with open(filename, "w") as f:
+            write_frame(f, args.natoms)
+            write_frame(f, args.natoms, seed=1)
+        detector = DetectDump(
+            filename=filename, atomname=np.array(["C", "H", "O"]), pbc=True
+        )
+        with open(filename) as f:
+            lines = [next(f) for _ in range(detector.steplinenum)]
+    t_legacy, (atoms_legacy, _) = _timeit(
+        lambda: legacy_readcrd(detector, lines), args.repeat
+    )
+    t_new, (atoms_new, _) = _timeit(lambda: detector.readcrd(lines), args.repeat)
+    assert atoms_legacy == atoms_new
+    print(f"atoms per frame: {args.natoms}")
+    print(f"legacy readcrd:     {t_legacy:.3f} s/frame")
+    print(f"vectorized readcrd: {t_new:.3f} s/frame")
+    print(f"speed-up:           {t_legacy / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
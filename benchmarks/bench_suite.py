@@ -0,0 +1,317 @@
+"""Offline benchmark suite on synthetic trajectories.
+
+The trajectories are written by ``synthetic.py``, so no file is downloaded.
+Micro-benchmarks measure the functions of each step on a frame:
+``DetectDump.readcrd``, ``_crd2bond``, ``dps``, ``_calcoulumbmatrix``,
+``_clusterdatas`` and ``_writestepxyzfile``. The end-to-end benchmark runs
+``builddataset`` at several scales with the profiler. The throughput and the
+peak memory of each benchmark are printed and written as JSON, so results of
+different commits can be compared.
+
+The peak memory of micro-benchmarks is the peak of memory allocated by Python
+and NumPy (traced by ``tracemalloc`` in a separate run), and the peak memory
+of the end-to-end benchmark is the peak resident memory of the parent process
+and of the largest worker process.
+
+Run ``python benchmarks/bench_suite.py -n 20000 --scales 1000x20 10000x20 -o
+bench.json``.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from synthetic import generate, parse_elements
+
+from mddatasetbuilder._version import version as __version__
+from mddatasetbuilder.datasetbuilder import DatasetBuilder
+from mddatasetbuilder.detect import DetectDump
+from mddatasetbuilder.dps import dps as connectmolecule
+from mddatasetbuilder.neighbor import NeighborList
+
+
+def _timeit(func, repeat):
+    """Return the best time of calls and the result."""
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t)
+    return min(times), result
+
+
+def _tracedpeak(func):
+    """Return the peak memory allocated during a call in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _builder(**kwargs):
+    """Create a builder without printing the banner."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return DatasetBuilder(**kwargs)
+
+
+def micro(args, tmpdir):
+    """Run the micro-benchmarks on the first frame of a synthetic trajectory.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The options.
+    tmpdir : str
+        The directory to write files.
+
+    Returns
+    -------
+    list of dicts
+        The name, time, number of items, throughput and peak memory of each
+        benchmark.
+    """
+    atomname = list(args.elements)
+    dumpfilename, _ = generate(
+        os.path.join(tmpdir, "micro"),
+        args.natoms,
+        2,
+        elements=args.elements,
+        triclinic=args.triclinic,
+        bond=False,
+        seed=args.seed,
+    )
+    builder = _builder(
+        dumpfilename=dumpfilename,
+        atomname=atomname,
+        n_clusters=args.nclusters,
+        nproc=1,
+        bondbackend=args.bondbackend,
+    )
+    detector = builder.crddetector
+    assert isinstance(detector, DetectDump)
+    with open(dumpfilename) as f:
+        lines = [next(f) for _ in range(detector.steplinenum)]
+    atoms, _ = detector.readcrd(lines)
+    bond = DetectDump._crd2bond(atoms, False, backend=args.bondbackend)
+    centers = np.random.default_rng(args.seed).choice(
+        args.natoms, size=min(args.ncenters, args.natoms), replace=False
+    )
+    clusters = NeighborList(atoms, builder.cutoff).query(centers)
+    features = np.random.default_rng(args.seed).random((args.natoms, 32))
+    # write structures of the centers as step 3
+    builder.dataset_dir = os.path.join(tmpdir, "dataset")
+    builder.gjfdir = os.path.join(tmpdir, "gjf")
+    builder.maxlength = len(str(args.nclusters))
+    builder.foldermaxlength = 1
+    builder.dstep = {
+        0: [(int(atoma) + 1, "C4", ii, ii) for ii, atoma in enumerate(centers)]
+    }
+    os.makedirs(os.path.join(builder.dataset_dir, "0"))
+    os.makedirs(os.path.join(builder.gjfdir, "0"))
+    benchmarks = [
+        ("readcrd", lambda: detector.readcrd(lines), args.natoms, "atoms"),
+        (
+            "_crd2bond",
+            lambda: DetectDump._crd2bond(atoms, True, backend=args.bondbackend),
+            args.natoms,
+            "atoms",
+        ),
+        ("dps", lambda: connectmolecule(bond), args.natoms, "atoms"),
+        (
+            "_calcoulumbmatrix",
+            lambda: [builder._calcoulumbmatrix(atoms[cluster]) for cluster in clusters],
+            len(clusters),
+            "clusters",
+        ),
+        (
+            "_clusterdatas",
+            lambda: DatasetBuilder._clusterdatas(features, args.nclusters),
+            len(features),
+            "atoms",
+        ),
+        (
+            "_writestepxyzfile",
+            lambda: builder._writestepxyzfile((0, lines)),
+            len(centers),
+            "structures",
+        ),
+    ]
+    results = []
+    for name, func, items, unit in benchmarks:
+        seconds, _ = _timeit(func, args.repeat)
+        results.append(
+            {
+                "name": name,
+                "seconds": seconds,
+                "items": items,
+                "unit": unit,
+                "throughput": items / seconds,
+                "peak_memory": _tracedpeak(func),
+            }
+        )
+    return results
+
+
+def endtoend(args, tmpdir, natoms, nframes):
+    """Build a dataset from a synthetic trajectory.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The options.
+    tmpdir : str
+        The directory to write files.
+    natoms : int
+        The number of atoms.
+    nframes : int
+        The number of frames.
+
+    Returns
+    -------
+    dict
+        The time, throughput and peak memory of the run and of each stage.
+    """
+    workdir = os.path.join(tmpdir, f"{natoms}x{nframes}")
+    os.makedirs(workdir)
+    dumpfilename, bondfilename = generate(
+        os.path.join(workdir, "traj"),
+        natoms,
+        nframes,
+        elements=args.elements,
+        triclinic=args.triclinic,
+        bond=args.bondfile,
+        seed=args.seed,
+    )
+    profile = os.path.join(workdir, "profile.json")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        builder = _builder(
+            dumpfilename=dumpfilename,
+            bondfilename=bondfilename,
+            atomname=list(args.elements),
+            n_clusters=args.nclusters,
+            nproc=args.nproc,
+            bondbackend=args.bondbackend,
+            output=args.output,
+            profile=profile,
+        )
+        t = time.perf_counter()
+        builder.builddataset()
+        seconds = time.perf_counter() - t
+    finally:
+        os.chdir(cwd)
+    with open(profile) as f:
+        report = json.load(f)
+    stages = [
+        {
+            key: stage[key]
+            for key in ("name", "seconds", "frames_per_second", "peak_rss")
+        }
+        for stage in report["stages"]
+    ]
+    return {
+        "natoms": natoms,
+        "nframes": nframes,
+        "seconds": seconds,
+        "frames_per_second": nframes / seconds,
+        "atoms_per_second": natoms * nframes / seconds,
+        "peak_rss": {
+            key: max(stage["peak_rss"][key] for stage in stages)
+            for key in ("parent", "workers")
+        },
+        "stages": stages,
+    }
+
+
+def _parsescale(value):
+    natoms, nframes = (int(x) for x in value.lower().split("x"))
+    return natoms, nframes
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--natoms", type=int, default=20000, help="Atoms of micro-benchmarks"
+    )
+    parser.add_argument(
+        "--ncenters",
+        type=int,
+        default=1000,
+        help="Clusters of _calcoulumbmatrix and _writestepxyzfile",
+    )
+    parser.add_argument(
+        "--scales",
+        type=_parsescale,
+        nargs="*",
+        default=[(1000, 20), (5000, 20)],
+        help="End-to-end runs as ATOMSxFRAMES, such as 1000x20",
+    )
+    parser.add_argument(
+        "-e",
+        "--elements",
+        type=parse_elements,
+        default="C:0.25,H:0.5,O:0.25",
+        help="Fractions of elements in the order of atom types",
+    )
+    parser.add_argument("--triclinic", action="store_true")
+    parser.add_argument(
+        "--bondfile",
+        action="store_true",
+        help="Read bonds from the bond file in the end-to-end benchmark",
+    )
+    parser.add_argument(
+        "--bondbackend", choices=["openbabel", "native"], default="native"
+    )
+    parser.add_argument("-k", "--nclusters", type=int, default=100)
+    parser.add_argument("-np", "--nproc", type=int, default=4)
+    parser.add_argument("--output", default="dir", help="Output format of datasets")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+    mib = 2**20
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = {
+            "version": __version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "options": vars(args),
+            "micro": micro(args, tmpdir),
+            "end_to_end": [
+                endtoend(args, tmpdir, natoms, nframes)
+                for natoms, nframes in args.scales
+            ],
+        }
+    print(f"atoms per frame: {args.natoms}")
+    for item in results["micro"]:
+        print(
+            f"{item['name']:>18}: {item['seconds']:.4f} s, "
+            f"{item['throughput']:.1f} {item['unit']}/s, "
+            f"peak {item['peak_memory'] / mib:.1f} MiB"
+        )
+    for item in results["end_to_end"]:
+        print(
+            f"builddataset {item['natoms']}x{item['nframes']}: "
+            f"{item['seconds']:.3f} s, {item['frames_per_second']:.2f} frames/s, "
+            f"peak RSS {item['peak_rss']['parent'] / mib:.0f}/"
+            f"{item['peak_rss']['workers'] / mib:.0f} MiB (parent/worker)"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
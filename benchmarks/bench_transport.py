@@ -0,0 +1,74 @@
+"""Benchmark of handing frames to worker processes in run_mp.
+
+Frames are sent to workers either as pickled lines, or as raw bytes in shared
+memory which are decoded by workers. Workers only count the lines, so the
+throughput is limited by the parent process.
+
+Run ``python benchmarks/bench_transport.py -n 100000 -f 200 -np 8``.
+"""
+
+import argparse
+import io
+import time
+
+import numpy as np
+
+from mddatasetbuilder.frameindex import decodeframe
+from mddatasetbuilder.utils import run_mp
+
+
+def make_frame(natoms, box=100.0):
+    """Return a random frame of the LAMMPS dump file in bytes."""
+    rng = np.random.default_rng(0)
+    f = io.StringIO()
+    f.write(f"ITEM: TIMESTEP\n0\nITEM: NUMBER OF ATOMS\n{natoms}\n")
+    f.write("ITEM: BOX BOUNDS pp pp pp\n" + f"0.0 {box}\n" * 3)
+    f.write("ITEM: ATOMS id type x y z\n")
+    np.savetxt(
+        f,
+        np.column_stack(
+            (
+                np.arange(1, natoms + 1),
+                rng.integers(1, 4, size=natoms),
+                rng.random((natoms, 3)) * box,
+            )
+        ),
+        fmt="%d %d %.6f %.6f %.6f",
+    )
+    return f.getvalue().encode()
+
+
+def count_lines(lines):
+    """Count lines of a frame."""
+    return len(lines)
+
+
+def _throughput(nproc, frames, shared):
+    t = time.perf_counter()
+    if shared:
+        items = iter(frames)
+    else:
+        items = (decodeframe(frame) for frame in frames)
+    nlines = sum(run_mp(nproc, func=count_lines, l=items, shared=shared, bar=False))
+    return len(frames) / (time.perf_counter() - t), nlines
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--natoms", type=int, default=100000)
+    parser.add_argument("-f", "--nframes", type=int, default=200)
+    parser.add_argument("-np", "--nproc", type=int, default=8)
+    args = parser.parse_args()
+    frames = [make_frame(args.natoms)] * args.nframes
+    pickled, nlines_pickled = _throughput(args.nproc, frames, shared=False)
+    shared, nlines_shared = _throughput(args.nproc, frames, shared=True)
+    assert nlines_pickled == nlines_shared
+    print(f"atoms per frame: {args.natoms}")
+    print(f"pickled lines: {pickled:.1f} frames/s")
+    print(f"shared memory: {shared:.1f} frames/s")
+    print(f"speed-up:      {shared / pickled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""Synthetic reactive-like LAMMPS trajectories for benchmarks.
+
+Heavy atoms are grouped into fragments of one or two bonded atoms, which are
+saturated with hydrogen atoms as far as the element mix allows, and spare
+hydrogen atoms form H2. The fragments are placed on a lattice in a periodic
+(orthorhombic or triclinic) box and move by a random walk. In each frame,
+hydrogen atoms hop to a nearby heavy atom with a probability, so bond types
+change over time like a reactive trajectory. The LAMMPS dump file and the
+ReaxFF bond file of the same frames are written.
+
+Run ``python benchmarks/synthetic.py -n 10000 -f 100 -o traj`` to write
+``traj.dump`` and ``traj.bond``.
+"""
+
+import argparse
+from contextlib import ExitStack
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# directions of a tetrahedron
+_TETRAHEDRON = np.array([[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]]) / 3**0.5
+_VALENCE = {"C": 4, "N": 3, "O": 2, "S": 2}
+_BONDLENGTH = {"H": 1.09, "HH": 0.74, "XX": 1.45}
+
+
+def _rotation(rng):
+    """Return a random rotation matrix."""
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    return q * np.sign(np.diag(r))
+
+
+class SyntheticTrajectory:
+    """A synthetic reactive-like trajectory.
+
+    Parameters
+    ----------
+    natoms : int
+        The number of atoms.
+    elements : dict
+        The fraction of each element, such as {"C": 0.25, "H": 0.5, "O":
+        0.25}. The order of elements is the order of atom types.
+    triclinic : bool, optional, default=False
+        Use a triclinic box instead of an orthorhombic box.
+    density : float, optional, default=0.05
+        The number density of atoms (1/Å^3).
+    hop : float, optional, default=0.01
+        The probability of each bonded hydrogen atom to hop in a frame.
+    dimer : float, optional, default=0.3
+        The probability of a heavy atom to be bonded with another one.
+    seed : int, optional, default=0
+        The random seed.
+    """
+
+    def __init__(
+        self,
+        natoms,
+        elements,
+        triclinic=False,
+        density=0.05,
+        hop=0.01,
+        dimer=0.3,
+        seed=0,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.elements = list(elements)
+        self.hop = hop
+        fractions = np.array([elements[x] for x in self.elements], dtype=float)
+        counts = np.floor(fractions / fractions.sum() * natoms).astype(int)
+        counts[np.argmax(fractions)] += natoms - counts.sum()
+        types = np.repeat(np.arange(len(self.elements)), counts)
+        self.types = self.rng.permutation(types)
+        self.symbols = np.array(self.elements)[self.types]
+        self.natoms = natoms
+        # the box
+        length = (natoms / density) ** (1 / 3)
+        self.cell = np.diag([length] * 3)
+        if triclinic:
+            self.cell[1, 0] = 0.1 * length
+            self.cell[2, :2] = [0.05 * length, -0.1 * length]
+        # bonds: atom -> {atom: bond order}
+        self.bonds = [{} for _ in range(natoms)]
+        # the fragment, reference position, directions and free slots
+        self.fragment = np.zeros(natoms, dtype=int)
+        self.positions = np.zeros((natoms, 3))
+        self._directions = {}
+        self._free = {}
+        # the slot of each bonded hydrogen atom
+        self._slots = {}
+        heavy = [ii for ii in range(natoms) if self.symbols[ii] != "H"]
+        hydrogens = [ii for ii in range(natoms) if self.symbols[ii] == "H"]
+        fragments = []
+        while heavy:
+            n = 2 if len(heavy) > 1 and self.rng.random() < dimer else 1
+            fragments.append([heavy.pop() for _ in range(n)])
+        # hydrogen atoms exceeding the valence of heavy atoms form H2
+        capacity = sum(
+            _VALENCE.get(self.symbols[atom], 4) - (len(fragment) - 1)
+            for fragment in fragments
+            for atom in fragment
+        )
+        spare = hydrogens[capacity:]
+        while spare:
+            fragments.append([spare.pop() for _ in range(min(2, len(spare)))])
+        self._build(fragments, hydrogens[:capacity])
+
+    def _build(self, fragments, hydrogens):
+        """Place fragments on a lattice and bond atoms in them.
+
+        Hydrogen atoms are bonded to random free slots of heavy atoms.
+        """
+        nsites = int(np.ceil(len(fragments) ** (1 / 3)))
+        grid = np.stack(
+            np.meshgrid(*[np.arange(nsites)] * 3, indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        sites = grid[self.rng.permutation(len(grid))[: len(fragments)]]
+        for index, (fragment, site) in enumerate(zip(fragments, sites)):
+            center = (site + 0.5) / nsites @ self.cell
+            if self.symbols[fragment[0]] == "H":
+                direction = _rotation(self.rng)[0]
+                for kk, atom in enumerate(fragment):
+                    sign = 0.5 if kk == 0 else -0.5
+                    self.positions[atom] = center + sign * _BONDLENGTH["HH"] * direction
+                    self.fragment[atom] = index
+                if len(fragment) == 2:
+                    self._bond(fragment[0], fragment[1], 1.0)
+                continue
+            rotation = _rotation(self.rng)
+            for kk, atom in enumerate(fragment):
+                # the second heavy atom is inverted to face the first one
+                self._directions[atom] = (
+                    _TETRAHEDRON @ rotation.T * (1 if kk == 0 else -1)
+                )
+                self._free[atom] = list(
+                    range(_VALENCE.get(self.symbols[atom], 4))[::-1]
+                )
+                self.positions[atom] = center
+                self.fragment[atom] = index
+            if len(fragment) == 2:
+                a, b = fragment
+                self._free[a].remove(0)
+                self._free[b].remove(0)
+                self.positions[b] = (
+                    self.positions[a] + _BONDLENGTH["XX"] * self._directions[a][0]
+                )
+                self._bond(a, b, float(self.rng.choice([1.0, 2.0])))
+        slots = [atom for atom, free in self._free.items() for _ in free]
+        for hydrogen, kk in zip(hydrogens, self.rng.permutation(len(slots))):
+            self._attach(hydrogen, slots[kk])
+
+    def _bond(self, a, b, order):
+        self.bonds[a][b] = order
+        self.bonds[b][a] = order
+
+    def _attach(self, hydrogen, atom):
+        """Bond a hydrogen atom to a free slot of a heavy atom."""
+        slot = self._free[atom].pop()
+        self.positions[hydrogen] = (
+            self.positions[atom] + _BONDLENGTH["H"] * self._directions[atom][slot]
+        )
+        self.fragment[hydrogen] = self.fragment[atom]
+        self._bond(hydrogen, atom, 1.0)
+        self._slots[hydrogen] = slot
+
+    def _detach(self, hydrogen):
+        (atom,) = self.bonds[hydrogen]
+        del self.bonds[atom][hydrogen]
+        self.bonds[hydrogen] = {}
+        self._free[atom].append(self._slots.pop(hydrogen))
+
+    def step(self, move=0.05):
+        """Move fragments and let hydrogen atoms hop.
+
+        Parameters
+        ----------
+        move : float, optional, default=0.05
+            The standard deviation of the displacement of fragments (Å).
+        """
+        shift = self.rng.normal(scale=move, size=(self.fragment.max() + 1, 3))
+        self.positions += shift[self.fragment]
+        bonded = [
+            ii
+            for ii in range(self.natoms)
+            if self.symbols[ii] == "H"
+            and len(self.bonds[ii]) == 1
+            and self.symbols[next(iter(self.bonds[ii]))] != "H"
+        ]
+        hoppers = [ii for ii in bonded if self.rng.random() < self.hop]
+        if not hoppers:
+            return
+        heavy = np.array(sorted(self._free))
+        scaled = np.linalg.solve(self.cell.T, self.positions[heavy].T).T % 1.0
+        tree = cKDTree(scaled, boxsize=1.0)
+        for hydrogen in hoppers:
+            (atom,) = self.bonds[hydrogen]
+            _, neighbors = tree.query(
+                scaled[np.searchsorted(heavy, atom)], k=min(9, len(heavy))
+            )
+            candidates = [
+                heavy[kk]
+                for kk in np.atleast_1d(neighbors)
+                if self._free[heavy[kk]]
+                and self.fragment[heavy[kk]] != self.fragment[atom]
+            ]
+            if candidates:
+                self._detach(hydrogen)
+                self._attach(hydrogen, candidates[self.rng.integers(len(candidates))])
+
+    def frame(self, jitter=0.02):
+        """Return the wrapped positions with thermal noise.
+
+        Parameters
+        ----------
+        jitter : float, optional, default=0.02
+            The standard deviation of the noise (Å).
+
+        Returns
+        -------
+        numpy.ndarray (natoms, 3)
+            The positions.
+        """
+        positions = self.positions + self.rng.normal(
+            scale=jitter, size=self.positions.shape
+        )
+        scaled = np.linalg.solve(self.cell.T, positions.T).T % 1.0
+        return scaled @ self.cell
+
+    def write_dump(self, f, timestep, positions):
+        """Write a frame of the LAMMPS dump file.
+
+        Parameters
+        ----------
+        f : File object
+            The dump file.
+        timestep : int
+            The timestep.
+        positions : numpy.ndarray (natoms, 3)
+            The positions.
+        """
+        (lx, _, _), (xy, ly, _), (xz, yz, lz) = self.cell
+        f.write(f"ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n{self.natoms}\n")
+        if xy or xz or yz:
+            f.write(
+                "ITEM: BOX BOUNDS xy xz yz pp pp pp\n"
+                f"{min(0.0, xy, xz, xy + xz)} {lx + max(0.0, xy, xz, xy + xz)} {xy}\n"
+                f"{min(0.0, yz)} {ly + max(0.0, yz)} {xz}\n"
+                f"0.0 {lz} {yz}\n"
+            )
+        else:
+            f.write(f"ITEM: BOX BOUNDS pp pp pp\n0.0 {lx}\n0.0 {ly}\n0.0 {lz}\n")
+        f.write("ITEM: ATOMS id type x y z\n")
+        # atoms are not sorted as in parallel runs of LAMMPS
+        order = self.rng.permutation(self.natoms)
+        np.savetxt(
+            f,
+            np.column_stack((order + 1, self.types[order] + 1, positions[order])),
+            fmt="%d %d %.6f %.6f %.6f",
+        )
+
+    def write_bond(self, f, timestep):
+        """Write a frame of the ReaxFF bond file.
+
+        Parameters
+        ----------
+        f : File object
+            The bond file.
+        timestep : int
+            The timestep.
+        """
+        f.write(
+            f"# Timestep {timestep}\n#\n# Number of particles {self.natoms}\n#\n"
+            "# id type nb id_1...id_nb mol bo_1...bo_nb abo nlp q\n"
+        )
+        for ii in range(self.natoms):
+            neighbors = sorted(self.bonds[ii])
+            # bond orders are not exact in ReaxFF
+            orders = [self.bonds[ii][jj] - 0.1 * self.rng.random() for jj in neighbors]
+            f.write(
+                " ".join(
+                    [
+                        str(ii + 1),
+                        str(self.types[ii] + 1),
+                        str(len(neighbors)),
+                        *(str(jj + 1) for jj in neighbors),
+                        str(self.fragment[ii] + 1),
+                        *(f"{bo:.3f}" for bo in orders),
+                        f"{sum(orders):.3f}",
+                        "0.000",
+                        "0.000",
+                    ]
+                )
+                + "\n"
+            )
+        f.write("#\n")
+
+
+def generate(
+    prefix,
+    natoms,
+    nframes,
+    elements=None,
+    triclinic=False,
+    bond=True,
+    interval=10,
+    **kwargs,
+):
+    """Write a synthetic trajectory.
+
+    Parameters
+    ----------
+    prefix : str
+        The prefix of the files.
+    natoms : int
+        The number of atoms.
+    nframes : int
+        The number of frames.
+    elements : dict, optional, default=None
+        The fraction of each element. If None (default), C, H and O atoms with
+        the fractions 0.25, 0.5 and 0.25 are used.
+    triclinic : bool, optional, default=False
+        Use a triclinic box instead of an orthorhombic box.
+    bond : bool, optional, default=True
+        Write the bond file.
+    interval : int, optional, default=10
+        The interval of timesteps between frames.
+    **kwargs : dict, optional
+        Other parameters of `SyntheticTrajectory`.
+
+    Returns
+    -------
+    dumpfilename: str
+        The dump file `{prefix}.dump`.
+    bondfilename: str or None
+        The bond file `{prefix}.bond`, or None if `bond` is False.
+    """
+    if elements is None:
+        elements = {"C": 0.25, "H": 0.5, "O": 0.25}
+    traj = SyntheticTrajectory(natoms, elements, triclinic=triclinic, **kwargs)
+    dumpfilename = f"{prefix}.dump"
+    bondfilename = f"{prefix}.bond" if bond else None
+    with ExitStack() as stack:
+        fd = stack.enter_context(open(dumpfilename, "w"))
+        fb = stack.enter_context(open(bondfilename, "w")) if bond else None
+        for ii in range(nframes):
+            if ii:
+                traj.step()
+            traj.write_dump(fd, ii * interval, traj.frame())
+            if fb is not None:
+                traj.write_bond(fb, ii * interval)
+    return dumpfilename, bondfilename
+
+
+def parse_elements(value):
+    """Parse the element mix such as ``C:0.25,H:0.5,O:0.25``."""
+    elements = {}
+    for item in value.split(","):
+        element, fraction = item.split(":")
+        elements[element] = float(fraction)
+    return elements
+
+
+def main():
+    """Write a synthetic trajectory."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--natoms", type=int, default=10000)
+    parser.add_argument("-f", "--nframes", type=int, default=100)
+    parser.add_argument("-o", "--output", default="traj", help="Prefix of files")
+    parser.add_argument(
+        "-e",
+        "--elements",
+        type=parse_elements,
+        default="C:0.25,H:0.5,O:0.25",
+        help="Fractions of elements in the order of atom types",
+    )
+    parser.add_argument("--triclinic", action="store_true")
+    parser.add_argument("--density", type=float, default=0.05)
+    parser.add_argument("--hop", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    dumpfilename, bondfilename = generate(
+        args.output,
+        args.natoms,
+        args.nframes,
+        elements=args.elements,
+        triclinic=args.triclinic,
+        density=args.density,
+        hop=args.hop,
+        seed=args.seed,
+    )
+    print(f"{dumpfilename}, {bondfilename}: atoms {list(args.elements)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
 # Copyright 2018 East China Normal University
 """MDDatasetBuilder."""
 
-from .datasetbuilder import DatasetBuilder
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .datasetbuilder import DatasetBuilder
 
 __all__ = ["DatasetBuilder"]
+
+
+def __getattr__(name):
+    # the builder is imported on first use, so the other command line tools
+    # do not import it
+    if name == "DatasetBuilder":
+        from .datasetbuilder import DatasetBuilder
+
+        return DatasetBuilder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
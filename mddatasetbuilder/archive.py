@@ -0,0 +1,218 @@
+"""Tar shards of the dataset with an index."""
+
+import json
+import os
+import tarfile
+import time
+
+from ._logger import logger
+
+
+def appendmembers(filename, members):
+    """Append files to a tar shard.
+
+    Each file is written as a header and the padded data, so the shard can be
+    appended by reopening it. The end-of-archive blocks are not written, which
+    is accepted by both `tarfile` and GNU tar.
+
+    Parameters
+    ----------
+    filename : str
+        The filename of the shard.
+    members : list of tuples (name, data)
+        name: str
+            The name of the file in the archive.
+        data: bytes
+            The content of the file.
+
+    Returns
+    -------
+    list of tuples (name, offset, size)
+        The name, the offset of the data in the shard and the size of each file.
+    """
+    entries = []
+    mtime = int(time.time())
+    with open(filename, "ab") as f:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = mtime
+            header = info.tobuf()
+            offset = f.tell() + len(header)
+            f.write(header)
+            f.write(data)
+            f.write(b"\0" * (-len(data) % tarfile.BLOCKSIZE))
+            entries.append((name, offset, len(data)))
+    return entries
+
+
+def readmember(location):
+    """Read a file from a shard.
+
+    Parameters
+    ----------
+    location : tuple (filename, offset, size)
+        The filename of the shard, the offset and the size of the file.
+
+    Returns
+    -------
+    bytes
+        The content of the file.
+    """
+    filename, offset, size = location
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+class Archive:
+    """Files of a dataset stored in tar shards in a directory.
+
+    Each writer appends to its own shard, and the index maps the name of each
+    file to its shard, offset and size, so a file is read with one seek.
+    Shards are plain tar files, which can also be extracted by `tar -xf`.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of shards and the index.
+    """
+
+    indexname = "index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        # name -> (shard, offset, size)
+        self.index = {}
+        if self.isarchive(directory):
+            with open(os.path.join(directory, self.indexname)) as f:
+                self.index = {
+                    name: tuple(entry) for name, entry in json.load(f).items()
+                }
+
+    @classmethod
+    def isarchive(cls, directory):
+        """Return whether a directory contains an archive.
+
+        Parameters
+        ----------
+        directory : str
+            The directory.
+
+        Returns
+        -------
+        bool
+            True if the index exists.
+        """
+        return os.path.isfile(os.path.join(directory, cls.indexname))
+
+    def add(self, shard, entries):
+        """Add files written to a shard to the index.
+
+        Parameters
+        ----------
+        shard : str
+            The filename of the shard in the directory.
+        entries : list of tuples (name, offset, size)
+            The files returned by `appendmembers`.
+        """
+        for name, offset, size in entries:
+            self.index[name] = (shard, offset, size)
+
+    def append(self, shard, members):
+        """Append files to a shard and add them to the index.
+
+        Parameters
+        ----------
+        shard : str
+            The filename of the shard in the directory.
+        members : list of tuples (name, data)
+            The names and contents of files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.add(shard, appendmembers(os.path.join(self.directory, shard), members))
+
+    def save(self):
+        """Save the index."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.indexname), "w") as f:
+            json.dump(self.index, f)
+
+    def clear(self):
+        """Remove all shards and the index."""
+        for shard in {entry[0] for entry in self.index.values()}:
+            path = os.path.join(self.directory, shard)
+            if os.path.isfile(path):
+                os.remove(path)
+        if self.isarchive(self.directory):
+            os.remove(os.path.join(self.directory, self.indexname))
+        self.index = {}
+
+    def names(self, suffix=""):
+        """Return the names of files.
+
+        Parameters
+        ----------
+        suffix : str, optional, default=""
+            Only return names ending with the suffix.
+
+        Returns
+        -------
+        list of strs
+            The sorted names.
+        """
+        return sorted(name for name in self.index if name.endswith(suffix))
+
+    def locate(self, name):
+        """Return the location of a file, which can be read by `readmember`.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file.
+
+        Returns
+        -------
+        tuple (filename, offset, size)
+            The filename of the shard, the offset and the size of the file.
+        """
+        shard, offset, size = self.index[name]
+        return os.path.join(self.directory, shard), offset, size
+
+    def read(self, name):
+        """Read a file.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file.
+
+        Returns
+        -------
+        bytes
+            The content of the file.
+        """
+        return readmember(self.locate(name))
+
+    def export(self, directory="."):
+        """Write files to the directory layout.
+
+        Parameters
+        ----------
+        directory : str, optional, default="."
+            The directory that the names of files are relative to.
+        """
+        logger.info(f"Export {len(self.index)} files to {directory}")
+        for name in self.names():
+            path = os.path.join(directory, *name.split("/"))
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self.read(name))
+
+    def __len__(self):
+        """Return the number of files."""
+        return len(self.index)
+
+    def __contains__(self, name):
+        """Return whether a file is in the archive."""
+        return name in self.index
@@ -0,0 +1,367 @@
+"""Native bond perception from coordinates.
+
+Connectivity follows the rules of Open Babel's ``ConnectTheDots``: two atoms
+are bonded if their distance is between 0.4 Å and the sum of their covalent
+radii plus 0.45 Å, and the longest bonds of atoms exceeding their maximum
+number of bonds or having a bond angle less than 45° are removed. Bond orders
+follow the rules of Open Babel's ``PerceiveBondOrders``, i.e. hybridizations
+from bond angles and electronegativity-ordered multiple bonds, but aromatic
+rings and most functional groups are not perceived. Thus bond orders, and the
+bond types built from them, are not equivalent to those of Open Babel.
+"""
+
+from typing import List
+
+import numpy as np
+from ase.data import covalent_radii
+
+from .neighbor import NeighborList
+
+# maximum number of bonds in Open Babel's element table
+_max_bonds = {
+    1: 1,
+    2: 0,
+    3: 1,
+    4: 2,
+    5: 4,
+    6: 4,
+    7: 4,
+    8: 2,
+    9: 1,
+    10: 0,
+    11: 1,
+    12: 2,
+    17: 1,
+    18: 0,
+    19: 1,
+    20: 2,
+    35: 1,
+    36: 0,
+    53: 1,
+    54: 0,
+}
+# Pauling electronegativities in Open Babel's element table
+_electronegativities = {
+    1: 2.20,
+    3: 0.98,
+    4: 1.57,
+    5: 2.04,
+    6: 2.55,
+    7: 3.04,
+    8: 3.44,
+    9: 3.98,
+    11: 0.93,
+    12: 1.31,
+    13: 1.61,
+    14: 1.90,
+    15: 2.19,
+    16: 2.58,
+    17: 3.16,
+    19: 0.82,
+    20: 1.00,
+    35: 2.96,
+    53: 2.66,
+}
+# (element, degree) of both ends of sp carbon atoms with two double bonds:
+# ketenes, allenes, isocyanates, and carbon dioxide
+_cumulenes = (
+    [(6, 3), (8, 1)],
+    [(6, 3), (6, 3)],
+    [(7, 2), (8, 1)],
+    [(8, 1), (8, 1)],
+)
+
+
+def _lookup(table, numbers, default):
+    return np.array([table.get(int(number), default) for number in numbers])
+
+
+def crd2bond(step_atoms, readlevel) -> List[List[int]]:
+    """Perceive bonds of atoms.
+
+    Parameters
+    ----------
+    step_atoms : ase.Atoms
+        The atoms of the frame.
+    readlevel : bool
+        If False, return the connected atoms of each atom; otherwise, return the
+        bond orders of each atom.
+
+    Returns
+    -------
+    list of lists of int
+        The connected atoms or bond orders of each atom.
+    """
+    numbers = step_atoms.get_atomic_numbers()
+    natoms = len(numbers)
+    radii = covalent_radii[numbers]
+    if natoms:
+        neighbors = NeighborList(step_atoms, 2 * radii.max() + 0.45)
+        i, j, vectors = neighbors.pairs()
+    else:
+        i = j = np.zeros(0, dtype=int)
+        vectors = np.zeros((0, 3))
+    lengths = np.linalg.norm(vectors, axis=1)
+    mask = (lengths < radii[i] + radii[j] + 0.45) & (lengths > 0.4)
+    i, j, vectors, lengths = i[mask], j[mask], vectors[mask], lengths[mask]
+    keep = _cleanup(numbers, step_atoms.positions[:, 2], i, j, vectors, lengths)
+    i, j, vectors, lengths = i[keep], j[keep], vectors[keep], lengths[keep]
+    bond = [[] for _ in range(natoms)]
+    if not readlevel:
+        for s1, s2 in zip(i.tolist(), j.tolist()):
+            bond[s1].append(s2)
+            bond[s2].append(s1)
+        return bond
+    levels = _bondorders(numbers, radii, i, j, vectors, lengths)
+    for s1, s2, level in zip(i.tolist(), j.tolist(), levels.tolist()):
+        bond[s1].append(level)
+        bond[s2].append(level)
+    return bond
+
+
+def _cleanup(numbers, z, i, j, vectors, lengths):
+    """Remove bonds exceeding the maximum number of bonds or with small angles.
+
+    Bonds of each atom are visited in the order Open Babel creates them, i.e.
+    looping over pairs of atoms sorted by z coordinates.
+
+    Returns
+    -------
+    numpy.ndarray
+        Whether each bond is kept.
+    """
+    natoms = len(numbers)
+    nbonds = len(i)
+    max_bonds = _lookup(_max_bonds, numbers, 6)
+    degree = np.bincount(i, minlength=natoms) + np.bincount(j, minlength=natoms)
+    bad = degree > max_bonds
+    # directed bonds sorted by atoms, to find bond angles less than 45 degrees
+    atom = np.concatenate((i, j))
+    units = vectors / lengths[:, None]
+    units = np.concatenate((units, -units))
+    order = np.argsort(atom, kind="stable")
+    atom, units = atom[order], units[order]
+    end = np.cumsum(np.bincount(atom, minlength=natoms))[atom]
+    for shift in range(1, int(degree.max(initial=0))):
+        e1 = np.flatnonzero(np.arange(len(atom)) + shift < end)
+        e2 = e1 + shift
+        cos = np.einsum("ij,ij->i", units[e1], units[e2])
+        bad[atom[e1[cos > np.cos(np.deg2rad(45.0))]]] = True
+    keep = np.ones(nbonds, dtype=bool)
+    if not bad.any():
+        return keep
+    # remove bonds one by one, in the same way as Open Babel
+    zrank = np.empty(natoms, dtype=int)
+    zrank[np.argsort(z, kind="stable")] = np.arange(natoms)
+    created = np.lexsort(
+        (np.maximum(zrank[i], zrank[j]), np.minimum(zrank[i], zrank[j]))
+    )
+    bonds_of = {}
+    for b, s1, s2 in zip(created.tolist(), i[created].tolist(), j[created].tolist()):
+        bonds_of.setdefault(s1, []).append(b)
+        bonds_of.setdefault(s2, []).append(b)
+    for a in np.flatnonzero(bad).tolist():
+        while True:
+            bonds = [b for b in bonds_of[a] if keep[b]]
+            others = [int(j[b]) if i[b] == a else int(i[b]) for b in bonds]
+            if len(bonds) <= max_bonds[a] and not _smallangle(
+                a, bonds, i, vectors, lengths
+            ):
+                break
+            if numbers[a] == 1:
+                hh = [b for b, o in zip(bonds, others) if numbers[o] == 1]
+                if hh:
+                    keep[hh[0]] = False
+                    continue
+            keep[max(bonds, key=lambda b: lengths[b])] = False
+    return keep
+
+
+def _smallangle(a, bonds, i, vectors, lengths):
+    """Whether any bond angle of an atom is less than 45 degrees."""
+    if len(bonds) < 2:
+        return False
+    units = vectors[bonds] / lengths[bonds, None]
+    units[i[bonds] != a] *= -1
+    cos = units @ units.T
+    np.fill_diagonal(cos, -1.0)
+    return bool((cos > np.cos(np.deg2rad(45.0))).any())
+
+
+def _bondorders(numbers, radii, i, j, vectors, lengths):
+    """Assign bond orders with the rules of Open Babel's ``PerceiveBondOrders``.
+
+    Atoms are sp or sp2 hybridized if their average bond angle is larger than
+    155° or 115°. After carbon dioxide, cumulenes, nitro groups, and S=O bonds
+    are assigned, atoms are visited in the order of descending
+    electronegativity, and each sp atom forms a triple bond, or each sp2 atom
+    forms a double bond, with its most electronegative unsaturated neighbor.
+    Bonds of terminal atoms must be short enough, and double bonds must be in a
+    planar geometry.
+
+    Unlike Open Babel, aromatic rings are not kekulized and only the functional
+    groups above are matched, so bond orders may differ in these cases.
+
+    Returns
+    -------
+    numpy.ndarray
+        The bond order of each bond.
+    """
+    natoms = len(numbers)
+    nbonds = len(i)
+    levels = np.ones(nbonds, dtype=int)
+    # directed bonds sorted by atoms
+    atom = np.concatenate((i, j))
+    other = np.concatenate((j, i))
+    bonds = np.tile(np.arange(nbonds), 2)
+    units = vectors / lengths[:, None]
+    units = np.concatenate((units, -units))
+    order = np.argsort(atom, kind="stable")
+    atom, other, bonds, units = atom[order], other[order], bonds[order], units[order]
+    degree = np.bincount(atom, minlength=natoms)
+    hybridization = _hybridizations(numbers, degree, atom, other, units)
+    maxbonds = _lookup(_max_bonds, numbers, 6)
+    candidate = ((hybridization > 0) | (degree == 1)) & (degree < maxbonds)
+    groups = (
+        ((numbers == 6) & (degree == 2) & (hybridization == 1))
+        | ((numbers == 7) & (degree == 3) & (hybridization == 2))
+        | ((numbers == 16) & (degree >= 2))
+    )
+    if not (candidate.any() or groups.any()):
+        return levels
+    # corrected covalent radii of sp and sp2 atoms
+    corrected = (radii * np.choose(hybridization, [1.0, 0.90, 0.95])).tolist()
+    electronegativity = _lookup(_electronegativities, numbers, 0.0).tolist()
+    start = np.concatenate(([0], np.cumsum(degree))).tolist()
+    other_, bonds_ = other.tolist(), bonds.tolist()
+    numbers_, degree_ = numbers.tolist(), degree.tolist()
+    hybridization_, maxbonds_ = hybridization.tolist(), maxbonds.tolist()
+    valence = degree.tolist()
+    nonsingle = [False] * natoms
+
+    def neighbors(a):
+        return zip(
+            other_[start[a] : start[a + 1]],
+            bonds_[start[a] : start[a + 1]],
+            range(start[a], start[a + 1]),
+        )
+
+    def overvalent(a, increment):
+        return numbers_[a] == 7 and valence[a] + increment > 3
+
+    def assign(a, b, bond, increment):
+        levels[bond] += increment
+        valence[a] += increment
+        valence[b] += increment
+        nonsingle[a] = nonsingle[b] = True
+
+    for a in np.flatnonzero(groups).tolist():
+        oxygens = [
+            (o, bond)
+            for o, bond, _ in neighbors(a)
+            if numbers_[o] == 8 and degree_[o] == 1
+        ]
+        if numbers_[a] == 6:
+            double = [(o, bond) for o, bond, _ in neighbors(a)]
+            if sorted((numbers_[o], degree_[o]) for o, _ in double) not in _cumulenes:
+                continue
+        elif numbers_[a] == 7:
+            double = oxygens if len(oxygens) == 2 else []
+        else:
+            double = oxygens
+        if not double or any(nonsingle[o] for o, _ in double):
+            continue
+        for o, bond in double:
+            assign(a, o, bond, 1)
+    lengths_ = lengths.tolist()
+    order = np.lexsort((-np.arange(natoms), -np.array(electronegativity)))
+    for a in order[candidate[order]].tolist():
+        free = maxbonds_[a] - valence[a]
+        if (hybridization_[a] == 1 or degree_[a] == 1) and free >= 2:
+            increment, factor = 2, 0.9
+        elif (hybridization_[a] == 2 or degree_[a] == 1) and free >= 1:
+            increment, factor = 1, 0.93
+        else:
+            continue
+        if nonsingle[a] or overvalent(a, increment):
+            continue
+        best = None
+        maxen = 0.0
+        shortest = 5000.0
+        for b, bond, k in neighbors(a):
+            if (
+                (hybridization_[b] != 3 - increment and degree_[b] != 1)
+                or valence[b] + increment > maxbonds_[b]
+                or nonsingle[b]
+                or overvalent(b, increment)
+            ):
+                continue
+            if not (
+                electronegativity[b] > maxen
+                or (
+                    abs(electronegativity[b] - maxen) < 1e-6
+                    and lengths_[bond] < shortest
+                )
+            ):
+                continue
+            if (degree_[a] == 1 or degree_[b] == 1) and lengths_[bond] > factor * (
+                corrected[a] + corrected[b]
+            ):
+                continue
+            if increment == 1 and not _isplanar(a, b, k, start, other, units):
+                continue
+            best = b, bond
+            maxen = electronegativity[b]
+            shortest = lengths_[bond]
+        if best is not None:
+            assign(a, *best, increment)
+    return levels
+
+
+def _hybridizations(numbers, degree, atom, other, units):
+    """Assign hybridizations from the average bond angles.
+
+    Returns
+    -------
+    numpy.ndarray
+        1 for sp atoms, 2 for sp2 atoms, and 0 for other atoms.
+    """
+    natoms = len(numbers)
+    end = np.cumsum(degree)[atom]
+    total = np.zeros(natoms)
+    for shift in range(1, int(degree.max(initial=0))):
+        e1 = np.flatnonzero(np.arange(len(atom)) + shift < end)
+        e2 = e1 + shift
+        cos = np.clip(np.einsum("ij,ij->i", units[e1], units[e2]), -1.0, 1.0)
+        total += np.bincount(atom[e1], np.degrees(np.arccos(cos)), minlength=natoms)
+    npairs = degree * (degree - 1) // 2
+    angle = np.divide(total, npairs, out=np.zeros(natoms), where=npairs > 0)
+    hybridization = np.where(angle > 155.0, 1, np.where(angle > 115.0, 2, 0))
+    # imines with one hydrogen atom
+    nhydrogens = np.bincount(atom[numbers[other] == 1], minlength=natoms)
+    hybridization[
+        (numbers == 7) & (degree == 2) & (nhydrogens == 1) & (angle > 109.5)
+    ] = 2
+    # sp and sp2 atoms need an sp, sp2, or terminal neighbor
+    conjugated = ((hybridization > 0) | (degree == 1))[other]
+    hybridization[
+        (hybridization > 0) & (np.bincount(atom[conjugated], minlength=natoms) == 0)
+    ] = 0
+    return hybridization
+
+
+def _isplanar(a, b, k, start, other, units):
+    """Whether all torsion angles around the bond k from a to b are near 0° or 180°.
+
+    Torsion angles are not checked if either atom has more than three neighbors.
+    """
+    if start[a + 1] - start[a] > 3 or start[b + 1] - start[b] > 3:
+        return True
+    ua = np.delete(units[start[a] : start[a + 1]], k - start[a], axis=0)
+    ub = units[start[b] : start[b + 1]][other[start[b] : start[b + 1]] != a]
+    uab = units[k]
+    n1 = np.cross(ua, uab)
+    n2 = np.cross(uab, ub)
+    dot = n1 @ n2.T
+    norm = np.outer(np.linalg.norm(n1, axis=1), np.linalg.norm(n2, axis=1))
+    return not (np.abs(dot) < np.cos(np.deg2rad(15.0)) * norm).any()
@@ -0,0 +1,210 @@
+"""Binary cache of trajectory files."""
+
+import hashlib
+import os
+from typing import Any, Dict
+
+import numpy as np
+
+from . import profiler
+from .utils import ArrayWriter, read_array
+
+# arrays of caches opened in this process
+_opened = {}
+
+
+def _prefix(directory, filename):
+    """Return the prefix of cache files for a trajectory."""
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16]
+    return os.path.join(directory, f"cache.{key}")
+
+
+def _stat(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class CachedFrame:
+    """A frame in the binary cache.
+
+    Only the prefix of the cache files and the index of the frame are sent to
+    worker processes, which read the arrays of the frame from memory-mapped
+    files.
+
+    Parameters
+    ----------
+    prefix : str
+        The prefix of the cache files.
+    index : int
+        The index of the frame in the file.
+    """
+
+    __slots__ = ("prefix", "index")
+
+    def __init__(self, prefix, index):
+        self.prefix = prefix
+        self.index = index
+
+    def read(self):
+        """Read the arrays of the frame.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            The flattened arrays of the frame, which are returned by
+            `readarrays` of the detector.
+        """
+        if self.prefix not in _opened:
+            with np.load(f"{self.prefix}.npz") as meta:
+                keys = meta["keys"].tolist()
+                _opened[self.prefix] = {
+                    key: (
+                        read_array(
+                            f"{self.prefix}.{key}", 1, dtype=str(dtype), mmap=True
+                        ).ravel(),
+                        meta[f"offsets_{key}"],
+                    )
+                    for key, dtype in zip(keys, meta["dtypes"].tolist())
+                }
+        i = self.index
+        arrays = {
+            key: data[offsets[i] : offsets[i + 1]]
+            for key, (data, offsets) in _opened[self.prefix].items()
+        }
+        profiler.count("read_bytes", sum(x.nbytes for x in arrays.values()))
+        return arrays
+
+
+class TrajectoryCache:
+    """Binary cache of a trajectory file.
+
+    Each array of frames, such as the coordinates or the bond table, is
+    appended to its own file, and the offsets of frames in each file are kept
+    in the metadata, which is saved last. The cache is valid only if the size
+    and the modification time of the trajectory are unchanged.
+
+    Parameters
+    ----------
+    prefix : str
+        The prefix of the cache files.
+    nframes : int
+        The number of frames.
+    """
+
+    def __init__(self, prefix, nframes):
+        self.prefix = prefix
+        self.nframes = nframes
+
+    def __len__(self):
+        """Return the number of frames."""
+        return self.nframes
+
+    def frame(self, i):
+        """Return a frame.
+
+        Parameters
+        ----------
+        i : int
+            The index of the frame.
+
+        Returns
+        -------
+        CachedFrame
+            The frame.
+        """
+        return CachedFrame(self.prefix, i)
+
+    @classmethod
+    def load(cls, directory, filename):
+        """Load the cache of a trajectory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of caches.
+        filename : str
+            The filename of the trajectory.
+
+        Returns
+        -------
+        TrajectoryCache or None
+            The cache. None if the trajectory is not cached or has been
+            modified.
+        """
+        prefix = _prefix(directory, filename)
+        if not os.path.isfile(f"{prefix}.npz"):
+            return None
+        with np.load(f"{prefix}.npz") as meta:
+            if meta["stat"].tolist() != _stat(filename):
+                return None
+            return cls(prefix, int(meta["nframes"]))
+
+
+class CacheWriter:
+    """Write the binary cache of a trajectory frame by frame.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of caches.
+    filename : str
+        The filename of the trajectory.
+    """
+
+    def __init__(self, directory, filename):
+        os.makedirs(directory, exist_ok=True)
+        self.filename = filename
+        self.prefix = _prefix(directory, filename)
+        self.stat = _stat(filename)
+        # an old cache is invalid from now on
+        if os.path.isfile(f"{self.prefix}.npz"):
+            os.remove(f"{self.prefix}.npz")
+        self._writers = {}
+        self._offsets = {}
+        self.nframes = 0
+
+    def append(self, arrays):
+        """Append a frame.
+
+        Parameters
+        ----------
+        arrays : dict of numpy.ndarray
+            The arrays of the frame. Every frame should have the same keys.
+        """
+        for key, value in arrays.items():
+            value = np.asarray(value)
+            if key not in self._writers:
+                self._writers[key] = ArrayWriter(
+                    f"{self.prefix}.{key}", 1, dtype=value.dtype
+                )
+                self._offsets[key] = [0]
+            self._writers[key].append(value.ravel())
+            self._offsets[key].append(self._offsets[key][-1] + value.size)
+        self.nframes += 1
+
+    def close(self):
+        """Close files and save the metadata."""
+        for writer in self._writers.values():
+            writer.close()
+        keys = list(self._writers)
+        arrays: Dict[str, Any] = {
+            "stat": np.array(self.stat, dtype=np.int64),
+            "nframes": self.nframes,
+            "keys": np.array(keys),
+            "dtypes": np.array([self._writers[key].dtype.str for key in keys]),
+        }
+        for key, offsets in self._offsets.items():
+            arrays[f"offsets_{key}"] = np.array(offsets, dtype=np.int64)
+        np.savez(f"{self.prefix}.npz", **arrays)
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, exc_type, *args):
+        """Save the cache when exiting the context without errors."""
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self._writers.values():
+                writer.close()
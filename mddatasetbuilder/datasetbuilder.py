@@ -15,9 +15,13 @@ __date__ = "2018-07-18"
 
 import argparse
 import gc
+import glob
+import io
 import itertools
+import json
 import os
 import pickle
+import shutil
 import tempfile
 import time
 from collections import Counter, defaultdict
@@ -26,20 +30,22 @@ from typing import List, Optional
 import numpy as np
 from ase.atoms import Atoms
 from ase.data import atomic_numbers
-from ase.io import write as write_xyz
-from sklearn import preprocessing
-from sklearn.cluster import MiniBatchKMeans
+from threadpoolctl import threadpool_limits
+from tqdm.auto import tqdm
 
+from . import profiler
 from ._logger import logger
 from ._version import version as __version__
-from .detect import Detect, DetectDump
-from .utils import (
-    bytestolist,
-    listtobytes,
-    must_be_list,
-    read_compressed_block,
-    run_mp,
-)
+from .archive import Archive, appendmembers
+from .cache import CacheWriter, TrajectoryCache
+from .deepmd import DeePMDWriter
+from .detect import Detect, DetectBinaryDump, DetectDump
+from .features import DiskFeatureMatrix, FeatureMatrix, coulumbspectra
+from .frameindex import BinaryFrame, FrameIndex, decodeframe
+from .manifest import Manifest, fileinfo
+from .molecule import MoleculeIndex
+from .neighbor import NeighborList
+from .utils import ArrayWriter, WorkerPool, must_be_list, read_array, run_mp
 
 
 class DatasetBuilder:
@@ -83,6 +89,77 @@ class DatasetBuilder:
         if the atomic model deviation is less than this value.
     atom_pref: bool, optional, default=False
         (Deprecated) Generator atom_pref information for each cluster.
+    bondbackend: {"openbabel", "native"}, optional, default="openbabel"
+        The backend to perceive bonds from the dump file when the bond file is
+        not given. "native" follows the rules of Open Babel and is much faster,
+        but its bond orders are not equivalent to Open Babel's, as aromatic
+        rings and most functional groups are not perceived. Thus bond types,
+        and the selected structures, may differ between backends.
+    clusterchunksize: int, optional, default=None
+        The number of atoms in each chunk for streaming clustering. If given,
+        the features are stored on the disk and clustered chunk by chunk, so
+        the memory is bounded by the chunk size. If None (default), the
+        features are kept in memory: as all bond types are calculated in one
+        pass, the peak memory covers the features of all bond types, and each
+        matrix is released once its bond type is clustered.
+    workdir: str, optional, default=None
+        The directory to keep intermediate files. If None (default), a temporary
+        directory is used and removed after the dataset is built.
+    resume: bool, optional, default=False
+        Resume from `workdir`, skipping the steps (and bond types in step 2)
+        finished in the last run. Finished work is redone if the input files
+        or the parameters it depends on have changed.
+    maxworkermemory: float, optional, default=None
+        The maximum resident memory of each worker process in MiB. Worker
+        processes are kept for the whole run, and are restarted between stages
+        if any of them exceeds it. If None (default), they are never restarted.
+    maxinflight: float, optional, default=1024.
+        The memory budget in MiB of the frames sent to worker processes but
+        not finished yet. The number of frames in flight and the number of
+        frames in each task are chosen from it and the size of frames.
+    output: {"dir", "tar", "deepmd/npy", "deepmd/hdf5"}, optional, default="dir"
+        The output format. "dir" writes one file per structure to folders of
+        1000 files in `dataset_dir` (xyz) and `gjfdir` (gjf). "tar" appends
+        the same files to a few tar shards in `dataset_dir`, one for each
+        worker process, with an index. The GJF files are also in these shards
+        instead of `gjfdir`, so `qmcalc` and `preparedeepmd` are given
+        `dataset_dir` and read the shards directly, and `mddatasetbuilder.archive.Archive.export` writes
+        them to the directory layout. "deepmd/npy" and "deepmd/hdf5" write
+        the unlabeled structures to DeePMD-kit data grouped by formula, in
+        `dataset_dir` or `{dataset_dir}.hdf5`, without any text files.
+    cachedir: str, optional, default=None
+        The directory of the binary trajectory cache. If given, the dump and
+        bond files are converted to binary arrays in this directory once, and
+        all steps read frames from memory-mapped arrays instead of parsing
+        text. The cache is reused by later runs on the same files, e.g. with
+        a different `n_clusters` or `cutoff`, and is rebuilt if the files have
+        been modified. If None (default), frames are parsed from text files.
+    dumpformat: {"text", "binary"}, optional, default="text"
+        The format of the dump file. "binary" reads the LAMMPS binary dump,
+        which is written by LAMMPS when the filename ends with ".bin".
+    dumpcolumns: list of strs, optional, default=None
+        The columns of the binary dump file, such as ["id", "type", "x", "y",
+        "z"]. If None (default), the columns are read from the file, which
+        requires the binary dump written by LAMMPS 2019 or later.
+    shard: tuple (index, count), optional, default=None
+        Run only a shard of the trajectory, e.g. on one of `count` nodes.
+        Shards are assigned contiguous blocks of whole files, so the
+        trajectory should be given as at least `count` dump (and bond and
+        model deviation) files, and each shard only reads its own files. The
+        shard `index` (from 0) runs step 1 and calculates the features of its
+        frames, which are written to `{dataset_dir}_shards/{index}`. After all
+        shards finish, `mergeshards` clusters the features of all shards and
+        writes the dataset. Shards only communicate through the shared file
+        system. If None (default), the whole dataset is built by
+        `builddataset`.
+    profile: str, optional, default=None
+        The filename of the profiling report. If given, the time and calls of
+        functions (such as parsing, bond perception, neighbor search, `eigh`
+        and k-means), the bytes read and written, frames per second, the
+        items in flight and the peak resident memory of each stage, including
+        those of worker processes, are written to it as JSON, and a summary
+        is logged at the end of the run. If None (default), the run is not
+        profiled.
     """
 
     def __init__(
@@ -103,17 +180,37 @@ class DatasetBuilder:
         errorfilename: Optional[List[str]] = None,
         errorlimit=0.0,
         atom_pref=False,
+        bondbackend="openbabel",
+        clusterchunksize=None,
+        workdir=None,
+        resume=False,
+        maxworkermemory=None,
+        maxinflight=1024.0,
+        output="dir",
+        cachedir=None,
+        dumpformat="text",
+        dumpcolumns=None,
+        shard=None,
+        profile=None,
     ):
         """Init the builder."""
         print(__doc__)
         print(f"Author:{__author__}  Email:{__email__}")
         atomname = np.array(atomname) if atomname else np.array(["C", "H", "O"])
-        self.crddetector = Detect.gettype("dump")(
+        if dumpformat == "text":
+            dumpkwargs = {}
+        elif dumpformat == "binary":
+            dumpkwargs = {"columns": dumpcolumns}
+        else:
+            raise RuntimeError(f"Unsupported dump format: {dumpformat}")
+        self.crddetector = (DetectDump if dumpformat == "text" else DetectBinaryDump)(
             filename=dumpfilename,
             atomname=atomname,
             pbc=pbc,
             errorfilename=errorfilename,
             errorlimit=errorlimit,
+            bondbackend=bondbackend,
+            **dumpkwargs,
         )
         if bondfilename is None:
             self.bonddetector = self.crddetector
@@ -134,7 +231,7 @@ class DatasetBuilder:
                 self.nproc = len(os.sched_getaffinity(0))
             except AttributeError:
                 # macos and windows
-                self.nproc = os.cpu_count()
+                self.nproc = os.cpu_count() or 1
         self.cutoff = cutoff
         self.n_clusters = n_clusters
         self.n_each = n_each
@@ -142,6 +239,7 @@ class DatasetBuilder:
         self.gjfdir = f"{self.dataset_dir}_gjf"
         self.qmkeywords = must_be_list(qmkeywords)
         self.fragment = fragment
+        self._typeindex = {symbol: i for i, symbol in enumerate(atomname)}
         self._coulumbdiag = {
             symbol: atomic_numbers[symbol] ** 2.4 / 2 for symbol in atomname
         }
@@ -149,6 +247,59 @@ class DatasetBuilder:
         self.bondtyperestore = {}
         self.errorfilename = errorfilename
         self.atom_pref = atom_pref
+        self._trajatom_dir: Optional[str] = None
+        self.clusterchunksize = clusterchunksize
+        if resume and workdir is None:
+            raise RuntimeError("workdir should be given to resume")
+        self.workdir = workdir
+        self.resume = resume
+        self._errorlimit = errorlimit
+        self._pbc = pbc
+        self._bondbackend = bondbackend
+        self._dumpformat = dumpformat
+        self._dumpcolumns = dumpcolumns
+        self.workers = WorkerPool(
+            self.nproc,
+            maxmemory=int(maxworkermemory * 2**20) if maxworkermemory else None,
+            tmpdir=workdir,
+        )
+        self.maxinflight = int(maxinflight * 2**20)
+        if output not in ("dir", "tar", "deepmd/npy", "deepmd/hdf5"):
+            raise RuntimeError(f"Unsupported output format: {output}")
+        self.output = output
+        self.cachedir = cachedir
+        if shard is not None:
+            shard = tuple(shard)
+            if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+                raise RuntimeError(f"Invalid shard: {shard}")
+        self.shard = shard
+        if shard is not None:
+            nfiles = len(must_be_list(self.bonddetector.filename))
+            if shard[1] > nfiles:
+                raise RuntimeError(
+                    f"{shard[1]} shards are given, but only {nfiles} files; "
+                    "shards are assigned whole files"
+                )
+            if len(must_be_list(self.crddetector.filename)) != nfiles or (
+                errorfilename is not None and len(must_be_list(errorfilename)) != nfiles
+            ):
+                raise RuntimeError(
+                    "The dump, bond and model deviation files should be paired "
+                    "to run in shards"
+                )
+        self.sharddir = f"{self.dataset_dir}_shards"
+        self.profile = profile
+
+    @property
+    def trajatom_dir(self) -> str:
+        """The directory of intermediate files, which is set during a build."""
+        if self._trajatom_dir is None:
+            raise RuntimeError("trajatom_dir is only set during a build")
+        return self._trajatom_dir
+
+    @trajatom_dir.setter
+    def trajatom_dir(self, value: Optional[str]):
+        self._trajatom_dir = value
 
     def builddataset(self, writegjf=True):
         """Build a dataset.
@@ -159,41 +310,290 @@ class DatasetBuilder:
             Write gjf files.
         """
         self.writegjf = writegjf
+        # worker processes are shared by all steps
+        with profiler.session(self.profile), self.workers:
+            if self.workdir is None:
+                with tempfile.TemporaryDirectory() as self.trajatom_dir:
+                    self._runsteps()
+            else:
+                self.trajatom_dir = self.workdir
+                os.makedirs(self.trajatom_dir, exist_ok=True)
+                manifest = Manifest(self.trajatom_dir, self._manifestparameters())
+                if self.resume:
+                    manifest.load()
+                self._runsteps(manifest)
+
+    def mergeshards(self, writegjf=True):
+        """Build a dataset from the outputs of all shards.
+
+        The builder should have the same inputs and parameters as the shards
+        (except `shard` and the parameters of step 3). The features of each
+        bond type in all shards are clustered, and the selected structures
+        are written as step 3 of `builddataset`.
+
+        Parameters
+        ----------
+        writegjf : bool, optional, default=True
+            Write gjf files.
+        """
+        self.writegjf = writegjf
+        shards = self._loadshards()
+        if self.workdir is not None:
+            os.makedirs(self.workdir, exist_ok=True)
+        with profiler.session(self.profile), self.workers:
+            with tempfile.TemporaryDirectory(dir=self.workdir) as self.trajatom_dir:
+                with profiler.stage("merge"):
+                    self._mergefeatures(shards)
+                with profiler.stage("step 3"):
+                    if self.output != "deepmd/hdf5":
+                        # the HDF5 file is the dataset itself
+                        os.makedirs(self.dataset_dir, exist_ok=True)
+                    if self.writegjf and self.output == "dir":
+                        os.makedirs(self.gjfdir, exist_ok=True)
+                    self._writexyzfiles()
+
+    def _mergefeatures(self, shards):
+        """Cluster the features of all shards and write the selected atoms.
+
+        Parameters
+        ----------
+        shards : list of tuples (directory, metadata)
+            The output directory and the metadata of each shard.
+        """
+        self.atombondtype = list(
+            dict.fromkeys(
+                trajatomfilename
+                for _, metadata in shards
+                for trajatomfilename in metadata["atombondtype"]
+            )
+        )
+        # steps of a shard are counted from its first file
+        starts = np.cumsum([0] + [metadata["nstep"] for _, metadata in shards])
+        self._nstep = int(starts[-1])
+        stepatoms = []
+        stores = {}
+        for itype, trajatomfilename in enumerate(self.atombondtype):
+            parts = []
+            for (directory, metadata), start in zip(shards, starts):
+                if trajatomfilename in metadata["atombondtype"]:
+                    part = DiskFeatureMatrix.load(
+                        os.path.join(directory, f"features.{trajatomfilename}"),
+                        self._coulumbdiag,
+                    )
+                    part.stepatom[:, 0] += start
+                    parts.append(part)
+            n_atoms = sum(part.n for part in parts)
+            if n_atoms > self.n_clusters:
+                stores[itype] = DiskFeatureMatrix(
+                    n_atoms,
+                    self._coulumbdiag,
+                    os.path.join(self.trajatom_dir, f"features.{trajatomfilename}"),
+                )
+                for part in parts:
+                    stores[itype].extend(part)
+                stepatoms.append(None)
+            else:
+                stepatoms.append(np.concatenate([part.stepatom for part in parts]))
+        self._nstructure = 0
+        with open(os.path.join(self.trajatom_dir, "chooseatoms"), "wb") as f:
+            self._choosestructures(f, stepatoms, stores)
+
+    def _shardparameters(self):
+        """Return the inputs and parameters that the outputs of shards depend on.
+
+        Returns
+        -------
+        dict
+            The parameters.
+        """
+        parameters = dict(self._manifestparameters()[0], cutoff=self.cutoff)
+        parameters.pop("shard", None)
+        return json.loads(json.dumps(parameters))
+
+    def _loadshards(self):
+        """Load the metadata of all shards.
+
+        Returns
+        -------
+        list of tuples (directory, metadata)
+            The output directory and the metadata of each shard.
+
+        Raises
+        ------
+        RuntimeError
+            If any shard is not finished, or shards have different inputs or
+            parameters.
+        """
+        shards = {}
+        for path in glob.glob(os.path.join(self.sharddir, "*", "shard.json")):
+            with open(path) as f:
+                metadata = json.load(f)
+            shards[metadata["shard"][0]] = (os.path.dirname(path), metadata)
+        if not shards:
+            raise RuntimeError(f"No finished shard in {self.sharddir}")
+        count = next(iter(shards.values()))[1]["shard"][1]
+        parameters = self._shardparameters()
+        for directory, metadata in shards.values():
+            if metadata["shard"][1] != count:
+                raise RuntimeError(
+                    f"Shards in {self.sharddir} have different numbers of shards"
+                )
+            if metadata["parameters"] != parameters:
+                raise RuntimeError(
+                    f"The shard in {directory} has different inputs or parameters"
+                )
+        missing = sorted(set(range(count)) - set(shards))
+        if missing:
+            raise RuntimeError(f"Shards {missing} of {count} are not finished")
+        return [shards[index] for index in range(count)]
+
+    def _runsteps(self, manifest=None):
+        """Run the three steps in `trajatom_dir`.
+
+        If `shard` is given, only step 1 and the features of step 2 are run,
+        and the outputs are written by `_writeshard`.
+
+        Parameters
+        ----------
+        manifest : mddatasetbuilder.manifest.Manifest, optional, default=None
+            The manifest of the work directory. Finished steps in the manifest
+            are skipped. If None (default), all steps are run.
+        """
         timearray = [time.time()]
-        with tempfile.TemporaryDirectory() as self.trajatom_dir:
-            for runstep in range(3):
+        if self.cachedir is not None:
+            # convert files before the steps, as the conversion also runs in
+            # workers and cannot be nested in the frames sent to a step
+            with profiler.stage("cache"):
+                for detector in dict.fromkeys((self.crddetector, self.bonddetector)):
+                    self.caches(detector)
+        for runstep in range(3 if self.shard is None else 2):
+            if manifest is not None and runstep < len(manifest.stages):
+                self._restorestep(runstep, manifest.stages[runstep])
+                timearray.append(time.time())
+                logger.info(f"Step {len(timearray) - 1} has been done. Skipped.")
+                continue
+            with profiler.stage(f"step {runstep + 1}"):
                 if runstep == 0:
                     self._readtimestepsbond()
+                elif runstep == 1 and self.shard is not None:
+                    self._writeshard(*self.shard)
                 elif runstep == 1:
                     with open(
-                        os.path.join(self.trajatom_dir, "chooseatoms"), "wb"
+                        os.path.join(self.trajatom_dir, "chooseatoms"), "ab"
                     ) as f:
-                        for bondtype in self.atombondtype:
-                            self._writecoulumbmatrix(bondtype, f)
-                            gc.collect()
+                        self._writecoulumbmatrix(f, manifest)
                 elif runstep == 2:
-                    os.makedirs(self.dataset_dir, exist_ok=True)
-                    if self.writegjf:
+                    if self.output != "deepmd/hdf5":
+                        # the HDF5 file is the dataset itself
+                        os.makedirs(self.dataset_dir, exist_ok=True)
+                    if self.writegjf and self.output == "dir":
                         os.makedirs(self.gjfdir, exist_ok=True)
                     self._writexyzfiles()
-                gc.collect()
-                timearray.append(time.time())
-                logger.info(
-                    f"Step {len(timearray)-1} Done! Time consumed (s): {timearray[-1]-timearray[-2]:.3f}"
-                )
+            if manifest is not None:
+                manifest.complete(self._stepstate(runstep))
+            gc.collect()
+            timearray.append(time.time())
+            logger.info(
+                f"Step {len(timearray) - 1} Done! Time consumed (s): {timearray[-1] - timearray[-2]:.3f}"
+            )
+
+    def _manifestparameters(self):
+        """Return the inputs and parameters that each step depends on.
+
+        Returns
+        -------
+        list of dicts
+            The parameters of each step.
+        """
+        filenames = must_be_list(self.crddetector.filename)
+        if self.bonddetector is not self.crddetector:
+            filenames = filenames + must_be_list(self.bonddetector.filename)
+        if self.errorfilename is not None:
+            filenames = filenames + must_be_list(self.errorfilename)
+        parameters = [
+            {
+                "inputs": fileinfo(filenames),
+                "bondfile": self.bonddetector is not self.crddetector,
+                "atomname": [str(x) for x in self.crddetector.atomname],
+                "stepinterval": self.stepinterval,
+                "errorlimit": self._errorlimit,
+                "pbc": bool(self._pbc),
+                "bondbackend": self._bondbackend,
+                "dumpformat": self._dumpformat,
+                "dumpcolumns": self._dumpcolumns,
+                "cachedir": self.cachedir,
+            },
+            {
+                "cutoff": self.cutoff,
+                "n_clusters": self.n_clusters,
+                "n_each": self.n_each,
+                "clusterchunksize": self.clusterchunksize,
+            },
+            {
+                "dataset_dir": self.dataset_dir,
+                "writegjf": self.writegjf,
+                "qmkeywords": self.qmkeywords,
+                "fragment": self.fragment,
+                "atom_pref": self.atom_pref,
+                "output": self.output,
+            },
+        ]
+        if self.shard is not None:
+            parameters[0]["shard"] = list(self.shard)
+        return parameters
+
+    def _stepstate(self, runstep):
+        """Return the state of a finished step needed by the following steps.
+
+        Parameters
+        ----------
+        runstep : int
+            The step.
+
+        Returns
+        -------
+        dict
+            The state.
+        """
+        if runstep == 0:
+            return {"atombondtype": self.atombondtype, "nstep": self._nstep}
+        if runstep == 1:
+            return {"nstructure": self._nstructure}
+        return {}
+
+    def _restorestep(self, runstep, state):
+        """Restore the state of a finished step.
+
+        Parameters
+        ----------
+        runstep : int
+            The step.
+        state : dict
+            The state returned by `_stepstate`.
+        """
+        if runstep == 0:
+            self.atombondtype = state["atombondtype"]
+            self._nstep = state["nstep"]
+        elif runstep == 1:
+            self._nstructure = state["nstructure"]
 
     def _readtimestepsbond(self):
         """Read and store the bond of each atom in each frame."""
         # added on 2018-12-15
         stepatomfiles = {}
         os.makedirs(self.trajatom_dir, exist_ok=True)
+        frames = self.lineiter(self.bonddetector, raw=True)
+        if self.errorfilename is not None:
+            frames = zip(frames, self.erroriter())
+        frames = enumerate(frames)
         results = run_mp(
             self.nproc,
-            func=self.bonddetector.readatombondtype,
-            l=zip(self.lineiter(self.bonddetector), self.erroriter())
-            if self.errorfilename is not None
-            else self.lineiter(self.bonddetector),
-            return_num=True,
+            func="readatombondtype",
+            state=self.bonddetector,
+            pool=self.workers,
+            maxinflight=self.maxinflight,
+            l=frames,
+            shared=True,
             extra=self.errorfilename is not None,
             desc="Read trajectory",
             unit="timestep",
@@ -204,81 +604,298 @@ class DatasetBuilder:
                 bondtype = self._bondtype(bondtypebytes)
                 if bondtype not in self.atombondtype:
                     self.atombondtype.append(bondtype)
-                    stepatomfiles[bondtype] = open(
-                        os.path.join(self.trajatom_dir, f"stepatom.{bondtype}"), "wb"
+                    stepatomfiles[bondtype] = ArrayWriter(
+                        os.path.join(self.trajatom_dir, f"stepatom.{bondtype}"), 2
                     )
-                stepatomfiles[bondtype].write(listtobytes([step, atomids]))
+                rows = np.empty((len(atomids), 2), dtype=np.int32)
+                rows[:, 0] = step
+                rows[:, 1] = atomids
+                stepatomfiles[bondtype].append(rows)
             nstep += 1
         self._nstep = nstep
         for stepatomfile in stepatomfiles.values():
             stepatomfile.close()
 
-    def _writecoulumbmatrix(self, trajatomfilename, fc):
+    def _writecoulumbmatrix(self, fc, manifest=None):
         """Write Coulumb matrix.
 
+        All bond types are processed in a single pass over the trajectory: the
+        Coulumb matrices of all selected atoms in a frame are calculated at once,
+        and are then sent to the feature store of their bond type. Hence the
+        feature stores of all bond types are alive together until clustering;
+        only the disk stores of `clusterchunksize` bound the memory.
+
         Parameters
         ----------
-        trajatomfilename : str
-            The name of the bond, for example, C1111.
         fc : File object
-            The File object for storing selected atoms.
-        """
-        self.dstep = {}
-        with open(
-            os.path.join(self.trajatom_dir, f"stepatom.{trajatomfilename}"), "rb"
-        ) as f:
-            for line in read_compressed_block(f):
-                s = bytestolist(line)
-                self.dstep[s[0]] = s[1]
-        n_atoms = sum(map(len, self.dstep.values()))
-        if n_atoms > self.n_clusters:
-            # undersampling
-            max_counter = Counter()
-            stepatom = np.zeros((n_atoms, 2), dtype=int)
-            feedvector = np.zeros((n_atoms, 0))
-            vector_elements = defaultdict(list)
+            The File object for storing selected atoms, opened in the append
+            mode.
+        manifest : mddatasetbuilder.manifest.Manifest, optional, default=None
+            The manifest to save a checkpoint after each bond type. Bond types
+            finished in its progress are skipped.
+        """
+        progress = manifest.progress if manifest is not None else {}
+        ntype = progress.get("ntype", 0)
+        self._nstructure = progress.get("nstructure", 0)
+        fc.truncate(progress.get("offset", 0))
+        stepatoms = []
+        stores = {}
+        # rows of (step, atom ID) to calculate features
+        featureatoms = {}
+        for itype, trajatomfilename in enumerate(self.atombondtype):
+            if itype < ntype:
+                stepatoms.append(None)
+                continue
+            # rows of (step, atom ID)
+            stepatom = read_array(
+                os.path.join(self.trajatom_dir, f"stepatom.{trajatomfilename}"), 2
+            )
+            n_atoms = len(stepatom)
+            if n_atoms > self.n_clusters:
+                # undersampling
+                if self.clusterchunksize:
+                    stores[itype] = DiskFeatureMatrix(
+                        n_atoms,
+                        self._coulumbdiag,
+                        os.path.join(self.trajatom_dir, f"features.{trajatomfilename}"),
+                    )
+                else:
+                    stores[itype] = FeatureMatrix(n_atoms, self._coulumbdiag)
+                featureatoms[itype] = stepatom
+                stepatoms.append(None)
+            else:
+                stepatoms.append(stepatom)
+        self._calcfeatures(stores, featureatoms)
+        self._choosestructures(fc, stepatoms, stores, ntype, manifest)
+
+    def _writeshard(self, index, count):
+        """Calculate and write the features of all atoms in the shard.
+
+        Whether a bond type is clustered depends on its atoms in all shards,
+        so the features of all bond types are written to `sharddir`, and the
+        metadata is written last to mark the shard as finished.
+
+        Parameters
+        ----------
+        index : int
+            The index of the shard.
+        count : int
+            The number of shards.
+        """
+        directory = os.path.join(self.sharddir, str(index))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        stores = {}
+        featureatoms = {}
+        for itype, trajatomfilename in enumerate(self.atombondtype):
+            stepatom = read_array(
+                os.path.join(self.trajatom_dir, f"stepatom.{trajatomfilename}"), 2
+            )
+            stores[itype] = DiskFeatureMatrix(
+                len(stepatom),
+                self._coulumbdiag,
+                os.path.join(directory, f"features.{trajatomfilename}"),
+            )
+            featureatoms[itype] = stepatom
+        self._calcfeatures(stores, featureatoms)
+        for store in stores.values():
+            store.save()
+        with open(os.path.join(directory, "shard.json"), "w") as f:
+            json.dump(
+                {
+                    "shard": [index, count],
+                    "atombondtype": self.atombondtype,
+                    "nstep": self._nstep,
+                    "parameters": self._shardparameters(),
+                },
+                f,
+            )
+        logger.info(f"Shard {index} of {count} is written to {directory}")
+
+    def _calcfeatures(self, stores, featureatoms):
+        """Calculate the features of atoms in a single pass over the trajectory.
+
+        Parameters
+        ----------
+        stores : dict of mddatasetbuilder.features.FeatureMatrix
+            The feature store of each bond type.
+        featureatoms : dict of numpy.ndarray
+            The rows of (step, atom ID) of each bond type in `stores`.
+        """
+        # self.dstep[step] contains a list of tuples (atoma, itype)
+        self.dstep = defaultdict(list)
+        for itype, stepatom in featureatoms.items():
+            stepatom = stepatom[np.argsort(stepatom[:, 0], kind="stable")]
+            steps, starts = np.unique(stepatom[:, 0], return_index=True)
+            for step, atoms in zip(
+                steps.tolist(), np.split(stepatom[:, 1], starts[1:])
+            ):
+                self.dstep[step].extend((atoma, itype) for atoma in atoms.tolist())
+        if stores:
             results = run_mp(
                 self.nproc,
-                func=self._writestepmatrix,
-                l=self.lineiter(self.crddetector),
-                return_num=True,
-                total=self._nstep,
-                desc=trajatomfilename,
+                func="_writestepmatrix",
+                state=self,
+                pool=self.workers,
+                maxinflight=self.maxinflight,
+                l=self.lineiter(self.crddetector, steps=list(self.dstep), raw=True),
+                shared=True,
+                total=len(self.dstep),
+                desc="Coulumb matrix",
                 unit="timestep",
             )
-            j = 0
             for result in results:
-                for stepatoma, vector, symbols_counter in result:
-                    stepatom[j] = stepatoma
-                    for element in (symbols_counter - max_counter).elements():
-                        vector_elements[element].append(feedvector.shape[1])
-                        feedvector = np.pad(
-                            feedvector,
-                            ((0, 0), (0, 1)),
-                            "constant",
-                            constant_values=(0, self._coulumbdiag[element]),
+                for itype, stepatoma, vector, symbols_counter in result:
+                    stores[itype].append(stepatoma, vector, symbols_counter)
+
+    def _choosestructures(self, fc, stepatoms, stores, ntype=0, manifest=None):
+        """Cluster bond types with features and write the selected atoms.
+
+        Parameters
+        ----------
+        fc : File object
+            The File object for storing selected atoms, opened in the append
+            mode.
+        stepatoms : list of numpy.ndarray or None
+            The rows of (step, atom ID) of each bond type, which are all
+            selected. None for bond types in `stores` or skipped.
+        stores : dict of mddatasetbuilder.features.FeatureMatrix
+            The feature store of each bond type to cluster.
+        ntype : int, optional, default=0
+            The number of bond types finished in the last run, which are
+            skipped.
+        manifest : mddatasetbuilder.manifest.Manifest, optional, default=None
+            The manifest to save a checkpoint after each bond type.
+        """
+        jobs = []
+        parallel = self.nproc > 1 and len(stores) > 1
+        for itype, trajatomfilename in enumerate(self.atombondtype):
+            if itype in stores:
+                store = stores.pop(itype)
+                logger.info(f"Max counter of {trajatomfilename} is {store.max_counter}")
+                stepatoms[itype] = store.stepatom[: store.n]
+                if self.clusterchunksize:
+                    store.close()
+                    features = store
+                elif parallel:
+                    # workers load the features from the disk
+                    features = os.path.join(
+                        self.trajatom_dir, f"features.{trajatomfilename}.npy"
+                    )
+                    np.save(features, store.assemble())
+                else:
+                    features = store.assemble()
+                jobs.append((itype, features, store.n))
+                del store
+                gc.collect()
+        clustering = {job[0] for job in jobs}
+        clustered = self._clusterbondtypes(jobs, parallel)
+        choosed = {}
+        for itype, trajatomfilename in enumerate(self.atombondtype):
+            if itype < ntype:
+                continue
+            stepatom = stepatoms[itype]
+            if itype in clustering:
+                # results are written in the order of bond types
+                while itype not in choosed:
+                    k, index = next(clustered)
+                    choosed[k] = index
+                choosedindexs = choosed.pop(itype)
+            else:
+                choosedindexs = range(len(stepatom))
+            chooseatoms = np.empty((len(choosedindexs), 3), dtype=np.int32)
+            chooseatoms[:, :2] = stepatom[choosedindexs]
+            chooseatoms[:, 2] = itype
+            fc.write(chooseatoms.tobytes())
+            profiler.count("write_bytes", chooseatoms.nbytes)
+            self._nstructure += len(choosedindexs)
+            if manifest is not None:
+                fc.flush()
+                manifest.checkpoint(
+                    {
+                        "ntype": itype + 1,
+                        "nstructure": self._nstructure,
+                        "offset": fc.tell(),
+                    }
+                )
+        clustered.close()
+
+    def _clusterbondtypes(self, jobs, parallel):
+        """Cluster bond types, the largest first.
+
+        Parameters
+        ----------
+        jobs : list of tuples (itype, features, n_atoms)
+            itype: int
+                The index of the bond type.
+            features: numpy.ndarray, str or mddatasetbuilder.features.FeatureMatrix
+                The features, the filename of the saved features, or the feature
+                store for streaming clustering.
+            n_atoms: int
+                The number of atoms.
+        parallel : bool
+            Run jobs in the worker processes. The threads of BLAS and OpenMP are
+            divided among the jobs running at the same time.
+
+        Yields
+        ------
+        itype: int
+            The index of the bond type.
+        index: numpy.ndarray
+            The selected index.
+        """
+        jobs.sort(key=lambda job: job[2], reverse=True)
+        filenames = [
+            features if isinstance(features, str) else features.filename
+            for _, features, _ in jobs
+            if isinstance(features, (str, DiskFeatureMatrix))
+        ]
+        try:
+            if parallel:
+                nworkers = min(self.nproc, len(jobs))
+                nthreads = max(1, self.nproc // nworkers)
+                logger.info(
+                    f"Cluster {len(jobs)} bond types with {nworkers} processes and "
+                    f"{nthreads} threads each"
+                )
+                tasks = [
+                    (
+                        itype,
+                        features,
+                        self.n_clusters,
+                        self.n_each,
+                        self.clusterchunksize,
+                        nthreads,
+                    )
+                    for itype, features, _ in jobs
+                ]
+                yield from tqdm(
+                    self.workers.imap_unordered(
+                        self.workers.bind(_clusterbondtype), tasks
+                    ),
+                    desc="Clustering",
+                    unit="bond type",
+                    total=len(tasks),
+                    disable=None,
+                )
+            else:
+                while jobs:
+                    # release the features once clustered
+                    itype, features, _ = jobs.pop(0)
+                    yield _clusterbondtype(
+                        (
+                            itype,
+                            features,
+                            self.n_clusters,
+                            self.n_each,
+                            self.clusterchunksize,
+                            None,
                         )
-                    feedvector[
-                        j,
-                        sum(
-                            (
-                                vector_elements[x[0]][: x[1]]
-                                for x in symbols_counter.items()
-                            ),
-                            [],
-                        ),
-                    ] = vector
-                    max_counter |= symbols_counter
-                    j += 1
-            logger.info(f"Max counter of {trajatomfilename} is {max_counter}")
-            choosedindexs = self._clusterdatas(
-                np.sort(feedvector), n_clusters=self.n_clusters, n_each=self.n_each
-            )
-        else:
-            stepatom = np.array([[u, vv] for u, v in self.dstep.items() for vv in v])
-            choosedindexs = range(n_atoms)
-        fc.write(listtobytes(stepatom[choosedindexs]))
-        self._nstructure += len(choosedindexs)
+                    )
+                    del features
+        finally:
+            for filename in filenames:
+                os.remove(filename)
 
     def _writestepmatrix(self, item):
         """Calculate Coulumb atoms for each atom.
@@ -294,7 +911,9 @@ class DatasetBuilder:
         Returns
         -------
         results: list of tuples
-            The tuple (stepatoma, columbmatrix, symbols) contains:
+            The tuple (itype, stepatoma, columbmatrix, symbols) contains:
+                itype: int
+                    The index of the bond type.
                 stepatoma: numpy.ndarray (2,)
                     Contains two elements: step and atom ID.
                 columbmatrix: numpy.ndarray (N,)
@@ -307,19 +926,21 @@ class DatasetBuilder:
         if step in self.dstep:
             assert isinstance(self.crddetector, DetectDump)
             step_atoms, _ = self.crddetector.readcrd(lines)
-            for atoma in self.dstep[step]:
-                # atom ID starts from 1
-                distances = step_atoms.get_distances(
-                    atoma - 1, range(len(step_atoms)), mic=True
-                )
-                cutoffatoms = step_atoms[distances < self.cutoff]
-                assert isinstance(cutoffatoms, Atoms)
-                symbols = cutoffatoms.get_chemical_symbols()
+            # atom ID starts from 1
+            neighbors = NeighborList(step_atoms, self.cutoff).query(
+                [atoma - 1 for atoma, _ in self.dstep[step]]
+            )
+            spectra = coulumbspectra(step_atoms, neighbors, self._coulumbdiag)
+            symbols = np.array(step_atoms.get_chemical_symbols())
+            for (atoma, itype), cutoffatomid, eigvals in zip(
+                self.dstep[step], neighbors, spectra
+            ):
                 results.append(
                     (
+                        itype,
                         np.array([step, atoma]),
-                        self._calcoulumbmatrix(cutoffatoms),
-                        Counter(symbols),
+                        eigvals,
+                        Counter(symbols[cutoffatomid].tolist()),
                     )
                 )
         return results
@@ -337,18 +958,10 @@ class DatasetBuilder:
         numpy.darray (N,)
             The eigenvalues of columb matrix.
         """
-        # https://github.com/crcollins/molml/blob/master/molml/utils.py
-        top = np.outer(atoms.numbers, atoms.numbers).astype(np.float64)
-        r = atoms.get_all_distances(mic=True)
-        diag = np.array(list(map(self._coulumbdiag.get, atoms.get_chemical_symbols())))
-        with np.errstate(divide="ignore", invalid="ignore"):
-            np.divide(top, r, top)
-            np.fill_diagonal(top, diag)
-        top[top == np.Infinity] = 0
-        top[np.isnan(top)] = 0
-        return np.linalg.eigh(top)[0]
+        return coulumbspectra(atoms, [np.arange(len(atoms))], self._coulumbdiag)[0]
 
     @classmethod
+    @profiler.timed("kmeans")
     def _clusterdatas(cls, X, n_clusters, n_each=1):
         """Select data using Mini Batch Kmeans.
 
@@ -366,6 +979,9 @@ class DatasetBuilder:
         numpy.ndarray
             The selected index.
         """
+        from sklearn import preprocessing
+        from sklearn.cluster import MiniBatchKMeans
+
         min_max_scaler = preprocessing.MinMaxScaler()
         X = np.array(min_max_scaler.fit_transform(X))
         clus = MiniBatchKMeans(
@@ -374,6 +990,78 @@ class DatasetBuilder:
             n_init=3,  # type: ignore
         )
         labels = clus.fit_predict(X)
+        return cls._chooselabels(labels, n_clusters, n_each)
+
+    @classmethod
+    @profiler.timed("kmeans")
+    def _clusterdatastream(cls, store, n_clusters, n_each=1, chunksize=65536):
+        """Select data using Mini Batch Kmeans chunk by chunk.
+
+        The features are read three times: the minimum and maximum are found
+        first, then the model is fitted with `partial_fit`, and the labels are
+        assigned at last. Only one chunk is kept in memory at a time.
+
+        Parameters
+        ----------
+        store : mddatasetbuilder.features.FeatureMatrix
+            The features.
+        n_clusters : int
+            The number of clusters.
+        n_each : int, optional, default=1
+            The number of structures in each cluster.
+        chunksize : int, optional, default=65536
+            The number of atoms in each chunk. It should be no less than the
+            number of clusters, otherwise the number of clusters is used.
+
+        Returns
+        -------
+        numpy.ndarray
+            The selected index.
+        """
+        from sklearn import preprocessing
+        from sklearn.cluster import MiniBatchKMeans
+
+        chunksize = max(chunksize, n_clusters)
+        min_max_scaler = preprocessing.MinMaxScaler()
+        for X in store.iterchunks(chunksize):
+            min_max_scaler.partial_fit(X)
+        clus = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            init_size=(min(3 * n_clusters, store.n)),
+            n_init=3,  # type: ignore
+        )
+        for ii, X in enumerate(store.iterchunks(chunksize)):
+            X = min_max_scaler.transform(X)
+            # the first chunk is used to initialize the centers
+            batchsize = len(X) if ii == 0 else clus.batch_size
+            for start in range(0, len(X), batchsize):
+                clus.partial_fit(X[start : start + batchsize])
+        labels = np.concatenate(
+            [
+                clus.predict(min_max_scaler.transform(X))
+                for X in store.iterchunks(chunksize)
+            ]
+        )
+        return cls._chooselabels(labels, n_clusters, n_each)
+
+    @staticmethod
+    def _chooselabels(labels, n_clusters, n_each):
+        """Choose structures from each cluster.
+
+        Parameters
+        ----------
+        labels : numpy.ndarray
+            The cluster label of each structure.
+        n_clusters : int
+            The number of clusters.
+        n_each : int
+            The number of structures in each cluster.
+
+        Returns
+        -------
+        numpy.ndarray
+            The selected index.
+        """
         choosedidx = []
         for i in range(n_clusters):
             idx = np.where(labels == i)[0]
@@ -399,46 +1087,75 @@ class DatasetBuilder:
                 index of structures in all
         """
         self.dstep = defaultdict(list)
-        with open(os.path.join(self.trajatom_dir, "chooseatoms"), "rb") as fc:
-            typecounter = Counter()
-            for typefile, trajatomfilename in zip(
-                read_compressed_block(fc), self.atombondtype
-            ):
-                for step, atoma in bytestolist(typefile):
-                    self.dstep[step].append(
-                        (
-                            atoma,
-                            trajatomfilename,
-                            typecounter[trajatomfilename],
-                            typecounter["total"],
-                        )
-                    )
-                    typecounter[trajatomfilename] += 1
-                    typecounter["total"] += 1
-            self.maxlength = len(str(self.n_clusters))
-            foldernum = self._nstructure // 1000 + 1
-            self.foldermaxlength = len(str(foldernum))
-            foldernames = [str(i).zfill(self.foldermaxlength) for i in range(foldernum)]
+        # rows of (step, atom ID, index of the bond type)
+        chooseatoms = read_array(os.path.join(self.trajatom_dir, "chooseatoms"), 3)
+        typecounter = Counter()
+        for step, atoma, itype in chooseatoms.tolist():
+            trajatomfilename = self.atombondtype[itype]
+            self.dstep[step].append(
+                (
+                    atoma,
+                    trajatomfilename,
+                    typecounter[trajatomfilename],
+                    typecounter["total"],
+                )
+            )
+            typecounter[trajatomfilename] += 1
+            typecounter["total"] += 1
+        self.maxlength = len(str(self.n_clusters))
+        foldernum = self._nstructure // 1000 + 1
+        self.foldermaxlength = len(str(foldernum))
+        foldernames = [str(i).zfill(self.foldermaxlength) for i in range(foldernum)]
+        archive = Archive(self.dataset_dir) if self.output == "tar" else None
+        if archive is not None:
+            archive.clear()
+            # shards left by an interrupted run
+            for shard in glob.glob(os.path.join(self.dataset_dir, "*.tar")):
+                os.remove(shard)
+        elif self.output == "dir":
             for folder in foldernames:
                 os.makedirs(os.path.join(self.dataset_dir, folder), exist_ok=True)
             if self.writegjf:
                 for folder in foldernames:
                     os.makedirs(os.path.join(self.gjfdir, folder), exist_ok=True)
-            crditer = self.lineiter(self.crddetector)
-            if self.crddetector is self.bonddetector:
-                lineiter = crditer
-            else:
-                bonditer = self.lineiter(self.bonddetector)
-                lineiter = zip(crditer, bonditer)
-            results = run_mp(
-                self.nproc,
-                func=self._writestepxyzfile,
-                l=lineiter,
-                return_num=True,
-                total=self._nstructure,
-                desc="Write structures",
-                unit="structure",
+        steps = list(self.dstep)
+        crditer = self.lineiter(self.crddetector, steps=steps, raw=True)
+        if self.crddetector is self.bonddetector:
+            lineiter = crditer
+        else:
+            bonditer = self.lineiter(self.bonddetector, steps=steps, raw=True)
+            lineiter = (
+                (step, (crdlines, bondlines))
+                for (step, crdlines), (_, bondlines) in zip(crditer, bonditer)
             )
+        results = run_mp(
+            self.nproc,
+            func="_writestepxyzfile",
+            state=self,
+            pool=self.workers,
+            maxinflight=self.maxinflight,
+            l=lineiter,
+            shared=True,
+            total=len(steps),
+            desc="Write structures",
+            unit="timestep",
+        )
+        if archive is not None:
+            for shard, entries in results:
+                archive.add(shard, entries)
+            archive.save()
+        elif self.output != "dir":
+            with DeePMDWriter(
+                f"{self.dataset_dir}.hdf5"
+                if self.output == "deepmd/hdf5"
+                else self.dataset_dir,
+                list(self._typeindex),
+                fmt=self.output,
+            ) as writer:
+                for structures in results:
+                    for structure in structures:
+                        writer.append(*structure)
+        else:
             for _ in results:
                 pass
 
@@ -476,6 +1193,29 @@ class DatasetBuilder:
         atoms_whole : ase.Atoms
             The whole atoms in the frame.
         """
+        with open(gjffilename, "w") as f:
+            profiler.count(
+                "write_bytes",
+                f.write(self._gjfstring(gjffilename, takenatomidindex, atoms_whole)),
+            )
+
+    def _gjfstring(self, gjffilename, takenatomidindex, atoms_whole):
+        """Return the content of a GJF file.
+
+        Parameters
+        ----------
+        gjffilename : str
+            The filename of GJF file, which names the checkpoint file.
+        takenatomidindex : list
+            The index of taken atoms.
+        atoms_whole : ase.Atoms
+            The whole atoms in the frame.
+
+        Returns
+        -------
+        str
+            The content of the GJF file.
+        """
         buff = []
         multiplicities = [
             self.detect_multiplicity(atoms_whole[atoms].get_chemical_symbols())
@@ -516,8 +1256,7 @@ class DatasetBuilder:
             assert connect is not None
             buff.extend((connect, *chk, kw, title, f"0 {multiplicity_whole}", "\n"))
         buff.append("\n")
-        with open(gjffilename, "w") as f:
-            f.write("\n".join(buff))
+        return "\n".join(buff)
 
     def _writestepxyzfile(self, item):
         """Write xyz files and GJF files in a timestep.
@@ -532,40 +1271,41 @@ class DatasetBuilder:
 
         Returns
         -------
-        results: int
-            The number of written files.
+        results: int, tuple (shard, entries) or list of tuples
+            The number of written structures. If the output format is "tar",
+            the shard of this process and the files appended to it instead,
+            which should be added to the index by `Archive.add`. For DeePMD-kit
+            formats, the structures (types, coord, tags) to append to
+            `DeePMDWriter` instead.
         """
+        from ase.io import write as write_xyz
+
         step, lines = item
         results = 0
+        members = []
         if step in self.dstep:
-            if len(lines) == 2:
+            if isinstance(lines, tuple):
                 assert isinstance(self.crddetector, DetectDump)
                 step_atoms, _ = self.crddetector.readcrd(lines[0])
                 molecules, _ = self.bonddetector.readmolecule(lines[1])
             else:
                 molecules, step_atoms = self.bonddetector.readmolecule(lines)
             assert step_atoms is not None
-            for atoma, trajatomfilename, itype, itotal in self.dstep[step]:
+            # atom ID starts from 1
+            neighbors = NeighborList(step_atoms, self.cutoff).query(
+                [x[0] - 1 for x in self.dstep[step]]
+            )
+            molindex = MoleculeIndex(molecules, len(step_atoms))
+            for (atoma, trajatomfilename, itype, itotal), cutoffatomid in zip(
+                self.dstep[step], neighbors
+            ):
                 # update counter
                 folder = str(itotal // 1000).zfill(self.foldermaxlength)
                 atomtypenum = str(itype).zfill(self.maxlength)
-                # atom ID starts from 1
-                distances = step_atoms.get_distances(
-                    atoma - 1, range(len(step_atoms)), mic=True
-                )
-                cutoffatomid = np.where(distances < self.cutoff)
                 # make cutoff atoms in molecules
-                takenatomids = []
-                takenatomidindex = []
-                idsum = 0
-                for mo in molecules:
-                    mol_atomid = np.array(mo)
-                    if np.any(np.isin(mol_atomid, cutoffatomid)):
-                        takenatomids.append(mol_atomid)
-                        takenatomidindex.append(range(idsum, idsum + len(mol_atomid)))
-                        idsum += len(mol_atomid)
-                idx = np.concatenate(takenatomids)
+                idx, takenatomidindex = molindex.take(cutoffatomid)
                 cutoffatoms = step_atoms[idx]
+                basename = f"{self.xyzfilename}_{trajatomfilename}_{atomtypenum}"
                 assert isinstance(cutoffatoms, Atoms)
                 cutoffatoms[np.nonzero(idx == atoma - 1)[0][0]].tag = 1  # type: ignore
                 cutoffatoms.wrap(
@@ -573,68 +1313,314 @@ class DatasetBuilder:
                     / cutoffatoms.get_cell_lengths_and_angles()[0:3],
                     pbc=cutoffatoms.get_pbc(),
                 )
-                write_xyz(
-                    os.path.join(
-                        self.dataset_dir,
-                        folder,
-                        f"{self.xyzfilename}_{trajatomfilename}_{atomtypenum}.xyz",
-                    ),
-                    cutoffatoms,
-                    format="xyz",
-                )
-                if self.writegjf:
-                    self._convertgjf(
-                        os.path.join(
-                            self.gjfdir,
-                            folder,
-                            f"{self.xyzfilename}_{trajatomfilename}_{atomtypenum}.gjf",
-                        ),
-                        takenatomidindex,
-                        cutoffatoms,
+                if self.output.startswith("deepmd/"):
+                    members.append(
+                        (
+                            np.array(
+                                [
+                                    self._typeindex[symbol]
+                                    for symbol in cutoffatoms.get_chemical_symbols()
+                                ]
+                            ),
+                            cutoffatoms.get_positions(),
+                            cutoffatoms.get_tags(),
+                        )
                     )
-                if self.atom_pref:
-                    np.save(
-                        os.path.join(
-                            self.gjfdir,
-                            folder,
-                            f"{self.xyzfilename}_{trajatomfilename}_{atomtypenum}.atom_pref.npy",
-                        ),
-                        np.array([cutoffatoms.get_tags()]),
+                    results += 1
+                    continue
+                if self.output == "tar":
+                    members.extend(
+                        self._archivemembers(
+                            f"{folder}/{basename}", takenatomidindex, cutoffatoms
+                        )
                     )
+                    results += 1
+                    continue
+                xyzfilename = os.path.join(self.dataset_dir, folder, f"{basename}.xyz")
+                with profiler.timer("write"):
+                    write_xyz(xyzfilename, cutoffatoms, format="xyz")
+                    profiler.countfile("write_bytes", xyzfilename)
+                    if self.writegjf:
+                        self._convertgjf(
+                            os.path.join(self.gjfdir, folder, f"{basename}.gjf"),
+                            takenatomidindex,
+                            cutoffatoms,
+                        )
+                    if self.atom_pref:
+                        np.save(
+                            os.path.join(
+                                self.gjfdir, folder, f"{basename}.atom_pref.npy"
+                            ),
+                            np.array([cutoffatoms.get_tags()]),
+                        )
                 results += 1
+        if self.output.startswith("deepmd/"):
+            return members
+        if self.output == "tar":
+            # each process appends to its own shard
+            shard = f"{self.xyzfilename}.{os.getpid()}.tar"
+            with profiler.timer("write"):
+                entries = appendmembers(os.path.join(self.dataset_dir, shard), members)
+            profiler.count("write_bytes", sum(size for _, _, size in entries))
+            return shard, entries
         return results
 
+    def _archivemembers(self, name, takenatomidindex, cutoffatoms):
+        """Return the files of a structure to append to the archive.
+
+        Parameters
+        ----------
+        name : str
+            The folder and the basename of the structure.
+        takenatomidindex : list
+            The index of taken atoms.
+        cutoffatoms : ase.Atoms
+            The atoms of the structure.
+
+        Returns
+        -------
+        list of tuples (name, data)
+            The names (the paths of the directory layout) and contents of the
+            xyz file, the GJF file and the atom_pref file.
+        """
+        from ase.io import write as write_xyz
+
+        buff = io.StringIO()
+        write_xyz(buff, cutoffatoms, format="xyz")
+        members = [(f"{self.dataset_dir}/{name}.xyz", buff.getvalue().encode())]
+        if self.writegjf:
+            gjffilename = f"{self.gjfdir}/{name}.gjf"
+            members.append(
+                (
+                    gjffilename,
+                    self._gjfstring(
+                        gjffilename, takenatomidindex, cutoffatoms
+                    ).encode(),
+                )
+            )
+        if self.atom_pref:
+            buff = io.BytesIO()
+            np.save(buff, np.array([cutoffatoms.get_tags()]))
+            members.append((f"{self.gjfdir}/{name}.atom_pref.npy", buff.getvalue()))
+        return members
+
     def _bondtype(self, typebytes):
         if typebytes in self.bondtyperestore:
             return self.bondtyperestore[typebytes]
         typetuple = pickle.loads(typebytes)
-        typestr = f"{typetuple[0]}{''.join(map(str,typetuple[1]))}"
+        typestr = f"{typetuple[0]}{''.join(map(str, typetuple[1]))}"
         self.bondtyperestore[typebytes] = typestr
         return typestr
 
-    def lineiter(self, detector):
+    def _files(self, filenames):
+        """Return the files read by this run.
+
+        A shard only reads its block of files, and its steps are counted from
+        the first frame of the block.
+
+        Parameters
+        ----------
+        filenames : str or list of strs
+            The files of the whole trajectory.
+
+        Returns
+        -------
+        list of strs
+            The files read by this run.
+        """
+        fns = must_be_list(filenames)
+        if self.shard is None:
+            return fns
+        index, count = self.shard
+        return fns[len(fns) * index // count : len(fns) * (index + 1) // count]
+
+    def lineiter(self, detector, steps=None, raw=False):
         """Iterate over file(s).
 
+        When all frames are iterated, the frame index of each file is built at
+        the same time and saved to `trajatom_dir`. When `steps` is given, only
+        the selected frames are read by seeking to their offsets. If
+        `cachedir` is given, frames in the binary cache are yielded instead.
+
         Parameters
         ----------
         detector : mddatasetbuilder.detect.Detect
             File detector
+        steps : list of int, optional, default=None
+            The selected frames, which are counted from 0 after applying the
+            step interval. If None (default), all frames are iterated.
+        raw : bool, optional, default=False
+            If True, yield the content of frames in bytes instead of lines,
+            which can be decoded by `mddatasetbuilder.frameindex.decodeframe`.
 
         Yields
         ------
-        str
-            lines
+        str or tuple (step, lines)
+            lines, or the step and lines of the selected frame if `steps` is
+            given
         """
-        fns = must_be_list(detector.filename)
-        for fn in fns:
-            with open(fn) as f:
-                it = itertools.islice(
-                    itertools.zip_longest(*[f] * detector.steplinenum),
-                    0,
-                    None,
-                    self.stepinterval,
-                )
-                yield from it
+        if steps is not None:
+            yield from self._readframes(detector, steps, raw=raw)
+            return
+        if self.cachedir is not None:
+            for cache in self.caches(detector):
+                for ii in range(0, len(cache), self.stepinterval):
+                    profiler.count("frames")
+                    yield cache.frame(ii)
+            return
+        for fn in self._files(detector.filename):
+            offsets = []
+            lengths = []
+            timesteps = []
+            with open(fn, "rb") as f:
+                for ii, (offset, data) in enumerate(detector.iterframes(f)):
+                    offsets.append(offset)
+                    lengths.append(len(data))
+                    timesteps.append(detector.readtimestep(data))
+                    profiler.count("read_bytes", len(data))
+                    if ii % self.stepinterval == 0:
+                        profiler.count("frames")
+                        yield data if raw else decodeframe(data)
+            if self._trajatom_dir is not None:
+                FrameIndex(fn, offsets, lengths, timesteps).save(self._trajatom_dir)
+
+    def frameindex(self, detector):
+        """Return the frame indexes of file(s).
+
+        The index is loaded from `trajatom_dir` if it has been built, otherwise
+        the file will be scanned.
+
+        Parameters
+        ----------
+        detector : mddatasetbuilder.detect.Detect
+            File detector
+
+        Returns
+        -------
+        list of FrameIndex
+            The frame index of each file.
+        """
+        indexes = []
+        for fn in self._files(detector.filename):
+            index = None
+            if self._trajatom_dir is not None:
+                index = FrameIndex.load(self._trajatom_dir, fn)
+            if index is None:
+                index = FrameIndex.build(fn, detector)
+                if self._trajatom_dir is not None:
+                    index.save(self._trajatom_dir)
+            indexes.append(index)
+        return indexes
+
+    def caches(self, detector):
+        """Return the binary caches of file(s).
+
+        Files which are not cached yet, or have been modified, are converted
+        first.
+
+        Parameters
+        ----------
+        detector : mddatasetbuilder.detect.Detect
+            File detector
+
+        Returns
+        -------
+        list of TrajectoryCache
+            The cache of each file.
+        """
+        caches = []
+        for fn in self._files(detector.filename):
+            cache = TrajectoryCache.load(self.cachedir, fn)
+            if cache is None:
+                cache = self._buildcache(detector, fn)
+            caches.append(cache)
+        return caches
+
+    def _buildcache(self, detector, filename):
+        """Convert a file to the binary cache.
+
+        Parameters
+        ----------
+        detector : mddatasetbuilder.detect.Detect
+            File detector
+        filename : str
+            The filename.
+
+        Returns
+        -------
+        TrajectoryCache
+            The cache.
+        """
+
+        def frames():
+            with open(filename, "rb") as f:
+                for _, data in detector.iterframes(f):
+                    profiler.count("read_bytes", len(data))
+                    profiler.count("frames")
+                    yield data
+
+        logger.info(f"Convert {filename} to the binary cache in {self.cachedir}")
+        with CacheWriter(self.cachedir, filename) as writer:
+            for arrays in run_mp(
+                self.nproc,
+                func="readarrays",
+                state=detector,
+                pool=self.workers,
+                maxinflight=self.maxinflight,
+                l=frames(),
+                shared=True,
+                unordered=False,
+                desc="Convert trajectory",
+                unit="timestep",
+            ):
+                writer.append(arrays)
+        cache = TrajectoryCache.load(self.cachedir, filename)
+        assert cache is not None
+        return cache
+
+    def _readframes(self, detector, steps, raw=False):
+        """Read the selected frames with the frame index.
+
+        Parameters
+        ----------
+        detector : mddatasetbuilder.detect.Detect
+            File detector
+        steps : list of int
+            The selected frames, which are counted from 0 after applying the
+            step interval.
+        raw : bool, optional, default=False
+            If True, yield the content of frames in bytes instead of lines.
+
+        Yields
+        ------
+        tuple (step, lines)
+            The step and lines of the selected frame.
+        """
+        steps = np.sort(np.asarray(steps, dtype=int))
+        start = 0
+        if self.cachedir is not None:
+            for cache in self.caches(detector):
+                nframes = (len(cache) + self.stepinterval - 1) // self.stepinterval
+                selected = steps[(steps >= start) & (steps < start + nframes)]
+                for step in selected:
+                    profiler.count("frames")
+                    yield int(step), cache.frame((step - start) * self.stepinterval)
+                start += nframes
+            return
+        for index in self.frameindex(detector):
+            # frames taken from this file
+            nframes = (len(index) + self.stepinterval - 1) // self.stepinterval
+            selected = steps[(steps >= start) & (steps < start + nframes)]
+            if selected.size:
+                with open(index.filename, "rb") as f:
+                    for step in selected:
+                        data = index.read(f, (step - start) * self.stepinterval)
+                        if detector.binary:
+                            data = BinaryFrame(data)
+                        profiler.count("read_bytes", len(data))
+                        profiler.count("frames")
+                        yield int(step), data if raw else decodeframe(data)
+            start += nframes
 
     def erroriter(self):
         """Iterate over the model deviation file.
@@ -645,13 +1631,56 @@ class DatasetBuilder:
             the line of model deviation
         """
         assert self.errorfilename is not None
-        fns = must_be_list(self.errorfilename)
-        for fn in fns:
+        for fn in self._files(self.errorfilename):
             with open(fn) as f:
                 it = itertools.islice(f, 1, None)
                 yield from it
 
 
+def _clusterbondtype(task):
+    """Cluster a bond type.
+
+    Parameters
+    ----------
+    task : tuple (itype, features, n_clusters, n_each, chunksize, nthreads)
+        itype: int
+            The index of the bond type.
+        features: numpy.ndarray, str or mddatasetbuilder.features.FeatureMatrix
+            The features, the filename of the saved features, or the feature
+            store for streaming clustering.
+        n_clusters: int
+            The number of clusters.
+        n_each: int
+            The number of structures in each cluster.
+        chunksize: int or None
+            The chunk size of streaming clustering. If None, the features are
+            clustered in memory.
+        nthreads: int or None
+            The maximum number of threads of BLAS and OpenMP. If None, there is
+            no limit.
+
+    Returns
+    -------
+    itype: int
+        The index of the bond type.
+    index: numpy.ndarray
+        The selected index.
+    """
+    itype, features, n_clusters, n_each, chunksize, nthreads = task
+    with threadpool_limits(limits=nthreads):
+        if chunksize:
+            index = DatasetBuilder._clusterdatastream(
+                features, n_clusters=n_clusters, n_each=n_each, chunksize=chunksize
+            )
+        else:
+            if isinstance(features, str):
+                features = np.load(features)
+            index = DatasetBuilder._clusterdatas(
+                features, n_clusters=n_clusters, n_each=n_each
+            )
+    return itype, index
+
+
 def _commandline():
     parser = argparse.ArgumentParser(
         description="MDDatasetBuilder",
@@ -726,13 +1755,81 @@ def _commandline():
         type=float,
         default=0.0,
     )
+    parser.add_argument(
+        "--bondbackend",
+        help="Backend to perceive bonds from the dump file when the bond file is not given. native is much faster than openbabel, but its bond orders, and thus bond types, are not equivalent to those of openbabel.",
+        choices=["openbabel", "native"],
+        default="openbabel",
+    )
+    parser.add_argument(
+        "--clusterchunksize",
+        help="Number of atoms in each chunk to cluster features from the disk, which bounds the memory. If not given, features of all bond types are kept in memory until clustered.",
+        type=int,
+    )
+    parser.add_argument(
+        "--workdir",
+        help="Directory to keep intermediate files. If not given, a temporary directory will be used.",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Resume from the work directory, skipping finished steps.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--maxworkermemory",
+        help="Maximum memory (MiB) of each worker process. Workers exceeding it are restarted between stages. If not given, workers are never restarted.",
+        type=float,
+    )
+    parser.add_argument(
+        "--maxinflight",
+        help="Memory budget (MiB) of frames sent to worker processes but not finished yet.",
+        type=float,
+        default=1024.0,
+    )
+    parser.add_argument(
+        "--output",
+        help="Output format. dir writes one file per structure; tar appends them, including gjf files, to a few tar shards with an index in the dataset directory, which is passed to qmcalc -d and preparedeepmd -p; deepmd/npy and deepmd/hdf5 write unlabeled DeePMD-kit data.",
+        choices=["dir", "tar", "deepmd/npy", "deepmd/hdf5"],
+        default="dir",
+    )
+    parser.add_argument(
+        "--cachedir",
+        help="Directory of the binary trajectory cache. If given, trajectory files are converted once and later runs read frames from the cache without parsing.",
+    )
+    parser.add_argument(
+        "--dumpformat",
+        help="Format of the dump file. binary reads the LAMMPS binary dump (dump ... binary).",
+        choices=["text", "binary"],
+        default="text",
+    )
+    parser.add_argument(
+        "--dumpcolumns",
+        help="Columns of the binary dump file, e.g. id type x y z. If not given, the columns written in the file are used.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Run a shard i/n (i from 0) of the trajectory, writing step 1 and the features of its frames. Shards are assigned contiguous blocks of whole files, so give at least n dump files. Run --merge after all shards finish.",
+        type=_parseshard,
+    )
+    parser.add_argument(
+        "--merge",
+        help="Cluster the features written by all shards and write the dataset.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the stages and write the report to this file (default: profile.json), with a summary in the log.",
+        nargs="?",
+        const="profile.json",
+    )
     parser.add_argument(
         "--version",
         action="version",
         version=f"MDDatasetBuilder {__version__}",
     )
     args = parser.parse_args()
-    DatasetBuilder(
+    builder = DatasetBuilder(
         atomname=args.atomname,
         bondfilename=args.bondfile,
         dumpfilename=args.dumpfile,
@@ -744,4 +1841,31 @@ def _commandline():
         nproc=args.nproc,
         errorfilename=args.errorfile,
         errorlimit=args.errorlimit,
-    ).builddataset()
+        bondbackend=args.bondbackend,
+        clusterchunksize=args.clusterchunksize,
+        workdir=args.workdir,
+        resume=args.resume,
+        maxworkermemory=args.maxworkermemory,
+        maxinflight=args.maxinflight,
+        output=args.output,
+        cachedir=args.cachedir,
+        dumpformat=args.dumpformat,
+        dumpcolumns=args.dumpcolumns,
+        shard=args.shard,
+        profile=args.profile,
+    )
+    if args.merge:
+        builder.mergeshards()
+    else:
+        builder.builddataset()
+
+
+def _parseshard(value):
+    """Parse the shard i/n from the command line."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid shard: {value}") from e
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard: {value}")
+    return index, count
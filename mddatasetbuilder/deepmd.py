@@ -1,18 +1,30 @@
 """Gaussian logs to DeePMD data files."""
 
 import argparse
+import glob
+import io
 import json
 import os
 import random
+import shutil
+import tempfile
+from collections import Counter, defaultdict
 from multiprocessing import Pool
 
-import dpdata
 import numpy as np
 from tqdm.auto import tqdm
 
+from . import profiler
+from ._logger import logger
+from .archive import Archive, readmember
+
 
 class PrepareDeePMD:
-    """Prepare DeePMD training files."""
+    """Prepare DeePMD training files.
+
+    `data_path` may also contain an archive of tar shards, from which the logs
+    are read directly.
+    """
 
     def __init__(
         self,
@@ -41,12 +53,25 @@ class PrepareDeePMD:
 
     def _searchpath(self):
         logfiles = []
-        for root, _, files in tqdm(
-            os.walk(self.data_path, followlinks=True), disable=None
-        ):
-            for logfile in files:
-                if logfile.endswith(self.suffix):
-                    logfiles.append(os.path.join(root, logfile))
+        if Archive.isarchive(self.data_path):
+            archive = Archive(self.data_path)
+            for name in archive.names(self.suffix):
+                atom_pref = f"{name[: -len(self.suffix)]}.atom_pref.npy"
+                logfiles.append(
+                    (
+                        archive.locate(name),
+                        archive.locate(atom_pref) if atom_pref in archive else None,
+                    )
+                )
+        else:
+            for root, _, files in tqdm(
+                os.walk(self.data_path, followlinks=True), disable=None
+            ):
+                for logfile in files:
+                    if logfile.endswith(self.suffix):
+                        logfiles.append(os.path.join(root, logfile))
+        import dpdata
+
         multi_systems = dpdata.MultiSystems()
         with Pool() as pool:
             for system in pool.imap_unordered(
@@ -64,12 +89,33 @@ class PrepareDeePMD:
         self.atomname = multi_systems.atom_names
 
     def _preparedeepmdforLOG(self, logfilename):
+        if isinstance(logfilename, tuple):
+            return self._preparedeepmdforarchive(*logfilename)
+        import dpdata
+
         system = dpdata.LabeledSystem(logfilename, fmt=self.fmt)
         atom_pref_file = os.path.splitext(logfilename)[0] + ".atom_pref.npy"
         if os.path.exists(atom_pref_file):
             system.data["atom_pref"] = np.load(atom_pref_file)
         return system
 
+    def _preparedeepmdforarchive(self, loglocation, atom_pref_location):
+        import dpdata
+
+        # the log is parsed from a temporary file
+        fd, logfilename = tempfile.mkstemp(suffix=self.suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(readmember(loglocation))
+            system = dpdata.LabeledSystem(logfilename, fmt=self.fmt)
+        finally:
+            os.remove(logfilename)
+        if atom_pref_location is not None:
+            system.data["atom_pref"] = np.load(
+                io.BytesIO(readmember(atom_pref_location))
+            )
+        return system
+
     def _writejson(self, jsonfilename):
         jsonpath = os.path.dirname(jsonfilename)
         deepmd_json = {
@@ -127,6 +173,128 @@ class PrepareDeePMD:
             json.dump(deepmd_json, f)
 
 
+class DeePMDWriter:
+    """Write unlabeled structures to DeePMD-kit data, grouped by formula.
+
+    Structures are buffered for each formula, and a set is written once a
+    buffer is full, so the memory is bounded by the set size. The layout is
+    the same as `deepmd/npy` or `deepmd/hdf5` of dpdata: a system for each
+    formula with `type.raw`, `type_map.raw`, `nopbc` and `set.*` containing
+    `coord.npy`. Clusters are not periodic, so `box.npy` is not written. The
+    tags of atoms are saved as `atom_pref.npy`.
+
+    Parameters
+    ----------
+    path : str
+        The directory (deepmd/npy) or the file (deepmd/hdf5).
+    type_map : list of strs
+        The element of each atom type.
+    fmt : {"deepmd/npy", "deepmd/hdf5"}, optional, default="deepmd/npy"
+        The format. "deepmd/hdf5" requires h5py.
+    set_size : int, optional, default=5000
+        The number of structures in each set.
+    """
+
+    def __init__(self, path, type_map, fmt="deepmd/npy", set_size=5000):
+        self.path = path
+        self.type_map = list(type_map)
+        self.fmt = fmt
+        self.set_size = set_size
+        # formula -> list of (coord, tags)
+        self._buffers = defaultdict(list)
+        self._types = {}
+        self._nsets = Counter()
+        if fmt == "deepmd/hdf5":
+            import h5py
+
+            self._h5 = h5py.File(path, "w")
+        elif fmt == "deepmd/npy":
+            self._h5 = None
+            os.makedirs(path, exist_ok=True)
+        else:
+            raise RuntimeError(f"Unsupported format: {fmt}")
+
+    def append(self, types, coord, tags):
+        """Append a structure.
+
+        Parameters
+        ----------
+        types : numpy.ndarray (N,)
+            The atom type of each atom.
+        coord : numpy.ndarray (N, 3)
+            The coordinates.
+        tags : numpy.ndarray (N,)
+            The tags of atoms.
+        """
+        # atoms are sorted by types, so structures of a formula share types
+        order = np.argsort(types, kind="stable")
+        counts = np.bincount(types, minlength=len(self.type_map))
+        formula = "".join(f"{name}{n}" for name, n in zip(self.type_map, counts))
+        if formula not in self._types:
+            self._types[formula] = types[order]
+        buffer = self._buffers[formula]
+        buffer.append((coord[order], tags[order]))
+        if len(buffer) >= self.set_size:
+            self._flush(formula)
+
+    def _flush(self, formula):
+        buffer = self._buffers.pop(formula)
+        nset = self._nsets[formula]
+        data = {
+            "coord.npy": np.array([x[0].ravel() for x in buffer], dtype=np.float32),
+            "atom_pref.npy": np.array([x[1] for x in buffer], dtype=np.float32),
+        }
+        types = self._types[formula]
+        setname = f"set.{nset:03d}"
+        if self._h5 is not None:
+            system = self._h5.require_group(formula)
+            if nset == 0:
+                system.create_dataset("type.raw", data=types)
+                system.create_dataset(
+                    "type_map.raw", data=np.array(self.type_map, dtype="S")
+                )
+                system.create_dataset("nopbc", data=True)
+            g = system.create_group(setname)
+            for fn, value in data.items():
+                g.create_dataset(fn, data=value)
+        else:
+            folder = os.path.join(self.path, formula)
+            if nset == 0:
+                os.makedirs(folder, exist_ok=True)
+                # sets left by the last run
+                for oldset in glob.glob(os.path.join(folder, "set.*")):
+                    shutil.rmtree(oldset)
+                np.savetxt(os.path.join(folder, "type.raw"), types, fmt="%d")
+                np.savetxt(
+                    os.path.join(folder, "type_map.raw"), self.type_map, fmt="%s"
+                )
+                open(os.path.join(folder, "nopbc"), "w").close()
+            os.makedirs(os.path.join(folder, setname))
+            for fn, value in data.items():
+                np.save(os.path.join(folder, setname, fn), value)
+        profiler.count("write_bytes", sum(value.nbytes for value in data.values()))
+        self._nsets[formula] += 1
+
+    def close(self):
+        """Write the remaining structures and close the file."""
+        for formula in list(self._buffers):
+            self._flush(formula)
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+        logger.info(
+            f"Wrote {len(self._nsets)} systems of DeePMD-kit data to {self.path}"
+        )
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the writer when exiting the context."""
+        self.close()
+
+
 def _commandline():
     parser = argparse.ArgumentParser(description="Prepare DeePMD data")
     parser.add_argument(
@@ -135,7 +303,7 @@ def _commandline():
     parser.add_argument(
         "-p",
         "--path",
-        help="Gaussian LOG file path, e.g. dataset_md_GJF",
+        help="Gaussian LOG file path, e.g. dataset_md_GJF, or the dataset directory (e.g. dataset_md) with --output tar",
         required=True,
     )
     parser.add_argument(
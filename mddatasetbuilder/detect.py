@@ -1,21 +1,32 @@
 """Detect from trajectory."""
 
 import pickle
+import struct
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 from enum import Enum, auto
+from itertools import chain
 from typing import List, Optional, Tuple, Union, cast
 
 import numpy as np
-from ase import Atom, Atoms
-from openbabel import openbabel
+from ase import Atoms
+from ase.data import atomic_numbers
 
 from mddatasetbuilder.dps import dps as connectmolecule
+from mddatasetbuilder.dps import dps_csr
+
+from . import profiler
+from .bondperception import crd2bond
+from .cache import CachedFrame
+from .frameindex import BinaryFrame, iterframes
 
 
 class Detect(metaclass=ABCMeta):
     """Detect structures from file(s)."""
 
+    # whether frames are BinaryFrame instead of text
+    binary = False
+
     def __init__(self, filename, atomname, pbc, errorlimit=None, errorfilename=None):
         self.filename = filename
         self.atomname = atomname
@@ -25,7 +36,11 @@ class Detect(metaclass=ABCMeta):
         self.steplinenum = self._readN()
 
     @abstractmethod
-    def _readN(self) -> int:
+    def _readN(self) -> Optional[int]:
+        """Read the first frame and return the number of lines in each frame.
+
+        None if frames are not split by lines.
+        """
         pass
 
     @abstractmethod
@@ -38,6 +53,33 @@ class Detect(metaclass=ABCMeta):
         """Read molecules."""
         pass
 
+    @abstractmethod
+    def readtimestep(self, data: bytes) -> int:
+        """Read the timestep from the content of a frame."""
+        pass
+
+    @abstractmethod
+    def readarrays(self, lines) -> dict:
+        """Read arrays of a frame, which are stored in the binary cache."""
+        pass
+
+    def iterframes(self, f):
+        """Split a file into frames.
+
+        Parameters
+        ----------
+        f : File object
+            The file object opened in the binary mode.
+
+        Yields
+        ------
+        offset: int
+            The byte offset of the frame.
+        data: bytes
+            The content of the frame.
+        """
+        return iterframes(f, self.steplinenum)
+
     @staticmethod
     def gettype(inputtype):
         """Get the class for the input file type."""
@@ -45,6 +87,8 @@ class Detect(metaclass=ABCMeta):
             detectclass = DetectBond
         elif inputtype == "dump":
             detectclass = DetectDump
+        elif inputtype == "binary":
+            detectclass = DetectBinaryDump
         else:
             raise RuntimeError("Wrong input file type")
         return detectclass
@@ -87,6 +131,7 @@ class DetectBond(Detect):
         self.atomnames = self.atomname[self.atomtype - 1]
         return steplinenum
 
+    @profiler.timed("DetectBond.readatombondtype")
     def readatombondtype(self, item):
         """Read bond orders of atoms.
 
@@ -102,9 +147,17 @@ class DetectBond(Detect):
         int
             the step index
         """
-        # copy from reacnetgenerator on 2018-12-15
         (step, lines), _ = item
         d = defaultdict(list)
+        if isinstance(lines, CachedFrame):
+            arrays = lines.read()
+            indptr = arrays["indptr"]
+            orders = arrays["orders"].tolist()
+            for ii, (start, end) in enumerate(zip(indptr[:-1], indptr[1:])):
+                atombond = sorted(orders[start:end])
+                d[pickle.dumps((self.atomnames[ii], atombond))].append(ii + 1)
+            return d, step
+        # copy from reacnetgenerator on 2018-12-15
         for line in lines:
             if line:
                 if line[0] != "#":
@@ -118,13 +171,14 @@ class DetectBond(Detect):
                     )
         return d, step
 
+    @profiler.timed("DetectBond.readmolecule")
     def readmolecule(self, lines) -> Tuple[List[List[int]], Optional[Atoms]]:
         """Return molecules from lines.
 
         Parameters
         ----------
-        lines : list of strs
-            Lines of LAMMPS bond files.
+        lines : list of strs or CachedFrame
+            Lines of LAMMPS bond files, or the frame in the binary cache.
 
         Returns
         -------
@@ -133,6 +187,15 @@ class DetectBond(Detect):
         None
             None
         """
+        if isinstance(lines, CachedFrame):
+            arrays = lines.read()
+            _, molptr, members = dps_csr(arrays["indptr"], arrays["indices"])
+            members = members.tolist()
+            molptr = molptr.tolist()
+            molecules = [
+                members[start:end] for start, end in zip(molptr[:-1], molptr[1:])
+            ]
+            return molecules, None
         # copy from reacnetgenerator on 2018-12-15
         bond: List[Optional[List[int]]] = [None] * self._N
         for line in lines:
@@ -144,11 +207,77 @@ class DetectBond(Detect):
         molecules = connectmolecule(bond_)
         return molecules, None
 
+    def readtimestep(self, data: bytes) -> int:
+        """Read the timestep from the content of a frame.
 
-class DetectDump(Detect):
-    """Detect from the dump file."""
+        Parameters
+        ----------
+        data : bytes
+            The content of the frame in the LAMMPS bond file.
 
-    def _readN(self):
+        Returns
+        -------
+        int
+            The timestep.
+        """
+        start = data.index(b"# Timestep") + len(b"# Timestep")
+        return int(data[start : data.index(b"\n", start)])
+
+    def readarrays(self, lines) -> dict:
+        """Read the bond table of a frame, which is stored in the binary cache.
+
+        Parameters
+        ----------
+        lines : list of strs
+            Lines of the frame in the LAMMPS bond file.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            indptr: int32 (N+1,)
+                The bonds of the atom with the index i are indices[indptr[i]:indptr[i+1]].
+            indices: int32
+                The indexes of bonded atoms, starting from 0.
+            orders: int8
+                The bond orders rounded as in `readatombondtype`.
+        """
+        neighbors: List[List[int]] = [[]] * self._N
+        orders: List[List[int]] = [[]] * self._N
+        for line in lines:
+            if line and line[0] != "#":
+                s = line.split()
+                ii = int(s[0]) - 1
+                nb = int(s[2])
+                neighbors[ii] = [int(x) - 1 for x in s[3 : 3 + nb]]
+                orders[ii] = [max(1, round(float(x))) for x in s[4 + nb : 4 + 2 * nb]]
+        indptr = np.zeros(self._N + 1, dtype=np.int32)
+        np.cumsum([len(x) for x in neighbors], out=indptr[1:])
+        return {
+            "indptr": indptr,
+            "indices": np.fromiter(chain(*neighbors), np.int32, indptr[-1]),
+            "orders": np.fromiter(chain(*orders), np.int8, indptr[-1]),
+        }
+
+
+class DetectDump(Detect):
+    """Detect from the dump file.
+
+    Parameters
+    ----------
+    bondbackend : {"openbabel", "native"}, optional, default="openbabel"
+        The backend to perceive bonds from coordinates. "openbabel" uses Open
+        Babel, and "native" uses the vectorized implementation in
+        `mddatasetbuilder.bondperception`. The native connectivity is the same as
+        Open Babel's, but the native bond orders only follow Open Babel's rules
+        without perceiving aromatic rings and most functional groups, so bond
+        types may differ between backends.
+    """
+
+    def __init__(self, *args, bondbackend="openbabel", **kwargs):
+        self.bondbackend = bondbackend
+        super().__init__(*args, **kwargs)
+
+    def _readN(self) -> Optional[int]:
         # copy from reacnetgenerator on 2018-12-15
         iscompleted = False
         N = None
@@ -191,8 +320,10 @@ class DetectDump(Detect):
         self._N = N
         self.atomtype = atomtype
         self.atomnames = self.atomname[self.atomtype - 1]
+        self.atomnumbers = np.array([atomic_numbers[name] for name in self.atomname])
         return steplinenum
 
+    @profiler.timed("DetectDump.readatombondtype")
     def readatombondtype(self, item):
         """Read bond orders of atoms.
 
@@ -211,12 +342,14 @@ class DetectDump(Detect):
         (step, lines), needlerror = item
         lerror: Optional[Union[np.ndarray, List[float]]] = None
         d = defaultdict(list)
-        step_atoms, ids = self.readcrd(lines)
+        errorline = None
         if needlerror:
-            trajline, errorline = lines
+            lines, errorline = lines
+        step_atoms, ids = self.readcrd(lines)
+        if errorline is not None:
             lerror = np.fromstring(errorline, dtype=float, sep=" ")[7:]
-            lerror = [x for (y, x) in sorted(zip(ids, lerror))]
-        level = self._crd2bond(step_atoms, readlevel=True)
+            lerror = lerror[np.argsort(ids, kind="stable")]
+        level = self._crd2bond(step_atoms, readlevel=True, backend=self.bondbackend)
         for i, (n, l) in enumerate(zip(self.atomnames, level)):
             if lerror is None or (
                 self.errorlimit is not None and lerror[i] > self.errorlimit
@@ -225,6 +358,7 @@ class DetectDump(Detect):
                 d[pickle.dumps((n, sorted(l)))].append(i + 1)
         return d, step
 
+    @profiler.timed("DetectDump.readmolecule")
     def readmolecule(self, lines) -> Tuple[List[List[int]], Optional[Atoms]]:
         """Return molecules from lines.
 
@@ -241,13 +375,36 @@ class DetectDump(Detect):
             The atoms of the frame.
         """
         step_atoms, _ = self.readcrd(lines)
-        bond = self._crd2bond(step_atoms, readlevel=False)
+        bond = self._crd2bond(step_atoms, readlevel=False, backend=self.bondbackend)
         molecules = connectmolecule(bond)
         # return atoms as well
         return molecules, step_atoms
 
+    def readtimestep(self, data: bytes) -> int:
+        """Read the timestep from the content of a frame.
+
+        Parameters
+        ----------
+        data : bytes
+            The content of the frame in the LAMMPS dump file.
+
+        Returns
+        -------
+        int
+            The timestep.
+        """
+        start = data.index(b"\n", data.index(b"ITEM: TIMESTEP")) + 1
+        return int(data[start : data.index(b"\n", start)])
+
     @classmethod
-    def _crd2bond(cls, step_atoms, readlevel):
+    @profiler.timed("_crd2bond")
+    def _crd2bond(cls, step_atoms, readlevel, backend="openbabel"):
+        if backend == "native":
+            return crd2bond(step_atoms, readlevel)
+        elif backend != "openbabel":
+            raise RuntimeError(f"Unknown bond perception backend: {backend}")
+        from openbabel import openbabel
+
         # copy from reacnetgenerator on 2019/4/13
         # updated on 2019/10/11
         atomnumber = len(step_atoms)
@@ -291,39 +448,105 @@ class DetectDump(Detect):
                 bond[s2].append(level)
         return bond
 
-    def readcrd(self, item) -> Tuple[Atoms, List[int]]:
-        """Only this function can read coordinates."""
-        lines = item
+    @profiler.timed("readcrd")
+    def readcrd(self, item) -> Tuple[Atoms, np.ndarray]:
+        """Only this function can read coordinates.
+
+        The ATOMS block of the frame is parsed into arrays at once, and then
+        sorted by atom IDs.
+
+        Parameters
+        ----------
+        item : list of strs or CachedFrame
+            Lines of the frame in the LAMMPS dump file, or the frame in the
+            binary cache.
+
+        Returns
+        -------
+        step_atoms: ase.Atoms
+            The atoms of the frame, sorted by IDs.
+        ids: numpy.ndarray
+            The atom IDs in the order of the dump file.
+        """
+        if isinstance(item, CachedFrame):
+            arrays = item.read()
+        else:
+            arrays = self.readarrays(item)
+        step_atoms = Atoms(
+            numbers=self.atomnumbers[arrays["types"] - 1],
+            positions=arrays["positions"].reshape(-1, 3),
+            cell=arrays["cell"].reshape(3, 3),
+            pbc=self.pbc,
+        )
+        return step_atoms, arrays["ids"]
+
+    def readarrays(self, lines) -> dict:
+        """Read arrays of a frame, which are stored in the binary cache.
+
+        Parameters
+        ----------
+        lines : list of strs
+            Lines of the frame in the LAMMPS dump file.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            ids: int32 (N,)
+                The atom IDs in the order of the dump file.
+            types: int32 (N,)
+                The atom types, sorted by IDs.
+            positions: float64 (N, 3)
+                The positions, sorted by IDs.
+            cell: float64 (3, 3)
+                The cell.
+        """
         # box information
         ss = []
-        step_atoms = []
-        ids = []
         linecontent = None
-        for line in lines:
-            if line:
-                if line.startswith("ITEM:"):
-                    linecontent = self.LineType.linecontent(line)
-                else:
-                    if linecontent is None:
-                        raise RuntimeError("No ITEM: in the dump file")
-                    elif linecontent == self.LineType.ATOMS:
-                        s = line.split()
-                        ids.append(int(s[self.id_idx]))
-                        step_atoms.append(
-                            Atom(
-                                self.atomname[int(s[self.tidx]) - 1],
-                                (
-                                    float(s[self.xidx]),
-                                    float(s[self.yidx]),
-                                    float(s[self.zidx]),
-                                ),
-                            )
-                        )
-                    elif linecontent == self.LineType.BOX:
-                        s = line.split()
-                        ss.append(list(map(float, s)))
+        iatoms = None
+        for ii, line in enumerate(lines):
+            if line.startswith("ITEM:"):
+                linecontent = self.LineType.linecontent(line)
+                if linecontent == self.LineType.ATOMS:
+                    iatoms = ii + 1
+                    break
+            else:
+                if linecontent is None:
+                    raise RuntimeError("No ITEM: in the dump file")
+                elif linecontent == self.LineType.BOX:
+                    s = line.split()
+                    ss.append(list(map(float, s)))
+        if iatoms is None:
+            raise RuntimeError("No ITEM: ATOMS in the dump file")
+        atomlines = [line for line in lines[iatoms : iatoms + self._N] if line]
+        data = np.loadtxt(
+            atomlines,
+            usecols=(self.id_idx, self.tidx, self.xidx, self.yidx, self.zidx),
+            ndmin=2,
+        )
+        return self._dumparrays(data, np.array(ss))
+
+    @staticmethod
+    def _dumparrays(data, ss) -> dict:
+        """Sort atoms by IDs and convert the box bounds to the cell.
+
+        Parameters
+        ----------
+        data : numpy.ndarray (N, 5)
+            The columns id, type, x, y and z of atoms.
+        ss : numpy.ndarray (3, 2) or (3, 3)
+            The box bounds in the LAMMPS dump file, with the tilt factors xy,
+            xz and yz in the third column for triclinic boxes.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            The arrays returned by `readarrays`.
+        """
+        ids = data[:, 0].astype(np.int32)
+        # sort by ID
+        data = data[np.argsort(ids, kind="stable")]
         # box information to 3x3 cell
-        ss = np.array(ss)
         if ss.shape[1] > 2:
             xy = ss[0][2]
             xz = ss[1][2]
@@ -339,10 +562,12 @@ class DetectDump(Detect):
         boxsize = np.array(
             [[xhi - xlo, 0.0, 0.0], [xy, yhi - ylo, 0.0], [xz, yz, zhi - zlo]]
         )
-        # sort by ID
-        step_atoms_ = [x for (y, x) in sorted(zip(ids, step_atoms))]
-        step_atoms = Atoms(step_atoms_, cell=boxsize, pbc=self.pbc)
-        return step_atoms, ids
+        return {
+            "ids": ids,
+            "types": data[:, 1].astype(np.int32),
+            "positions": data[:, 2:5],
+            "cell": boxsize,
+        }
 
     class LineType(Enum):
         """Line type in the LAMMPS dump files."""
@@ -365,3 +590,209 @@ class DetectDump(Detect):
             if line.startswith("ITEM: BOX"):
                 return cls.BOX
             return cls.OTHER
+
+
+def _readbinaryheader(read):
+    """Read the header of a frame in the LAMMPS binary dump file.
+
+    Both the old format and the new format with the magic string (LAMMPS
+    2019 and later) are supported, following `tools/binary2txt.cpp` of LAMMPS.
+
+    Parameters
+    ----------
+    read : function
+        A function that reads the given number of bytes.
+
+    Returns
+    -------
+    dict or None
+        timestep, natoms, bounds (3, 2) or (3, 3), size_one, columns (list of
+        strs or None) and nchunk. None if the end of the file is reached.
+    """
+    data = read(8)
+    if len(data) < 8:
+        return None
+    (timestep,) = struct.unpack("=q", data)
+    revision = 0
+    if timestep < 0:
+        # magic string, endian flag and revision
+        read(-timestep)
+        _, revision, timestep = struct.unpack("=iiq", read(16))
+    natoms, triclinic = struct.unpack("=qi", read(12))
+    # boundary flags
+    read(24)
+    bounds = np.frombuffer(read(72 if triclinic else 48), dtype=np.float64)
+    if triclinic:
+        # xlo xhi ylo yhi zlo zhi xy xz yz
+        bounds = np.column_stack((bounds[:6].reshape(3, 2), bounds[6:]))
+    else:
+        bounds = bounds.reshape(3, 2)
+    (size_one,) = struct.unpack("=i", read(4))
+    columns = None
+    if revision > 1:
+        # unit style
+        read(struct.unpack("=i", read(4))[0])
+        if read(1) != b"\0":
+            # time
+            read(8)
+        columns = read(struct.unpack("=i", read(4))[0]).decode().split()
+    (nchunk,) = struct.unpack("=i", read(4))
+    return {
+        "timestep": timestep,
+        "natoms": natoms,
+        "bounds": bounds,
+        "size_one": size_one,
+        "columns": columns,
+        "nchunk": nchunk,
+    }
+
+
+class _BufferReader:
+    """Read bytes from a buffer sequentially."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def __call__(self, size):
+        self.offset += size
+        return self.data[self.offset - size : self.offset]
+
+
+class DetectBinaryDump(DetectDump):
+    """Detect from the LAMMPS binary dump file.
+
+    The binary dump is written by LAMMPS when the filename ends with ".bin".
+    Each frame has a header followed by chunks of per-atom values in double
+    precision, which are read with `numpy.frombuffer` without parsing text.
+
+    Parameters
+    ----------
+    columns : list of strs, optional, default=None
+        The columns of the dump file, such as ["id", "type", "x", "y", "z"],
+        which should contain id, type, x, y and z. If None (default), the
+        columns are read from the file, which is only available in the new
+        format (LAMMPS 2019 and later).
+    """
+
+    binary = True
+
+    def __init__(self, *args, columns=None, **kwargs):
+        self.columns = columns
+        super().__init__(*args, **kwargs)
+
+    def _readN(self):
+        with open(
+            self.filename if isinstance(self.filename, str) else self.filename[0], "rb"
+        ) as f:
+            data = next(self.iterframes(f), (0, None))[1]
+        if data is None:
+            raise RuntimeError("The binary dump file is empty")
+        header = _readbinaryheader(_BufferReader(data))
+        if header is None:
+            raise RuntimeError("The binary dump file is empty")
+        columns = self.columns if self.columns is not None else header["columns"]
+        if columns is None:
+            raise RuntimeError(
+                "The columns of the binary dump file should be given, as they "
+                "are not written in the old format"
+            )
+        if len(columns) != header["size_one"]:
+            raise RuntimeError(
+                f"{len(columns)} columns are given, but the binary dump file "
+                f"has {header['size_one']} columns"
+            )
+        try:
+            self.id_idx = columns.index("id")
+            self.tidx = columns.index("type")
+            self.xidx = columns.index("x")
+            self.yidx = columns.index("y")
+            self.zidx = columns.index("z")
+        except ValueError as e:
+            raise RuntimeError(
+                "The binary dump file should have columns id, type, x, y and z"
+            ) from e
+        self._N = header["natoms"]
+        arrays = self.readarrays(data)
+        self.atomtype = arrays["types"].astype(int)
+        self.atomnames = self.atomname[self.atomtype - 1]
+        self.atomnumbers = np.array([atomic_numbers[name] for name in self.atomname])
+        # frames are not split by lines
+        return None
+
+    def iterframes(self, f):
+        """Split a binary dump file into frames.
+
+        Only headers are read and parsed to find the size of each frame.
+
+        Parameters
+        ----------
+        f : File object
+            The file object opened in the binary mode.
+
+        Yields
+        ------
+        offset: int
+            The byte offset of the frame.
+        data: BinaryFrame
+            The content of the frame.
+        """
+        offset = f.tell()
+        while True:
+            pending = []
+
+            def read(size):
+                pending.append(f.read(size))
+                return pending[-1]
+
+            header = _readbinaryheader(read)
+            if header is None:
+                return
+            for _ in range(header["nchunk"]):
+                (n,) = struct.unpack("=i", read(4))
+                read(n * 8)
+            data = BinaryFrame(b"".join(pending))
+            yield offset, data
+            offset += len(data)
+
+    def readtimestep(self, data: bytes) -> int:
+        """Read the timestep from the content of a frame.
+
+        Parameters
+        ----------
+        data : bytes
+            The content of the frame in the LAMMPS binary dump file.
+
+        Returns
+        -------
+        int
+            The timestep.
+        """
+        header = _readbinaryheader(_BufferReader(data))
+        assert header is not None
+        return header["timestep"]
+
+    def readarrays(self, lines) -> dict:
+        """Read arrays of a frame, which are stored in the binary cache.
+
+        Parameters
+        ----------
+        lines : bytes
+            The content of the frame in the LAMMPS binary dump file.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            The arrays returned by `DetectDump.readarrays`.
+        """
+        read = _BufferReader(lines)
+        header = _readbinaryheader(read)
+        assert header is not None
+        chunks = []
+        for _ in range(header["nchunk"]):
+            (n,) = struct.unpack("=i", read(4))
+            chunks.append(np.frombuffer(lines, np.float64, n, read.offset))
+            read.offset += n * 8
+        data = np.concatenate(chunks).reshape(-1, header["size_one"])
+        data = data[:, [self.id_idx, self.tidx, self.xidx, self.yidx, self.zidx]]
+        return self._dumparrays(data, header["bounds"])
@@ -1 +1,7 @@
+import numpy as np
+from numpy.typing import ArrayLike
+
+def dps_csr(
+    indptr: ArrayLike, indices: ArrayLike
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]: ...
 def dps(bonds: list[list[int]]) -> list[list[int]]: ...
@@ -5,42 +5,133 @@
 """Connect molecule with Depth-First Search."""
 from libc.stdlib cimport malloc, free
 
+from itertools import chain
+
 import cython
+import numpy as np
+
+
+cdef Py_ssize_t _connect(
+    Py_ssize_t n,
+    const int *indptr,
+    const int *indices,
+    int *labels,
+    int *molptr,
+    int *members,
+    int *stack,
+) noexcept nogil:
+    """Label connected components with an iterative DFS.
+
+    Atoms in each molecule are in the order they are visited, which is the
+    same as the recursive search pushing bonded atoms in order.
+    """
+    cdef Py_ssize_t i, ib, top, nmol = 0, nmember = 0
+    cdef int s, b_c
+    for i in range(n):
+        labels[i] = -1
+    for i in range(n):
+        if labels[i] >= 0:
+            continue
+        molptr[nmol] = <int> nmember
+        stack[0] = <int> i
+        top = 1
+        while top > 0:
+            top -= 1
+            s = stack[top]
+            if labels[s] >= 0:
+                continue
+            labels[s] = <int> nmol
+            members[nmember] = s
+            nmember += 1
+            for ib in range(indptr[s], indptr[s + 1]):
+                b_c = indices[ib]
+                if labels[b_c] < 0:
+                    stack[top] = b_c
+                    top += 1
+        nmol += 1
+    molptr[nmol] = <int> nmember
+    return nmol
+
+
+cdef size_t _address(a):
+    # the buffer protocol is not in the limited API of Python 3.7
+    return a.__array_interface__["data"][0]
 
-cdef extern from "c_stack.h":
-    # This function is copied from https://zhuanlan.zhihu.com/p/38212302
-    cdef cppclass C_Stack:
-        void push(int val)
-        int pop()
+
+@cython.binding(False)
+def dps_csr(indptr, indices):
+    """Find molecules from the bonds in the CSR format.
+
+    Parameters
+    ----------
+    indptr : array_like of int, shape (N+1,)
+        The bonded atoms of the atom i are indices[indptr[i]:indptr[i+1]].
+    indices : array_like of int
+        Indexes of bonded atoms.
+
+    Returns
+    -------
+    labels : numpy.ndarray of int32, shape (N,)
+        The molecule of each atom.
+    molptr : numpy.ndarray of int32, shape (M+1,)
+        The atoms of the molecule j are members[molptr[j]:molptr[j+1]].
+    members : numpy.ndarray of int32, shape (N,)
+        Indexes of atoms in molecules.
+    """
+    indptr = np.ascontiguousarray(indptr, dtype=np.intc)
+    indices = np.ascontiguousarray(indices, dtype=np.intc)
+    cdef Py_ssize_t n = indptr.shape[0] - 1
+    cdef Py_ssize_t nnz = indices.shape[0]
+    if (
+        n < 0
+        or indptr[0] != 0
+        or indptr[n] != nnz
+        or np.any(np.diff(indptr) < 0)
+        or (nnz and (indices.min() < 0 or indices.max() >= n))
+    ):
+        raise RuntimeError("Invalid bonds in the CSR format.")
+    labels = np.empty(n, dtype=np.intc)
+    molptr = np.empty(n + 1, dtype=np.intc)
+    members = np.empty(n, dtype=np.intc)
+    cdef const int *c_indptr = <const int *> _address(indptr)
+    cdef const int *c_indices = <const int *> _address(indices)
+    cdef int *c_labels = <int *> _address(labels)
+    cdef int *c_molptr = <int *> _address(molptr)
+    cdef int *c_members = <int *> _address(members)
+    # every atom is pushed at most once per bond, besides the first one
+    cdef int *stack = <int *> malloc((nnz + 1) * sizeof(int))
+    if stack == NULL:
+        raise MemoryError()
+    cdef Py_ssize_t nmol
+    with nogil:
+        nmol = _connect(
+            n, c_indptr, c_indices, c_labels, c_molptr, c_members, stack
+        )
+    free(stack)
+    return labels, molptr[: nmol + 1].copy(), members
 
 
 @cython.binding(False)
 def dps(bonds):
-    molecule = []
-    cdef int _N = len(bonds)
-    cdef int *visited = <int *> malloc(_N * sizeof(int))
-    cdef int i, s, b_c, nbonds, ib
-    cdef C_Stack st
-    for i in range(_N):
-        visited[i]=0
-
-    for i in range(_N):
-        if visited[i]==0:
-            mol = []
-            st.push(i)
-            while True:
-                s = st.pop()
-                if s < 0:
-                    break
-                elif visited[s]==1:
-                    continue
-                mol.append(s)
-                nbonds = len(bonds[s])
-                for ib in range(nbonds):
-                    b_c = bonds[s][ib]
-                    if visited[b_c]==0:
-                        st.push(b_c)
-                visited[s]=1
-            molecule.append(mol)
-    free(visited)
-    return molecule
+    """Find molecules from the bonded atoms of each atom.
+
+    Parameters
+    ----------
+    bonds : list of lists of int
+        Indexes of bonded atoms of each atom.
+
+    Returns
+    -------
+    list of lists of int
+        Indexes of atoms in molecules.
+    """
+    lengths = np.fromiter(map(len, bonds), dtype=np.intc, count=len(bonds))
+    indptr = np.zeros(len(bonds) + 1, dtype=np.intc)
+    np.cumsum(lengths, out=indptr[1:])
+    indices = np.fromiter(
+        chain.from_iterable(bonds), dtype=np.intc, count=indptr[-1]
+    )
+    _, molptr, members = dps_csr(indptr, indices)
+    members = members.tolist()
+    molptr = molptr.tolist()
+    return [members[start:end] for start, end in zip(molptr[:-1], molptr[1:])]
@@ -0,0 +1,394 @@
+"""Features of atoms for clustering."""
+
+import shutil
+from collections import Counter
+
+import numpy as np
+from ase.data import atomic_numbers
+from ase.geometry import find_mic
+
+from . import profiler
+
+
+class FeatureMatrix:
+    """Assemble the Coulumb matrix features of a bond type.
+
+    The eigenvalues of each atom are filled in place into a preallocated matrix,
+    whose number of columns grows geometrically when a larger cluster appears.
+    The missing atoms of each element are padded with the diagonal element of
+    the Coulumb matrix when the matrix is assembled.
+
+    Parameters
+    ----------
+    n_atoms : int
+        The number of atoms of the bond type.
+    coulumbdiag : dict
+        The diagonal elements of the Coulumb matrix for each element, which are
+        used to fill the missing atoms.
+    capacity : int, optional, default=32
+        The initial number of columns.
+    """
+
+    def __init__(self, n_atoms, coulumbdiag, capacity=32):
+        # the symbols may be NumPy strings, which are logged with their type
+        self.elements = [str(element) for element in coulumbdiag]
+        self._elementindex = {element: i for i, element in enumerate(self.elements)}
+        self.diag = np.array([coulumbdiag[element] for element in self.elements])
+        self.stepatom = np.zeros((n_atoms, 2), dtype=int)
+        self.counts = np.zeros((n_atoms, len(self.elements)), dtype=np.int32)
+        self._values = np.zeros((n_atoms, capacity))
+        self.n = 0
+        self._assembled = False
+
+    def append(self, stepatoma, vector, symbols_counter):
+        """Append the feature of an atom.
+
+        Parameters
+        ----------
+        stepatoma : numpy.ndarray (2,)
+            Contains two elements: step and atom ID.
+        vector : numpy.ndarray (N,)
+            The eigenvalues of columb matrix.
+        symbols_counter : collections.Counter
+            The elements of atoms.
+        """
+        j = self.n
+        length = len(vector)
+        if length > self._values.shape[1]:
+            self._grow(length)
+        self.stepatom[j] = stepatoma
+        self._values[j, :length] = vector
+        for element, count in symbols_counter.items():
+            self.counts[j, self._elementindex[element]] = count
+        self.n += 1
+
+    def _grow(self, length):
+        """Grow the number of columns to at least `length`."""
+        capacity = max(length, self._values.shape[1] * 3 // 2)
+        values = np.zeros((self._values.shape[0], capacity))
+        values[:, : self._values.shape[1]] = self._values
+        self._values = values
+
+    @property
+    def max_counter(self):
+        """collections.Counter: The maximum number of atoms of each element."""
+        if not self.n:
+            return Counter()
+        return Counter(
+            {
+                element: int(count)
+                for element, count in zip(
+                    self.elements, self.counts[: self.n].max(axis=0)
+                )
+                if count
+            }
+        )
+
+    def assemble(self, chunksize=65536):
+        """Pad the missing atoms and sort the features of each atom in place.
+
+        The features are assembled only once, so no more atoms should be
+        appended after that.
+
+        Parameters
+        ----------
+        chunksize : int, optional, default=65536
+            The number of rows processed at once.
+
+        Returns
+        -------
+        numpy.ndarray (n_atoms, n_features)
+            The sorted features. The matrix is a view of the internal buffer.
+        """
+        width = self._width
+        if self._assembled:
+            return self._values[: self.n, :width]
+        if width > self._values.shape[1]:
+            self._grow(width)
+        X = self._values[: self.n, :width]
+        self._assembled = True
+        for start in range(0, self.n, chunksize):
+            self._pad(
+                X[start : start + chunksize], self.counts[start : start + chunksize]
+            )
+        return X
+
+    def iterchunks(self, chunksize=65536):
+        """Iterate over the sorted features in chunks.
+
+        Parameters
+        ----------
+        chunksize : int, optional, default=65536
+            The number of rows in each chunk.
+
+        Yields
+        ------
+        numpy.ndarray (n_rows, n_features)
+            The sorted features of a chunk of atoms.
+        """
+        X = self.assemble(chunksize)
+        for start in range(0, self.n, chunksize):
+            yield X[start : start + chunksize]
+
+    @property
+    def _max_counts(self):
+        if not self.n:
+            return np.zeros_like(self.diag, dtype=self.counts.dtype)
+        return self.counts[: self.n].max(axis=0)
+
+    @property
+    def _width(self):
+        return int(self._max_counts.sum())
+
+    def _pad(self, x, c):
+        """Pad the missing atoms of rows `x` with counts `c` and sort in place."""
+        max_counts = self._max_counts
+        columns = np.arange(x.shape[1])
+        begin = c.sum(axis=1)
+        for ii, deficit in enumerate((max_counts - c).T):
+            end = begin + deficit
+            x[(columns >= begin[:, None]) & (columns < end[:, None])] = self.diag[ii]
+            begin = end
+        x.sort(axis=1)
+
+
+class DiskFeatureMatrix(FeatureMatrix):
+    """Store the Coulumb matrix features of a bond type on the disk.
+
+    The eigenvalues are appended to a file without padding, and only the atoms,
+    the element counts and the number of eigenvalues of each atom are kept in
+    memory. The features are padded and sorted chunk by chunk when they are
+    read, so the memory is bounded by the chunk size.
+
+    Parameters
+    ----------
+    n_atoms : int
+        The number of atoms of the bond type.
+    coulumbdiag : dict
+        The diagonal elements of the Coulumb matrix for each element, which are
+        used to fill the missing atoms.
+    filename : str
+        The file to store the eigenvalues.
+    """
+
+    def __init__(self, n_atoms, coulumbdiag, filename):
+        super().__init__(n_atoms, coulumbdiag, capacity=0)
+        self.filename = filename
+        self.lengths = np.zeros(n_atoms, dtype=np.int64)
+        self._f = open(filename, "wb")
+
+    def append(self, stepatoma, vector, symbols_counter):
+        """Append the feature of an atom.
+
+        Parameters
+        ----------
+        stepatoma : numpy.ndarray (2,)
+            Contains two elements: step and atom ID.
+        vector : numpy.ndarray (N,)
+            The eigenvalues of columb matrix.
+        symbols_counter : collections.Counter
+            The elements of atoms.
+        """
+        if self._f is None:
+            raise RuntimeError(f"{self.filename} is not opened for appending")
+        j = self.n
+        self.stepatom[j] = stepatoma
+        self.lengths[j] = len(vector)
+        data = np.asarray(vector, dtype=np.float64).tobytes()
+        self._f.write(data)
+        profiler.count("write_bytes", len(data))
+        for element, count in symbols_counter.items():
+            self.counts[j, self._elementindex[element]] = count
+        self.n += 1
+
+    def __getstate__(self):
+        """Return the state for pickling, without the file object."""
+        state = self.__dict__.copy()
+        state["_f"] = None
+        return state
+
+    def close(self):
+        """Close the file."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def save(self):
+        """Save the atoms, the element counts and the number of eigenvalues.
+
+        They are saved to `{filename}.npz` next to the eigenvalues, so the
+        store can be loaded by `load`.
+        """
+        self.close()
+        np.savez(
+            f"{self.filename}.npz",
+            stepatom=self.stepatom[: self.n],
+            counts=self.counts[: self.n],
+            lengths=self.lengths[: self.n],
+        )
+
+    @classmethod
+    def load(cls, filename, coulumbdiag):
+        """Load a store saved by `save`.
+
+        Parameters
+        ----------
+        filename : str
+            The file of the eigenvalues.
+        coulumbdiag : dict
+            The diagonal elements of the Coulumb matrix for each element, which
+            should be the same as the saved store.
+
+        Returns
+        -------
+        DiskFeatureMatrix
+            The store, whose file is not opened for appending.
+        """
+        with np.load(f"{filename}.npz") as data:
+            store = cls.__new__(cls)
+            FeatureMatrix.__init__(store, 0, coulumbdiag, capacity=0)
+            store.filename = filename
+            store._f = None
+            store.stepatom = data["stepatom"]
+            store.counts = data["counts"]
+            store.lengths = data["lengths"]
+            store.n = len(store.stepatom)
+        return store
+
+    def extend(self, other):
+        """Append all atoms of another store.
+
+        Parameters
+        ----------
+        other : DiskFeatureMatrix
+            The store.
+        """
+        if self._f is None:
+            raise RuntimeError(f"{self.filename} is not opened for appending")
+        j = self.n
+        n = other.n
+        self.stepatom[j : j + n] = other.stepatom[:n]
+        self.counts[j : j + n] = other.counts[:n]
+        self.lengths[j : j + n] = other.lengths[:n]
+        if other._f is not None:
+            other._f.flush()
+        with open(other.filename, "rb") as f:
+            shutil.copyfileobj(f, self._f)
+        self.n += n
+
+    def assemble(self, chunksize=65536):
+        """Read all the sorted features into memory.
+
+        Parameters
+        ----------
+        chunksize : int, optional, default=65536
+            The number of rows processed at once.
+
+        Returns
+        -------
+        numpy.ndarray (n_atoms, n_features)
+            The sorted features.
+        """
+        X = np.zeros((self.n, self._width))
+        for start, x in zip(range(0, self.n, chunksize), self.iterchunks(chunksize)):
+            X[start : start + chunksize] = x
+        return X
+
+    def iterchunks(self, chunksize=65536):
+        """Iterate over the sorted features in chunks.
+
+        Parameters
+        ----------
+        chunksize : int, optional, default=65536
+            The number of rows in each chunk.
+
+        Yields
+        ------
+        numpy.ndarray (n_rows, n_features)
+            The sorted features of a chunk of atoms.
+        """
+        if self._f is not None:
+            self._f.flush()
+        width = self._width
+        lengths = self.lengths[: self.n]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        if not offsets[-1]:
+            for start in range(0, self.n, chunksize):
+                yield np.zeros((len(lengths[start : start + chunksize]), width))
+            return
+        values = np.memmap(self.filename, dtype=np.float64, mode="r")
+        for start in range(0, self.n, chunksize):
+            length = lengths[start : start + chunksize]
+            x = np.zeros((len(length), width))
+            rows = np.repeat(np.arange(len(length)), length)
+            columns = np.arange(length.sum()) - np.repeat(
+                np.cumsum(length) - length, length
+            )
+            x[rows, columns] = values[offsets[start] : offsets[start + len(length)]]
+            self._pad(x, self.counts[start : start + chunksize])
+            yield x
+        del values
+
+
+@profiler.timed("coulumbspectra")
+def coulumbspectra(atoms, clusters, coulumbdiag, chunksize=1 << 22):
+    """Calculate the eigenvalues of Coulumb matrices of clusters in a frame.
+
+    Clusters with the same number of atoms are stacked together, so that the
+    Coulumb matrices are built with broadcasting and diagonalized with one
+    stacked `numpy.linalg.eigh` call. Clusters are not padded to a common
+    size, as padding would change the spectra.
+
+    Parameters
+    ----------
+    atoms : ase.Atoms
+        The atoms of the frame.
+    clusters : list of numpy.ndarray
+        The indexes of atoms in each cluster.
+    coulumbdiag : dict
+        The diagonal elements of the Coulumb matrix for each element.
+    chunksize : int, optional, default=4194304
+        The maximum number of matrix elements diagonalized at once.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        The sorted eigenvalues of the Coulumb matrix of each cluster.
+    """
+    numbers = atoms.numbers
+    diag = np.zeros(max(atomic_numbers.values()) + 1)
+    for element, value in coulumbdiag.items():
+        diag[atomic_numbers[element]] = value
+    pbc = np.array(atoms.pbc, dtype=bool)
+    sizes = np.array([len(cluster) for cluster in clusters], dtype=int)
+    spectra = [None] * len(clusters)
+    for n in np.unique(sizes).tolist():
+        members = np.flatnonzero(sizes == n)
+        iu, ju = np.triu_indices(n, 1)
+        diagonal = np.arange(n)
+        batchsize = max(1, chunksize // (n * n))
+        for start in range(0, len(members), batchsize):
+            batch = members[start : start + batchsize]
+            ids = np.array([clusters[k] for k in batch], dtype=int).reshape(-1, n)
+            positions = atoms.positions[ids]
+            # the same pairs and vectors as ase.Atoms.get_all_distances
+            vectors = (positions[:, ju] - positions[:, iu]).reshape(-1, 3)
+            if pbc.any():
+                _, lengths = find_mic(vectors, atoms.cell, pbc)
+            else:
+                lengths = np.linalg.norm(vectors, axis=1)
+            r = np.zeros((len(batch), n, n))
+            r[:, iu, ju] = lengths.reshape(len(batch), -1)
+            r += r.transpose(0, 2, 1)
+            z = numbers[ids].astype(np.float64)
+            top = z[:, :, None] * z[:, None, :]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                np.divide(top, r, top)
+            top[:, diagonal, diagonal] = diag[numbers[ids]]
+            top[np.isinf(top)] = 0
+            top[np.isnan(top)] = 0
+            with profiler.timer("eigh"):
+                values = np.linalg.eigh(top)[0]
+            for k, eigvals in zip(batch.tolist(), values):
+                spectra[k] = eigvals
+    return spectra
@@ -0,0 +1,209 @@
+"""Index of frames in trajectory files."""
+
+import hashlib
+import os
+
+import numpy as np
+
+
+def iterframes(f, steplinenum, chunksize=1 << 24):
+    """Split a text trajectory into frames with a fixed number of lines.
+
+    The file is read in large chunks, and newlines are located with NumPy.
+
+    Parameters
+    ----------
+    f : File object
+        The file object opened in the binary mode.
+    steplinenum : int
+        The number of lines in each frame.
+    chunksize : int, optional, default=16777216
+        The number of bytes read at once.
+
+    Yields
+    ------
+    offset: int
+        The byte offset of the frame.
+    data: bytes
+        The content of the frame.
+    """
+    start = f.tell()
+    pending = []
+    need = steplinenum
+    while True:
+        chunk = f.read(chunksize)
+        if not chunk:
+            break
+        nl = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+        ends = nl[need - 1 :: steplinenum] + 1
+        last = 0
+        for end in ends:
+            pending.append(chunk[last:end])
+            data = b"".join(pending)
+            yield start, data
+            start += len(data)
+            pending = []
+            last = end
+        pending.append(chunk[last:])
+        if len(ends):
+            need = steplinenum - (len(nl) - need - (len(ends) - 1) * steplinenum)
+        else:
+            need -= len(nl)
+    data = b"".join(pending)
+    if data:
+        yield start, data
+
+
+class BinaryFrame(bytes):
+    """The content of a frame in a binary trajectory, which is not decoded."""
+
+
+def decodeframe(data):
+    """Decode the content of a frame into lines.
+
+    Parameters
+    ----------
+    data : bytes
+        The content of the frame.
+
+    Returns
+    -------
+    list of strs or BinaryFrame
+        Lines of the frame, or the frame itself if it is binary.
+    """
+    if isinstance(data, BinaryFrame):
+        return data
+    return data.decode().splitlines(keepends=True)
+
+
+class FrameIndex:
+    """Byte offsets, lengths and timesteps of frames in a trajectory file.
+
+    Parameters
+    ----------
+    filename : str
+        The filename of the trajectory.
+    offsets : numpy.ndarray
+        The byte offset of each frame.
+    lengths : numpy.ndarray
+        The byte length of each frame.
+    timesteps : numpy.ndarray
+        The timestep of each frame.
+    """
+
+    def __init__(self, filename, offsets, lengths, timesteps):
+        self.filename = filename
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.timesteps = np.asarray(timesteps, dtype=np.int64)
+
+    def __len__(self):
+        """Return the number of frames."""
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, filename, detector):
+        """Build the index by scanning the file.
+
+        Parameters
+        ----------
+        filename : str
+            The filename of the trajectory.
+        detector : mddatasetbuilder.detect.Detect
+            File detector.
+
+        Returns
+        -------
+        FrameIndex
+            The index of the file.
+        """
+        offsets = []
+        lengths = []
+        timesteps = []
+        with open(filename, "rb") as f:
+            for offset, data in detector.iterframes(f):
+                offsets.append(offset)
+                lengths.append(len(data))
+                timesteps.append(detector.readtimestep(data))
+        return cls(filename, offsets, lengths, timesteps)
+
+    @staticmethod
+    def path(directory, filename):
+        """Return the path of the index file for a trajectory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to save the index.
+        filename : str
+            The filename of the trajectory.
+
+        Returns
+        -------
+        str
+            The path of the index file.
+        """
+        key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16]
+        return os.path.join(directory, f"frameindex.{key}.npz")
+
+    def save(self, directory):
+        """Save the index to the directory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to save the index.
+        """
+        stat = os.stat(self.filename)
+        with open(self.path(directory, self.filename), "wb") as f:
+            np.savez(
+                f,
+                offsets=self.offsets,
+                lengths=self.lengths,
+                timesteps=self.timesteps,
+                stat=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+            )
+
+    @classmethod
+    def load(cls, directory, filename):
+        """Load the index of a trajectory from the directory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory where the index is saved.
+        filename : str
+            The filename of the trajectory.
+
+        Returns
+        -------
+        FrameIndex or None
+            The index. None if the index does not exist or the trajectory has
+            been modified.
+        """
+        path = cls.path(directory, filename)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(filename)
+        with np.load(path) as data:
+            if data["stat"].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                return None
+            return cls(filename, data["offsets"], data["lengths"], data["timesteps"])
+
+    def read(self, f, i):
+        """Read a frame by seeking to its offset.
+
+        Parameters
+        ----------
+        f : File object
+            The file object opened in the binary mode.
+        i : int
+            The index of the frame.
+
+        Returns
+        -------
+        bytes
+            The content of the frame.
+        """
+        f.seek(self.offsets[i])
+        return f.read(self.lengths[i])
@@ -0,0 +1,107 @@
+"""Manifest of a resumable work directory."""
+
+import json
+import os
+
+from ._logger import logger
+
+
+def fileinfo(filenames):
+    """Return the absolute paths, sizes and modification times of files.
+
+    Parameters
+    ----------
+    filenames : list of strs
+        The filenames.
+
+    Returns
+    -------
+    list of lists
+        The absolute path, size and modification time (ns) of each file.
+    """
+    info = []
+    for fn in filenames:
+        stat = os.stat(fn)
+        info.append([os.path.abspath(fn), stat.st_size, stat.st_mtime_ns])
+    return info
+
+
+class Manifest:
+    """Record the finished steps of building a dataset in a work directory.
+
+    The manifest is saved after each step and after each checkpoint inside a
+    step. Each step has the parameters (including input files) it depends on;
+    when the manifest is loaded, a finished step is kept only if its parameters
+    and those of all previous steps are unchanged.
+
+    Parameters
+    ----------
+    directory : str
+        The work directory.
+    parameters : list of dicts
+        The parameters that each step depends on. They should be serializable
+        to JSON.
+    """
+
+    filename = "manifest.json"
+
+    def __init__(self, directory, parameters):
+        self.path = os.path.join(directory, self.filename)
+        self.parameters = json.loads(json.dumps(parameters))
+        self.stages = []
+        self.progress = {}
+
+    def load(self):
+        """Load the finished steps from the work directory."""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        for saved, parameters in zip(data["parameters"], self.parameters):
+            if saved != parameters:
+                logger.warning(
+                    f"Inputs or parameters of step {len(self.stages) + 1} have "
+                    "changed since the last run. Start from this step."
+                )
+                return
+            if len(self.stages) == len(data["stages"]):
+                self.progress = data["progress"]
+                return
+            self.stages.append(data["stages"][len(self.stages)])
+
+    def save(self):
+        """Save the manifest to the work directory."""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "parameters": self.parameters,
+                    "stages": self.stages,
+                    "progress": self.progress,
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+    def complete(self, state):
+        """Mark the current step as finished.
+
+        Parameters
+        ----------
+        state : dict
+            The state needed by the following steps.
+        """
+        self.stages.append(state)
+        self.progress = {}
+        self.save()
+
+    def checkpoint(self, progress):
+        """Save the progress of the current step.
+
+        Parameters
+        ----------
+        progress : dict
+            The progress of the current step.
+        """
+        self.progress = progress
+        self.save()
@@ -0,0 +1,66 @@
+"""Molecules of a frame."""
+
+import itertools
+
+import numpy as np
+
+
+class MoleculeIndex:
+    """Index of the molecule of each atom in a frame.
+
+    The atoms of molecules are stored in the CSR format, so the molecules
+    containing given atoms are gathered without looping over all molecules.
+
+    Parameters
+    ----------
+    molecules : list of lists of int
+        Indexes of atoms in molecules.
+    natoms : int, optional, default=None
+        The number of atoms. If None (default), it is the total number of
+        atoms in molecules.
+    """
+
+    def __init__(self, molecules, natoms=None):
+        lengths = np.fromiter(map(len, molecules), dtype=np.intp, count=len(molecules))
+        self.indptr = np.zeros(len(molecules) + 1, dtype=np.intp)
+        np.cumsum(lengths, out=self.indptr[1:])
+        self.indices = np.fromiter(
+            itertools.chain.from_iterable(molecules),
+            dtype=np.intp,
+            count=self.indptr[-1],
+        )
+        # atom -> molecule
+        self.labels = np.full(
+            self.indptr[-1] if natoms is None else natoms, -1, dtype=np.intp
+        )
+        self.labels[self.indices] = np.repeat(np.arange(len(molecules)), lengths)
+
+    def take(self, atomids):
+        """Return the atoms of molecules containing any of given atoms.
+
+        Parameters
+        ----------
+        atomids : array_like of int
+            Indexes of atoms.
+
+        Returns
+        -------
+        idx : numpy.ndarray
+            Indexes of atoms in the molecules, molecule by molecule in the
+            order of molecules.
+        ranges : list of ranges
+            The range of each molecule in `idx`.
+        """
+        mols = np.unique(self.labels[np.asarray(atomids, dtype=np.intp)])
+        starts = self.indptr[mols]
+        lengths = self.indptr[mols + 1] - starts
+        ends = np.cumsum(lengths)
+        # position of each output atom in indices
+        pos = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            starts - (ends - lengths), lengths
+        )
+        ranges = [
+            range(end - length, end)
+            for end, length in zip(ends.tolist(), lengths.tolist())
+        ]
+        return self.indices[pos], ranges
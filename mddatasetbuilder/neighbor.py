@@ -0,0 +1,141 @@
+"""Neighbor search in a frame."""
+
+import itertools
+
+import numpy as np
+
+from . import profiler
+
+
+class NeighborList:
+    """Find atoms within a cutoff of given atoms under the minimum image convention.
+
+    A KD-tree is built once for the frame and then queried for all centers.
+    Orthorhombic cells with full periodic boundary conditions use the periodic
+    KD-tree directly; other periodic cells are handled by adding ghost images
+    of atoms close to the cell boundaries.
+
+    Parameters
+    ----------
+    atoms : ase.Atoms
+        The atoms of the frame.
+    cutoff : float
+        The cutoff radius.
+    """
+
+    @profiler.timed("NeighborList.__init__")
+    def __init__(self, atoms, cutoff):
+        from scipy.spatial import KDTree
+
+        self.cutoff = cutoff
+        self.natoms = len(atoms)
+        cell = np.array(atoms.cell)
+        pbc = np.array(atoms.pbc, dtype=bool)
+        positions = atoms.positions
+        self._index = None
+        self._boxsize = None
+        if not pbc.any():
+            self.positions = positions
+            self._tree = KDTree(positions)
+        elif pbc.all() and not np.count_nonzero(cell - np.diag(np.diag(cell))):
+            # orthorhombic
+            boxsize = np.diag(cell)
+            positions = np.mod(positions, boxsize)
+            # np.mod may return boxsize due to round-off
+            positions[positions >= boxsize] = 0.0
+            self.positions = positions
+            self._boxsize = boxsize
+            self._tree = KDTree(positions, boxsize=boxsize)
+        else:
+            scaled = np.linalg.solve(cell.T, positions.T).T
+            wrapped = np.mod(scaled[:, pbc], 1.0)
+            # np.mod may return 1 due to round-off
+            wrapped[wrapped >= 1.0] = 0.0
+            scaled[:, pbc] = wrapped
+            self.positions = scaled @ cell
+            # the distance between two faces of the cell
+            volume = abs(np.linalg.det(cell))
+            spacing = volume / np.linalg.norm(
+                np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1
+            )
+            skin = np.where(pbc, cutoff / spacing, np.inf)
+            nimages = np.where(pbc, np.ceil(skin), 0).astype(int)
+            images = [self.positions]
+            index = [np.arange(self.natoms)]
+            for shift in itertools.product(*(range(-n, n + 1) for n in nimages)):
+                if not any(shift):
+                    continue
+                shifted = scaled + shift
+                mask = np.all((shifted > -skin) & (shifted < 1.0 + skin), axis=1)
+                images.append(shifted[mask] @ cell)
+                index.append(np.flatnonzero(mask))
+            self._index = np.concatenate(index)
+            self._tree = KDTree(np.concatenate(images))
+
+    @profiler.timed("NeighborList.query")
+    def query(self, centers):
+        """Return atoms within the cutoff of each center.
+
+        Parameters
+        ----------
+        centers : array_like of int
+            The indexes of center atoms (starting from 0).
+
+        Returns
+        -------
+        list of numpy.ndarray
+            Sorted indexes of atoms whose distances to each center are less than
+            the cutoff, including the center itself.
+        """
+        # distances should be less than the cutoff
+        r = np.nextafter(self.cutoff, 0)
+        results = self._tree.query_ball_point(
+            self.positions[np.asarray(centers, dtype=int)], r
+        )
+        neighbors = []
+        for result in results:
+            result = np.array(result, dtype=int)
+            if self._index is not None:
+                result = np.unique(self._index[result])
+            else:
+                result.sort()
+            neighbors.append(result)
+        return neighbors
+
+    def pairs(self):
+        """Return all pairs of atoms within the cutoff.
+
+        Returns
+        -------
+        i, j : numpy.ndarray
+            Indexes of the two atoms in each pair, where i < j.
+        vectors : numpy.ndarray
+            The minimum image vectors from atom i to atom j.
+        """
+        from scipy.spatial import KDTree
+
+        r = np.nextafter(self.cutoff, 0)
+        if self._index is None:
+            pairs = self._tree.query_pairs(r, output_type="ndarray")
+            i, j = pairs[:, 0], pairs[:, 1]
+            vectors = self.positions[j] - self.positions[i]
+            if self._boxsize is not None:
+                vectors -= np.round(vectors / self._boxsize) * self._boxsize
+        else:
+            pairs = KDTree(self.positions).sparse_distance_matrix(
+                self._tree, r, output_type="ndarray"
+            )
+            i = pairs["i"].astype(int)
+            image = pairs["j"].astype(int)
+            j = self._index[image]
+            mask = i < j
+            i, j, image = i[mask], j[mask], image[mask]
+            vectors = self._tree.data[image] - self.positions[i]
+            # keep the nearest image of each pair
+            order = np.lexsort((np.linalg.norm(vectors, axis=1), j, i))
+            i, j, vectors = i[order], j[order], vectors[order]
+            first = np.ones(len(i), dtype=bool)
+            first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+            i, j, vectors = i[first], j[first], vectors[first]
+        order = np.lexsort((j, i))
+        return i[order], j[order], vectors[order]
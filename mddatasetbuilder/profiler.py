@@ -0,0 +1,356 @@
+"""Profile the stages of building a dataset.
+
+Timers and counters are kept in each process, and do nothing unless the
+profiler is enabled. The stats of worker processes are sent back with the
+results of their tasks by `mddatasetbuilder.utils.WorkerPool`, and are merged
+into the parent process, which records the stats of each stage and writes them
+as a JSON report with a human-readable summary.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from ._logger import logger
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+_enabled = False
+_lock = threading.Lock()
+# name -> [seconds, calls]
+_timers = {}
+# name -> value
+_counters = {}
+# name -> [count, sum, max]
+_gauges = {}
+# stats of finished stages in the parent process
+_stages = []
+
+
+def enabled():
+    """Return whether the profiler is enabled in this process."""
+    return _enabled
+
+
+def enable(flag=True):
+    """Enable or disable the profiler in this process.
+
+    Parameters
+    ----------
+    flag : bool, optional, default=True
+        Enable or disable.
+    """
+    global _enabled
+    _enabled = flag
+
+
+def _addtime(name, seconds):
+    with _lock:
+        timer = _timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += 1
+
+
+def timed(name):
+    """Decorate a function to record its cumulative time and calls.
+
+    The time is inclusive, i.e. it contains the time of other timed functions
+    called by the function.
+
+    Parameters
+    ----------
+    name : str
+        The name of the timer.
+
+    Returns
+    -------
+    function
+        The decorator.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _addtime(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def timer(name):
+    """Record the time of a block like `timed`.
+
+    Parameters
+    ----------
+    name : str
+        The name of the timer.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _addtime(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    """Add a value to a counter, such as the number of bytes read.
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter.
+    value : int, optional, default=1
+        The value to add.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def countfile(name, filename):
+    """Add the size of a file to a counter, such as the number of bytes written.
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter.
+    filename : str
+        The filename.
+    """
+    if _enabled:
+        count(name, os.path.getsize(filename))
+
+
+def observe(name, value):
+    """Record a sample of a gauge, such as the depth of a queue.
+
+    Parameters
+    ----------
+    name : str
+        The name of the gauge.
+    value : float
+        The sample.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        gauge = _gauges.setdefault(name, [0, 0, value])
+        gauge[0] += 1
+        gauge[1] += value
+        gauge[2] = max(gauge[2], value)
+
+
+def peakmemory(reset=False):
+    """Return the peak resident memory of this process in bytes.
+
+    Parameters
+    ----------
+    reset : bool, optional, default=False
+        Reset the peak to the current resident memory, so the next call
+        returns the peak since now. Only supported on Linux.
+
+    Returns
+    -------
+    int
+        The peak resident memory, or 0 if unknown.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            peak = next(
+                int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:")
+            )
+        if reset:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        return peak
+    except (OSError, ValueError, StopIteration):
+        # not Linux: the peak of the whole process
+        if resource is None:
+            return 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def collect():
+    """Return and reset the stats of this process.
+
+    Returns
+    -------
+    dict
+        The timers, counters and gauges, which can be passed to `merge`.
+    """
+    global _timers, _counters, _gauges
+    with _lock:
+        stats = {"timers": _timers, "counters": _counters, "gauges": _gauges}
+        _timers, _counters, _gauges = {}, {}, {}
+    return stats
+
+
+def merge(stats):
+    """Merge the stats of another process into this process.
+
+    Parameters
+    ----------
+    stats : dict
+        The stats returned by `collect`.
+    """
+    with _lock:
+        for name, (seconds, calls) in stats["timers"].items():
+            timer = _timers.setdefault(name, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+        for name, value in stats["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, (n, total, maximum) in stats["gauges"].items():
+            gauge = _gauges.setdefault(name, [0, 0, maximum])
+            gauge[0] += n
+            gauge[1] += total
+            gauge[2] = max(gauge[2], maximum)
+
+
+@contextmanager
+def stage(name):
+    """Record the stats of a stage run in the context.
+
+    The stats include those of worker processes merged during the stage.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    """
+    if not _enabled:
+        yield
+        return
+    # stats out of stages are dropped
+    collect()
+    peakmemory(reset=True)
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    stats = collect()
+    counters = stats["counters"]
+    gauges = stats["gauges"]
+    n, total, maximum = gauges.get("queue_depth", (0, 0, 0))
+    _stages.append(
+        {
+            "name": name,
+            "seconds": seconds,
+            "frames": counters.get("frames", 0),
+            "frames_per_second": counters.get("frames", 0) / seconds
+            if seconds
+            else 0.0,
+            "read_bytes": counters.get("read_bytes", 0),
+            "write_bytes": counters.get("write_bytes", 0),
+            "queue_depth": {"mean": total / n if n else 0.0, "max": maximum},
+            "peak_rss": {
+                "parent": peakmemory(),
+                "workers": gauges.get("peak_rss", (0, 0, 0))[2],
+            },
+            "functions": {
+                key: {"seconds": value[0], "calls": value[1]}
+                for key, value in sorted(
+                    stats["timers"].items(), key=lambda x: x[1][0], reverse=True
+                )
+            },
+        }
+    )
+
+
+@contextmanager
+def session(filename):
+    """Profile the stages run in the context and write the report.
+
+    The report is written only if the context exits without errors, and the
+    summary is logged.
+
+    Parameters
+    ----------
+    filename : str or None
+        The filename of the JSON report. If None, the profiler is not enabled.
+    """
+    if filename is None:
+        yield
+        return
+    enable()
+    _stages.clear()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        enable(False)
+    report = {"seconds": time.perf_counter() - start, "stages": list(_stages)}
+    _stages.clear()
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Profile is written to {filename}\n{summary(report)}")
+
+
+def summary(report, nfunctions=8):
+    """Return a human-readable summary of a report.
+
+    Parameters
+    ----------
+    report : dict
+        The report written by `session`.
+    nfunctions : int, optional, default=8
+        The number of the slowest functions shown for each stage.
+
+    Returns
+    -------
+    str
+        The summary.
+    """
+    mib = 2**20
+    lines = [
+        f"{'stage':<12}{'time (s)':>10}{'frames':>9}{'frames/s':>10}"
+        f"{'read (MiB)':>12}{'write (MiB)':>13}{'queue':>12}"
+        f"{'peak RSS (MiB)':>17}"
+    ]
+    for item in report["stages"]:
+        queue = f"{item['queue_depth']['mean']:.1f}/{item['queue_depth']['max']}"
+        rss = (
+            f"{item['peak_rss']['parent'] / mib:.0f}/"
+            f"{item['peak_rss']['workers'] / mib:.0f}"
+        )
+        lines.append(
+            f"{item['name']:<12}{item['seconds']:>10.3f}{item['frames']:>9}"
+            f"{item['frames_per_second']:>10.1f}{item['read_bytes'] / mib:>12.1f}"
+            f"{item['write_bytes'] / mib:>13.1f}{queue:>12}{rss:>17}"
+        )
+    lines.append(
+        "queue: mean/max items in flight; peak RSS: parent/largest worker; "
+        "time of functions is summed over processes:"
+    )
+    for item in report["stages"]:
+        functions = list(item["functions"].items())[:nfunctions]
+        if functions:
+            lines.append(
+                f"  {item['name']}: "
+                + ", ".join(
+                    f"{name} {value['seconds']:.3f} s/{value['calls']}"
+                    for name, value in functions
+                )
+            )
+    lines.append(f"Total time (s): {report['seconds']:.3f}")
+    return "\n".join(lines)
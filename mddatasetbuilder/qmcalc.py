@@ -2,13 +2,27 @@
 
 import argparse
 import os
+from multiprocessing.pool import ThreadPool
 from typing import Optional
 
-from gaussianrunner import GaussianRunner
+from .archive import Archive
 
 
 def qmcalc(gjfdir, command="g16", cpu_num: Optional[int] = None):
-    """QM Calculation."""
+    """QM Calculation.
+
+    If `gjfdir` contains an archive of tar shards, GJF files are read from it,
+    and the logs are appended to it. With `datasetbuilder --output tar`, the
+    archive is in the dataset directory (e.g. `dataset_md`), not in the
+    directory of GJF files.
+    """
+    from gaussianrunner import GaussianRunner
+
+    if Archive.isarchive(gjfdir):
+        _qmcalcarchive(
+            Archive(gjfdir), GaussianRunner(command=command, cpu_num=cpu_num)
+        )
+        return
     gjflist = [
         os.path.join(gjfdir, filename)
         for filename in os.listdir(gjfdir)
@@ -19,9 +33,39 @@ def qmcalc(gjfdir, command="g16", cpu_num: Optional[int] = None):
     )
 
 
+def _qmcalcarchive(archive, runner):
+    """Run GJF files in an archive and append the logs to a new shard.
+
+    GJF files which already have logs are skipped.
+    """
+    gjfnames = [
+        name
+        for name in archive.names(".gjf")
+        if f"{os.path.splitext(name)[0]}.log" not in archive
+    ]
+    shard = f"log.{os.getpid()}.tar"
+    try:
+        with ThreadPool(runner.thread_num) as pool:
+            outputs = pool.imap(
+                runner.runGaussianFromInput,
+                (archive.read(name).decode() for name in gjfnames),
+            )
+            for name, output in zip(gjfnames, outputs):
+                archive.append(
+                    shard, [(f"{os.path.splitext(name)[0]}.log", output.encode())]
+                )
+    finally:
+        archive.save()
+
+
 def _commandline():
     parser = argparse.ArgumentParser(description="QM Calculator")
-    parser.add_argument("-d", "--dir", help="Dataset dirs", required=True)
+    parser.add_argument(
+        "-d",
+        "--dir",
+        help="Dataset dirs: a directory of GJF files, or the dataset directory written by datasetbuilder --output tar",
+        required=True,
+    )
     parser.add_argument(
         "-c", "--command", help="Gaussian command, default is g16", default="g16"
     )
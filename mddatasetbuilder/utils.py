@@ -1,14 +1,31 @@
 """Utils."""
 
+import functools
 import itertools
+import os
 import pickle
-from multiprocessing import Pool, Semaphore
+import queue
+import sys
+import tempfile
+import threading
+import warnings
+import weakref
+from collections import OrderedDict
+from multiprocessing import Pool, SimpleQueue
 from typing import BinaryIO, List, TypeVar, Union, overload
 
-import lz4.frame
+import numpy as np
+from numpy.typing import DTypeLike
 from tqdm.auto import tqdm
 
+from . import profiler
 from ._logger import logger
+from .frameindex import BinaryFrame, decodeframe
+
+if sys.version_info >= (3, 8):
+    from multiprocessing import resource_tracker, shared_memory
+else:
+    shared_memory = None
 
 
 def multiopen(
@@ -26,20 +43,22 @@ def multiopen(
     desc=None,
     unit="it",
     total=None,
+    ring=None,
+    chunksize=100,
 ):
     """Return an interated object for process a file with multiple processors.
 
     Parameters
     ----------
-    pool : multiprocessing.Pool
+    pool : multiprocessing.Pool or WorkerPool
         The pool for multiprocessing.
     func : function
         The function to process lines.
     l : File object
         The file object.
-    semaphore : multiprocessing.Semaphore, optional, default: None
+    semaphore : multiprocessing.Semaphore or Scheduler, optional, default: None
         The semaphore to acquire. If None (default), the object will be passed
-        without control.
+        without control. A `Scheduler` also measures items and sizes chunks.
     nlines : int, optional, default: None
         The number of lines to pass to the function each time. If None (default),
         only one line will be passed to the function.
@@ -63,6 +82,14 @@ def multiopen(
         The unit of the iteration shown in the bar.
     total : int, optional, default: None
         The total number of the iteration shown in the bar.
+    ring : FrameRing, optional, default: None
+        If given, frames (bytes) in items are handed to workers through the
+        ring of shared memory buffers, and are decoded into lines in workers.
+        Each result is then a tuple of the used slots and the returned object,
+        and the slots should be released by `FrameRing.release`.
+    chunksize : int, optional, default: 100
+        The number of items sent to a worker at a time. It is chosen by the
+        scheduler if `semaphore` is a `Scheduler`.
 
     Returns
     -------
@@ -76,12 +103,23 @@ def multiopen(
         obj = itertools.islice(obj, 0, None, interval)
     if return_num:
         obj = enumerate(obj, start)
+    if isinstance(semaphore, Scheduler):
+        # the first item is measured before any chunk is sent
+        obj = iter(obj)
+        head = list(itertools.islice(obj, 1))
+        if head:
+            semaphore.start(head[0])
+        obj = map(semaphore.measure, itertools.chain(head, obj))
+        chunksize = semaphore.chunksize
     if semaphore:
         obj = produce(semaphore, obj, extra)
+    if ring is not None:
+        obj = map(ring.share, obj)
+        func = functools.partial(_sharedcall, func)
     if unordered:
-        obj = pool.imap_unordered(func, obj, 100)
+        obj = pool.imap_unordered(func, obj, chunksize)
     else:
-        obj = pool.imap(func, obj, 100)
+        obj = pool.imap(func, obj, chunksize)
     if bar:
         obj = tqdm(obj, desc=desc, unit=unit, total=total, disable=None)
     return obj
@@ -96,11 +134,350 @@ def produce(semaphore, plist, parameter):
         yield item
 
 
+def _itemsize(item) -> int:
+    """Return the number of bytes of frames or lines in an item."""
+    if isinstance(item, (bytes, str)):
+        return len(item)
+    if isinstance(item, (tuple, list)):
+        return sum(_itemsize(x) for x in item)
+    return 0
+
+
+class Scheduler:
+    """Size chunks of tasks and limit the items in flight by memory.
+
+    The chunk size and the limit are chosen from the size of the first item,
+    and the limit follows the average size of the items afterwards. A chunk
+    is kept around `chunkbytes`, but there are at least four chunks for each
+    worker if the total is known, so that workers are not idle at the end.
+    The items in flight are kept within `maxinflight`, but each worker can
+    always have two chunks (within `maxitems`), otherwise workers would wait
+    for each other.
+
+    Parameters
+    ----------
+    nproc : int
+        The number of worker processes.
+    maxinflight : int, optional, default=1073741824
+        The memory budget of the items in flight in bytes.
+    maxitems : int, optional, default=None
+        The maximum number of items in flight. If None (default), it is 150
+        times the number of processes.
+    total : int, optional, default=None
+        The total number of items, if known.
+    chunkbytes : int, optional, default=4194304
+        The target size of a chunk in bytes.
+    maxchunksize : int, optional, default=100
+        The maximum number of items in a chunk.
+    """
+
+    def __init__(
+        self,
+        nproc,
+        maxinflight=1 << 30,
+        maxitems=None,
+        total=None,
+        chunkbytes=1 << 22,
+        maxchunksize=100,
+    ):
+        self.nproc = nproc
+        self.maxinflight = maxinflight
+        self.maxitems = maxitems if maxitems else nproc * 150
+        self.total = total
+        self.chunkbytes = chunkbytes
+        self.maxchunksize = maxchunksize
+        self.chunksize = 1
+        self.limit = self.maxitems
+        self._inflight = 0
+        self._nbytes = 0
+        self._nitems = 0
+        self._cond = threading.Condition()
+
+    def start(self, item):
+        """Choose the chunk size and the limit from the first item.
+
+        Parameters
+        ----------
+        item : object
+            The first item.
+        """
+        itemsize = max(_itemsize(item), 1)
+        chunksize = min(self.maxchunksize, max(1, self.chunkbytes // itemsize))
+        if self.total:
+            chunksize = min(chunksize, max(1, self.total // (4 * self.nproc)))
+        self.chunksize = chunksize
+        self._setlimit(itemsize)
+        logger.info(
+            f"Item size: {itemsize / 2**20:.3f} MiB, chunk size: {self.chunksize}, "
+            f"items in flight: {self.limit}"
+        )
+
+    def measure(self, item):
+        """Update the limit with the size of an item.
+
+        Parameters
+        ----------
+        item : object
+            The item.
+
+        Returns
+        -------
+        object
+            The item.
+        """
+        self._nbytes += _itemsize(item)
+        self._nitems += 1
+        self._setlimit(max(self._nbytes // self._nitems, 1))
+        return item
+
+    def _setlimit(self, itemsize):
+        limit = min(
+            self.maxitems,
+            max(2 * self.nproc * self.chunksize, self.maxinflight // itemsize),
+        )
+        if limit != self.limit:
+            with self._cond:
+                self.limit = limit
+                self._cond.notify_all()
+
+    def acquire(self):
+        """Wait until an item can be sent."""
+        with profiler.timer("Scheduler.acquire"), self._cond:
+            self._cond.wait_for(lambda: self._inflight < self.limit)
+            self._inflight += 1
+            profiler.observe("queue_depth", self._inflight)
+
+    def release(self):
+        """Mark an item as finished."""
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify()
+
+
+class SharedFrame:
+    """A frame in a shared memory buffer.
+
+    Parameters
+    ----------
+    name : str
+        The name of the shared memory block.
+    length : int
+        The number of bytes of the frame.
+    binary : bool, optional, default=False
+        Whether the frame is a BinaryFrame, which is not decoded into lines.
+    """
+
+    __slots__ = ("name", "length", "binary")
+
+    def __init__(self, name, length, binary=False):
+        self.name = name
+        self.length = length
+        self.binary = binary
+
+    def __getstate__(self):
+        """Return the state for pickling."""
+        return self.name, self.length, self.binary
+
+    def __setstate__(self, state):
+        """Restore the state from pickling."""
+        self.name, self.length, self.binary = state
+
+
+class FrameRing:
+    """A ring of shared memory buffers to hand frames to worker processes.
+
+    The process reading the trajectory copies each frame into a free slot,
+    and only the name of the slot and the length of the frame are sent to
+    workers. A slot is returned to the ring when the result of its task is
+    received. Slots are created when no slot is free, up to `maxslots`, and
+    then the reader waits for a free slot. A slot grows when a larger frame
+    comes.
+
+    Frames are sent directly if the shared memory is not available (Python
+    3.7 or no space), or if a frame is larger than `maxslotsize`.
+
+    Parameters
+    ----------
+    maxslots : int
+        The maximum number of slots.
+    maxslotsize : int, optional, default=268435456
+        The maximum size of a slot in bytes.
+    """
+
+    def __init__(self, maxslots, maxslotsize=1 << 28):
+        self.maxslots = maxslots
+        self.maxslotsize = maxslotsize
+        # frames are sent directly if shared memory is not available
+        self.enabled = shared_memory is not None
+        self._slots = []
+        self._free = queue.Queue()
+
+    def share(self, item):
+        """Put frames in an item into shared memory.
+
+        Parameters
+        ----------
+        item : object
+            The item. Frames (bytes) in it or in nested tuples are replaced.
+
+        Returns
+        -------
+        slots: list of int
+            The used slots.
+        item: object
+            The item whose frames are replaced by SharedFrame objects.
+        """
+        slots = []
+        with profiler.timer("FrameRing.share"):
+            return slots, self._share(item, slots)
+
+    def _share(self, item, slots):
+        if isinstance(item, bytes):
+            slot = self._put(item)
+            if slot is None:
+                return item
+            slots.append(slot)
+            return SharedFrame(
+                self._slots[slot].name, len(item), isinstance(item, BinaryFrame)
+            )
+        if isinstance(item, tuple):
+            return tuple(self._share(x, slots) for x in item)
+        return item
+
+    def _put(self, data):
+        """Copy data into a free slot and return the slot, or None if failed."""
+        if not self.enabled or len(data) > self.maxslotsize:
+            return None
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            if len(self._slots) < self.maxslots:
+                slot = len(self._slots)
+                self._slots.append(None)
+            else:
+                slot = self._free.get()
+        shm = self._slots[slot]
+        if shm is None or shm.size < len(data):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+                self._slots[slot] = None
+            try:
+                shm = shared_memory.SharedMemory(
+                    create=True, size=max(len(data) * 5 // 4, 4096)
+                )
+            except OSError:
+                logger.warning(
+                    "Failed to create shared memory. Frames will be sent directly."
+                )
+                self.enabled = False
+                self._free.put(slot)
+                return None
+            self._slots[slot] = shm
+        shm.buf[: len(data)] = data
+        return slot
+
+    def release(self, slots):
+        """Return slots to the ring.
+
+        Parameters
+        ----------
+        slots : list of int
+            The slots.
+        """
+        for slot in slots:
+            self._free.put(slot)
+
+    def close(self):
+        """Close and remove all shared memory blocks."""
+        for shm in self._slots:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._slots = []
+
+
+# shared memory blocks attached in a worker
+_attached = OrderedDict()
+
+
+def _attachshared(name):
+    """Attach a shared memory block owned by the parent process.
+
+    Workers share the resource tracker of the parent process (see
+    `WorkerPool.pool`), which forgets the block when the parent unlinks it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _readshared(frame):
+    """Copy a frame out of shared memory in a worker."""
+    shm = _attached.pop(frame.name, None)
+    if shm is None:
+        shm = _attachshared(frame.name)
+        if len(_attached) >= 128:
+            _attached.popitem(last=False)[1].close()
+    _attached[frame.name] = shm
+    return bytes(shm.buf[: frame.length])
+
+
+def _unshare(item):
+    """Decode frames in an item into lines."""
+    if isinstance(item, SharedFrame):
+        data = _readshared(item)
+        return BinaryFrame(data) if item.binary else decodeframe(data)
+    if isinstance(item, bytes):
+        return decodeframe(item)
+    if isinstance(item, tuple):
+        return tuple(_unshare(x) for x in item)
+    return item
+
+
+def _sharedcall(func, item):
+    """Call a function with an item from `FrameRing.share`."""
+    slots, item = item
+    with profiler.timer("_unshare"):
+        item = _unshare(item)
+    return slots, func(item)
+
+
+def _profiledcall(func, item):
+    """Call a function in a worker and return the stats of the worker.
+
+    The stats since the last task are returned, together with the peak
+    resident memory of the worker since then.
+    """
+    profiler.enable()
+    result = func(item)
+    profiler.observe("peak_rss", profiler.peakmemory(reset=True))
+    return result, profiler.collect()
+
+
+def _mergestats(result):
+    """Merge the stats returned by `_profiledcall` and return the result."""
+    result, stats = result
+    profiler.merge(stats)
+    return result
+
+
+def _warndeprecated(name):
+    warnings.warn(
+        f"{name} is deprecated and will be removed in a future release, as the "
+        "intermediate files are no longer compressed with lz4",
+        DeprecationWarning,
+        stacklevel=3,
+    )
+
+
 def compress(x: Union[str, bytes]) -> bytes:
     """Compress the line.
 
-    This function reduces IO overhead to speed up the program. The functions will
-    use lz4 to compress, since lz4 has better performance that any others.
+    .. deprecated::
+        The intermediate files are no longer compressed. This function is kept
+        to read old files, and requires lz4.
+
     The compressed format is size + data + size + data + ..., where size is a 64-bit
     little-endian integer.
 
@@ -112,8 +489,15 @@ def compress(x: Union[str, bytes]) -> bytes:
     Returns
     -------
     bytes
-        The compressed line, with a linebreak in the end.
+        The compressed line.
     """
+    _warndeprecated("compress")
+    return _compress(x)
+
+
+def _compress(x):
+    import lz4.frame
+
     if isinstance(x, str):
         x = x.encode()
     compress_block = lz4.frame.compress(x, compression_level=0)
@@ -124,6 +508,10 @@ def compress(x: Union[str, bytes]) -> bytes:
 def decompress(x: bytes, isbytes: bool = False) -> Union[str, bytes]:
     """Decompress the line.
 
+    .. deprecated::
+        The intermediate files are no longer compressed. This function is kept
+        to read old files, and requires lz4.
+
     Parameters
     ----------
     x : bytes
@@ -136,6 +524,13 @@ def decompress(x: bytes, isbytes: bool = False) -> Union[str, bytes]:
     str or bytes
         The decompressed line.
     """
+    _warndeprecated("decompress")
+    return _decompress(x, isbytes)
+
+
+def _decompress(x, isbytes=False):
+    import lz4.frame
+
     x = lz4.frame.decompress(x[64:])
     if isbytes:
         return x
@@ -145,6 +540,10 @@ def decompress(x: bytes, isbytes: bool = False) -> Union[str, bytes]:
 def read_compressed_block(f: BinaryIO):
     """Read compressed binary file, assuming the format is size + data + size + data + ...
 
+    .. deprecated::
+        The intermediate files are no longer compressed. This function is kept
+        to read old files.
+
     Parameters
     ----------
     f : fileObject
@@ -155,6 +554,7 @@ def read_compressed_block(f: BinaryIO):
     data: bytes
         The compressed block.
     """
+    _warndeprecated("read_compressed_block")
     while True:
         sizeb = f.read(64)
         if not sizeb:
@@ -166,6 +566,10 @@ def read_compressed_block(f: BinaryIO):
 def listtobytes(x):
     """Convert an object to a compressed line.
 
+    .. deprecated::
+        The intermediate files are no longer compressed. This function is kept
+        to read old files, and requires lz4.
+
     Parameters
     ----------
     x : object
@@ -176,12 +580,17 @@ def listtobytes(x):
     bytes
         The compressed line.
     """
-    return compress(pickle.dumps(x))
+    _warndeprecated("listtobytes")
+    return _compress(pickle.dumps(x))
 
 
 def bytestolist(x):
     """Convert a compressed line to an object.
 
+    .. deprecated::
+        The intermediate files are no longer compressed. This function is kept
+        to read old files, and requires lz4.
+
     Parameters
     ----------
     x : bytes
@@ -192,16 +601,340 @@ def bytestolist(x):
     object
         The decompressed object.
     """
-    return pickle.loads(decompress(x, isbytes=True))  # type: ignore
+    _warndeprecated("bytestolist")
+    return pickle.loads(_decompress(x, isbytes=True))  # type: ignore
+
+
+class ArrayWriter:
+    """Append rows of integers to a binary file.
+
+    Rows are buffered and written in large chunks. The file has no header, so
+    it can be read with `read_array` or `numpy.memmap`.
+
+    Parameters
+    ----------
+    filename : str
+        The filename.
+    ncols : int
+        The number of columns.
+    dtype : data-type, optional, default=numpy.int32
+        The data type. 32-bit integers are enough for timesteps and atom IDs,
+        which are also 32-bit integers in LAMMPS by default.
+    buffersize : int, optional, default=1048576
+        The number of rows buffered before writing.
+    """
+
+    def __init__(
+        self, filename, ncols, dtype: DTypeLike = np.int32, buffersize=1 << 20
+    ):
+        self.filename = filename
+        self.ncols = ncols
+        self.dtype = np.dtype(dtype)
+        self.buffersize = buffersize
+        self._f = open(filename, "wb")
+        self._buffer = []
+        self._nbuffer = 0
+
+    def append(self, rows):
+        """Append rows.
+
+        Parameters
+        ----------
+        rows : array_like (n_rows, ncols)
+            The rows to append.
+        """
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.ncols)
+        self._buffer.append(rows)
+        self._nbuffer += len(rows)
+        if self._nbuffer >= self.buffersize:
+            self.flush()
+
+    @profiler.timed("ArrayWriter.flush")
+    def flush(self):
+        """Write buffered rows to the file."""
+        if self._buffer:
+            data = np.concatenate(self._buffer).tobytes()
+            self._f.write(data)
+            profiler.count("write_bytes", len(data))
+            self._buffer = []
+            self._nbuffer = 0
+        self._f.flush()
+
+    def close(self):
+        """Write buffered rows and close the file."""
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the file when exiting the context."""
+        self.close()
+
+
+def read_array(filename, ncols, dtype: DTypeLike = np.int32, mmap=False):
+    """Read rows written by `ArrayWriter` in one vectorized read.
+
+    Parameters
+    ----------
+    filename : str
+        The filename.
+    ncols : int
+        The number of columns.
+    dtype : data-type, optional, default=numpy.int32
+        The data type.
+    mmap : bool, optional, default=False
+        If True, map the file into memory instead of reading it.
+
+    Returns
+    -------
+    numpy.ndarray (n_rows, ncols)
+        The rows.
+    """
+    if mmap and os.path.getsize(filename):
+        return np.memmap(filename, dtype=dtype, mode="r").reshape(-1, ncols)
+    return np.fromfile(filename, dtype=dtype).reshape(-1, ncols)
+
+
+# the token and the state installed in a worker
+_worker_token = None
+_worker_state = None
+
+
+def _initworker(token, state):
+    """Install the state in a worker."""
+    global _worker_token, _worker_state
+    _worker_token = token
+    _worker_state = state
+
+
+def _startworker(token, state, pids):
+    """Start a worker with the state and report its PID to the pool."""
+    # stats inherited from the parent process are not of this worker
+    profiler.collect()
+    pids.put(os.getpid())
+    _initworker(token, state)
+
+
+def _callstate(key, name, item):
+    """Call a method of the state installed in the worker.
+
+    The state is loaded from its file if the worker does not have it yet.
+    """
+    token, filename = key
+    if _worker_token != token:
+        with open(filename, "rb") as f:
+            _initworker(token, pickle.load(f))
+    return getattr(_worker_state, name)(item)
+
+
+def _removefile(filename):
+    """Remove a file if it exists."""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def _residentmemory(pid):
+    """Return the resident memory of a process in bytes, or 0 if unknown."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # not Linux
+        return 0
+
+
+class WorkerPool:
+    """A pool of worker processes reused across stages.
 
+    The processes are started when the pool is first used, and are kept until
+    the pool is closed, so the processes are not spawned and the modules are
+    not imported again in each stage.
 
-def run_mp(nproc, **arg):
+    Each stage may install a state in workers with `bind`. The state is
+    inherited by workers when the processes are started, otherwise it is
+    pickled to a file once, and each worker loads it before its first task of
+    the stage.
+
+    Parameters
+    ----------
+    nproc : int
+        The number of processes.
+    maxmemory : int, optional, default=None
+        The maximum resident memory of a worker in bytes. Before each stage,
+        all workers are restarted if any worker exceeds it (only on Linux).
+        If None (default), workers are never restarted.
+    tmpdir : str, optional, default=None
+        The directory to write the state file. If None (default), the system
+        temporary directory is used.
+    """
+
+    def __init__(self, nproc, maxmemory=None, tmpdir=None):
+        self.nproc = nproc
+        self.maxmemory = maxmemory
+        self.tmpdir = tmpdir
+        self._pool = None
+        self._token = 0
+        self._state = None
+        self._statefile = None
+        self._pidqueue = None
+        self._pids = set()
+
+    @property
+    def pool(self):
+        """multiprocessing.Pool: The pool, started if it is not running."""
+        if self._pool is None:
+            if shared_memory is not None and os.name == "posix":
+                # forked workers share the resource tracker of this process
+                # instead of starting their own, which would remove the
+                # shared memory attached by a worker when the worker exits
+                resource_tracker.ensure_running()
+            self._pidqueue = SimpleQueue()
+            self._pids = set()
+            self._pool = Pool(
+                self.nproc,
+                initializer=_startworker,
+                initargs=((os.getpid(), self._token), self._state, self._pidqueue),
+            )
+        return self._pool
+
+    @property
+    def pids(self):
+        """The PIDs of workers started by the running pool.
+
+        Workers report their PIDs when started, so the set may contain
+        workers that have exited and been replaced by the pool.
+        """
+        if self._pidqueue is not None:
+            while not self._pidqueue.empty():
+                self._pids.add(self._pidqueue.get())
+        return self._pids
+
+    def bind(self, func, state=None):
+        """Return the function to run in workers for a stage.
+
+        Parameters
+        ----------
+        func : function or str
+            The function, or the name of the method of `state`.
+        state : object, optional, default=None
+            If given, the object is installed in each worker, and `func`
+            should be the name of its method.
+
+        Returns
+        -------
+        function
+            The function that can be passed to `imap`.
+        """
+        self.recycle()
+        if state is None:
+            return func
+        self._token += 1
+        token = (os.getpid(), self._token)
+        self._state = state
+        self._removestatefile()
+        statefile = None
+        if self._pool is not None:
+            fd, statefile = tempfile.mkstemp(suffix=".pkl", dir=self.tmpdir)
+            # removed with the pool, or at exit if the pool is not closed
+            self._statefile = weakref.finalize(self, _removefile, statefile)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return functools.partial(_callstate, (token, statefile), func)
+
+    def recycle(self):
+        """Restart workers if any of them exceeds the memory limit."""
+        if self._pool is None or self.maxmemory is None:
+            return
+        memory = max((_residentmemory(pid) for pid in self.pids), default=0)
+        if memory > self.maxmemory:
+            logger.info(f"Restart workers using {memory / 2**20:.0f} MiB of memory")
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def imap(self, func, iterable, chunksize=1):
+        """Apply a function to items, like `multiprocessing.Pool.imap`."""
+        return self._profiled(self.pool.imap, func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """Apply a function to items, like `multiprocessing.Pool.imap_unordered`."""
+        return self._profiled(self.pool.imap_unordered, func, iterable, chunksize)
+
+    @staticmethod
+    def _profiled(imap, func, iterable, chunksize):
+        """Gather the stats of workers with results if the profiler is enabled."""
+        if not profiler.enabled():
+            return imap(func, iterable, chunksize)
+        results = imap(functools.partial(_profiledcall, func), iterable, chunksize)
+        return map(_mergestats, results)
+
+    def terminate(self):
+        """Stop workers immediately. They are restarted when used again."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def close(self):
+        """Wait for workers to exit and remove the state file."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._state = None
+        self._removestatefile()
+
+    def _removestatefile(self):
+        if self._statefile is not None:
+            self._statefile()
+            self._statefile = None
+
+    def __getstate__(self):
+        """Return the state for pickling. Workers are not passed."""
+        return {"nproc": self.nproc, "maxmemory": self.maxmemory, "tmpdir": self.tmpdir}
+
+    def __setstate__(self, state):
+        """Restore the state from pickling."""
+        self.__init__(**state)
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, exc_type, *args):
+        """Stop workers when exiting the context."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+            self.close()
+
+
+def run_mp(nproc, shared=False, state=None, pool=None, maxinflight=1 << 30, **arg):
     """Process a file with multiple processors.
 
     Parameters
     ----------
     nproc : int
         The number of processors to be used.
+    shared : bool, optional, default=False
+        If True, frames (bytes) in items are handed to workers through shared
+        memory and decoded into lines in workers.
+    state : object, optional, default=None
+        If given, the object is installed once in each worker, and `func`
+        should be the name of its method. Tasks then carry only the items
+        instead of the pickled bound method.
+    pool : WorkerPool, optional, default=None
+        The pool to run tasks. If None (default), a new pool of `nproc`
+        processes is started and closed when finished.
+    maxinflight : int, optional, default=1073741824
+        The memory budget of the items in flight in bytes. The chunk size and
+        the number of items in flight are chosen from it by `Scheduler`.
     **kwargs : dict, optional
         Other parameters can be found in the `multiopen` method.
 
@@ -213,22 +946,35 @@ def run_mp(nproc, **arg):
     See Also
     --------
     multiopen
+    Scheduler
+    WorkerPool
     """
-    pool = Pool(nproc, maxtasksperchild=1000)
-    semaphore = Semaphore(nproc * 150)
+    owned = pool is None
+    if owned:
+        pool = WorkerPool(nproc)
+    else:
+        nproc = pool.nproc
+    arg["func"] = pool.bind(arg["func"], state)
+    scheduler = Scheduler(nproc, maxinflight=maxinflight, total=arg.get("total"))
+    # each item may contain a coordinate frame and a bond frame
+    ring = FrameRing(2 * scheduler.maxitems) if shared else None
     try:
-        results = multiopen(pool=pool, semaphore=semaphore, **arg)
+        results = multiopen(pool=pool, semaphore=scheduler, ring=ring, **arg)
         for item in results:
+            if ring is not None:
+                slots, item = item
+                ring.release(slots)
             yield item
-            semaphore.release()
+            scheduler.release()
     except:
         logger.exception("run_mp failed")
         pool.terminate()
         raise
-    else:
-        pool.close()
     finally:
-        pool.join()
+        if owned:
+            pool.close()
+        if ring is not None:
+            ring.close()
 
 
 T = TypeVar("T")
@@ -0,0 +1,20 @@
+"""Shared fixtures of tests."""
+
+import pytest
+
+
+def _water_frame(timestep):
+    # a water molecule moving along z
+    z = 1.0 + 0.1 * timestep
+    return (
+        f"ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n3\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0.0 10.0\n0.0 10.0\n0.0 10.0\n"
+        f"ITEM: ATOMS id type x y z\n1 2 5.0 5.0 {z}\n"
+        f"2 1 5.76 5.59 {z}\n3 1 4.24 5.59 {z}\n"
+    )
+
+
+@pytest.fixture
+def water_frame():
+    """Return a function giving a dump frame of a water molecule at a timestep."""
+    return _water_frame
@@ -0,0 +1,33 @@
+"""Test archive."""
+
+import tarfile
+
+from mddatasetbuilder.archive import Archive
+
+
+def test_archive(tmp_path):
+    """Test files are appended to shards and read by the index."""
+    archive = Archive(str(tmp_path / "dataset"))
+    archive.append("a.tar", [("dataset/0/x.xyz", b"1\n\nH 0 0 0\n")])
+    archive.append("b.tar", [("dataset_gjf/0/x.gjf", b"gjf" * 300)])
+    archive.append("a.tar", [("dataset_gjf/" + "y" * 120 + ".gjf", b"long name")])
+    archive.save()
+
+    archive = Archive(str(tmp_path / "dataset"))
+    assert len(archive) == 3
+    assert archive.names(".gjf")[0] == "dataset_gjf/0/x.gjf"
+    assert archive.read("dataset/0/x.xyz") == b"1\n\nH 0 0 0\n"
+    assert archive.read("dataset_gjf/0/x.gjf") == b"gjf" * 300
+    # shards are plain tar files
+    with tarfile.open(tmp_path / "dataset" / "a.tar") as f:
+        assert f.extractfile("dataset_gjf/" + "y" * 120 + ".gjf").read() == (
+            b"long name"
+        )
+
+    archive.export(str(tmp_path / "export"))
+    assert (tmp_path / "export" / "dataset_gjf" / "0" / "x.gjf").read_bytes() == (
+        b"gjf" * 300
+    )
+    archive.clear()
+    assert not Archive.isarchive(str(tmp_path / "dataset"))
+    assert not (tmp_path / "dataset" / "a.tar").exists()
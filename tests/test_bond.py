@@ -1,7 +1,9 @@
 """Test detecting bonds."""
 
 import numpy as np
+import pytest
 from ase import Atoms
+from ase.build import molecule
 
 from mddatasetbuilder.detect import DetectDump
 
@@ -32,3 +34,102 @@ def test_bond_nopbc():
     assert bonds == [[], []]
     levels = DetectDump._crd2bond(atoms, True)
     assert levels == [[], []]
+
+
+@pytest.mark.parametrize("pbc", [True, False])
+def test_native_bond_pbc(pbc):
+    """Test the native backend under PBC and non-PBC conditions."""
+    atoms = Atoms(
+        "O2",
+        positions=[[0.0, 0.0, 0.0], [19.0, 19.0, 19.0]],
+        pbc=pbc,
+        cell=np.diag([20.0, 20.0, 20.0]),
+    )
+    assert DetectDump._crd2bond(atoms, False, backend="native") == DetectDump._crd2bond(
+        atoms, False
+    )
+    assert DetectDump._crd2bond(atoms, True, backend="native") == DetectDump._crd2bond(
+        atoms, True
+    )
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "H2O",
+        "CH4",
+        "C2H4",
+        "C2H2",
+        "CO2",
+        "H2CO",
+        "N2",
+        "HCN",
+        "C6H6",
+        "CH3CHO",
+        "CO",
+        "HCOOH",
+        "CH3",
+        "H2O2",
+        "CH3COOH",
+        "H2CCO",
+        "C3H4_D2d",
+        "CH3NO2",
+        "SO2",
+        "C2H6SO",
+    ],
+)
+def test_native_bond_agreement(name):
+    """Test the native backend agrees with Open Babel for molecules."""
+    atoms = molecule(name, cell=np.diag([20.0, 20.0, 20.0]), pbc=True)
+    atoms.center()
+    for readlevel in (False, True):
+        expected = DetectDump._crd2bond(atoms, readlevel)
+        result = DetectDump._crd2bond(atoms, readlevel, backend="native")
+        assert [sorted(x) for x in result] == [sorted(x) for x in expected]
+
+
+@pytest.mark.parametrize(
+    "cell",
+    [
+        np.diag([25.0, 25.0, 25.0]),
+        [[25.0, 0.0, 0.0], [5.0, 25.0, 0.0], [-3.0, 4.0, 25.0]],
+    ],
+)
+def test_native_connectivity_agreement(cell):
+    """Test the native backend gives the same connectivity as Open Babel."""
+    rng = np.random.default_rng(0)
+    atoms = Atoms(
+        numbers=rng.choice([1, 6, 8], size=1500, p=[0.6, 0.2, 0.2]),
+        positions=rng.random((1500, 3)) @ np.array(cell),
+        cell=cell,
+        pbc=True,
+    )
+    expected = DetectDump._crd2bond(atoms, False)
+    result = DetectDump._crd2bond(atoms, False, backend="native")
+    assert [sorted(x) for x in result] == [sorted(x) for x in expected]
+
+
+@pytest.mark.parametrize(
+    "cell",
+    [
+        np.diag([25.0, 25.0, 25.0]),
+        [[25.0, 0.0, 0.0], [5.0, 25.0, 0.0], [-3.0, 4.0, 25.0]],
+    ],
+)
+def test_native_bondorder_agreement(cell):
+    """Test the native backend gives nearly the same bond orders as Open Babel.
+
+    Bond orders are not exactly equivalent, as the native backend does not
+    perceive aromatic rings and breaks ties in a different order.
+    """
+    rng = np.random.default_rng(0)
+    atoms = Atoms(
+        numbers=rng.choice([1, 6, 8], size=1500, p=[0.6, 0.2, 0.2]),
+        positions=rng.random((1500, 3)) @ np.array(cell),
+        cell=cell,
+        pbc=True,
+    )
+    expected = DetectDump._crd2bond(atoms, True)
+    result = DetectDump._crd2bond(atoms, True, backend="native")
+    agreement = np.mean([sorted(x) == sorted(y) for x, y in zip(result, expected)])
+    assert agreement > 0.99
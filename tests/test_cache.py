@@ -0,0 +1,111 @@
+"""Test the binary trajectory cache."""
+
+import os
+import pickle
+
+import numpy as np
+
+from mddatasetbuilder.cache import CacheWriter, TrajectoryCache
+from mddatasetbuilder.datasetbuilder import DatasetBuilder
+from mddatasetbuilder.detect import DetectBond, DetectDump
+from mddatasetbuilder.frameindex import decodeframe, iterframes
+
+
+def _dumpframe(timestep):
+    return (
+        f"ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n3\n"
+        "ITEM: BOX BOUNDS xy xz yz pp pp pp\n0.0 10.5 0.5\n0.0 10.0 0.0\n0.0 10.0 0.0\n"
+        f"ITEM: ATOMS id type x y z\n3 1 1.0 2.0 {timestep}.5\n"
+        "1 2 4.5 5.25 6.125\n2 1 7.0 8.0 9.0\n"
+    )
+
+
+def _bondframe(timestep):
+    return (
+        f"# Timestep {timestep}\n#\n# Number of particles 3\n#\n"
+        "# id type nb id_1...id_nb mol bo_1...bo_nb abo nlp q\n"
+        "2 1 1 1 0 0.951 0.951 0.0 0.1\n"
+        "1 2 2 2 3 0 0.951 1.6 1.9 2.0 -0.2\n"
+        "3 1 1 1 0 1.6 1.6 0.0 0.1\n#\n"
+    )
+
+
+def _cache(tmp_path, detector, filename):
+    with CacheWriter(str(tmp_path / "cache"), filename) as writer:
+        with open(filename, "rb") as f:
+            for _, data in iterframes(f, detector.steplinenum):
+                writer.append(detector.readarrays(decodeframe(data)))
+    cache = TrajectoryCache.load(str(tmp_path / "cache"), filename)
+    assert cache is not None
+    return cache
+
+
+def test_cache_dump(tmp_path):
+    """Test reading coordinates from the cache."""
+    filename = str(tmp_path / "dump")
+    frames = [_dumpframe(ii) for ii in range(3)]
+    with open(filename, "w") as f:
+        f.write("".join(frames))
+    detector = DetectDump(filename=filename, atomname=np.array(["H", "O"]), pbc=True)
+    cache = _cache(tmp_path, detector, filename)
+    assert len(cache) == 3
+    for ii, frame in enumerate(frames):
+        expected, expected_ids = detector.readcrd(frame.splitlines(keepends=True))
+        # the frame is sent to workers by pickling
+        step_atoms, ids = detector.readcrd(pickle.loads(pickle.dumps(cache.frame(ii))))
+        np.testing.assert_array_equal(ids, expected_ids)
+        assert step_atoms.get_chemical_symbols() == expected.get_chemical_symbols()
+        np.testing.assert_array_equal(step_atoms.positions, expected.positions)
+        np.testing.assert_array_equal(step_atoms.cell, expected.cell)
+    # the cache is invalid after the file is modified
+    with open(filename, "a") as f:
+        f.write(_dumpframe(3))
+    assert TrajectoryCache.load(str(tmp_path / "cache"), filename) is None
+
+
+def test_cache_bond(tmp_path):
+    """Test reading bonds from the cache."""
+    filename = str(tmp_path / "bonds")
+    frames = [_bondframe(ii) for ii in range(2)]
+    with open(filename, "w") as f:
+        f.write("".join(frames))
+    detector = DetectBond(filename=filename, atomname=np.array(["H", "O"]), pbc=True)
+    cache = _cache(tmp_path, detector, filename)
+    assert len(cache) == 2
+    lines = frames[1].splitlines(keepends=True)
+    arrays = cache.frame(1).read()
+    np.testing.assert_array_equal(arrays["indptr"], [0, 2, 3, 4])
+    np.testing.assert_array_equal(arrays["indices"], [1, 2, 0, 0])
+    np.testing.assert_array_equal(arrays["orders"], [1, 2, 1, 2])
+    expected, _ = detector.readatombondtype(((1, lines), None))
+    d, step = detector.readatombondtype(((1, cache.frame(1)), None))
+    assert step == 1
+    assert {k: sorted(v) for k, v in d.items()} == {
+        k: sorted(v) for k, v in expected.items()
+    }
+    molecules, _ = detector.readmolecule(cache.frame(1))
+    expected, _ = detector.readmolecule(lines)
+    assert sorted(map(sorted, molecules)) == sorted(map(sorted, expected))
+
+
+def test_datasetbuilder_cache(tmp_path):
+    """Test iterating frames of the builder from the cache."""
+    filename = str(tmp_path / "dump")
+    frames = [_dumpframe(ii) for ii in range(5)]
+    with open(filename, "w") as f:
+        f.write("".join(frames))
+    builder = DatasetBuilder(
+        dumpfilename=filename,
+        atomname=["H", "O"],
+        nproc=1,
+        stepinterval=2,
+        cachedir=str(tmp_path / "cache"),
+    )
+    with builder.workers:
+        cached = list(builder.lineiter(builder.crddetector))
+        selected = list(builder.lineiter(builder.crddetector, steps=[2, 1]))
+    assert os.path.isdir(tmp_path / "cache")
+    assert [frame.index for frame in cached] == [0, 2, 4]
+    assert [(step, frame.index) for step, frame in selected] == [(1, 2), (2, 4)]
+    step_atoms, _ = builder.crddetector.readcrd(cached[2])
+    np.testing.assert_array_equal(step_atoms.positions[2], [1.0, 2.0, 4.5])
@@ -1,9 +1,51 @@
 """Test command line interface."""
 
+import argparse
 import subprocess as sp
 import sys
 
+import pytest
+
+from mddatasetbuilder.datasetbuilder import _parseshard
+
+# imported only by the stages or backends that need them
+HEAVY_MODULES = ("sklearn", "scipy", "ase.io", "openbabel", "dpdata", "gaussianrunner")
+
 
 def test_module():
     """Test python -m mddatasetbuilder."""
     sp.check_output([sys.executable, "-m", "mddatasetbuilder", "-h"])
+
+
+def test_parseshard():
+    """Test parsing --shard i/n."""
+    assert _parseshard("1/4") == (1, 4)
+    for value in ("4/4", "-1/4", "1", "a/b"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            _parseshard(value)
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "mddatasetbuilder.datasetbuilder",
+        "mddatasetbuilder.qmcalc",
+        "mddatasetbuilder.deepmd",
+    ],
+)
+def test_lazyimport(module):
+    """Test command line tools start without importing heavy dependencies."""
+    output = sp.check_output(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print(*sys.modules, sep=chr(10))",
+        ],
+        text=True,
+    )
+    heavy = [
+        name
+        for name in output.splitlines()
+        if any(name == x or name.startswith(f"{x}.") for x in HEAVY_MODULES)
+    ]
+    assert not heavy
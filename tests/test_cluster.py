@@ -0,0 +1,36 @@
+"""Test clustering."""
+
+import numpy as np
+
+from mddatasetbuilder.datasetbuilder import DatasetBuilder, _clusterbondtype
+from mddatasetbuilder.features import FeatureMatrix
+
+
+def test_clusterdatastream():
+    """Test streaming clustering finds separated clusters."""
+    rng = np.random.default_rng(0)
+    n_clusters = 5
+    centers = rng.random((n_clusters, 3)) * 100
+    labels = rng.integers(0, n_clusters, size=1000)
+    features = FeatureMatrix(len(labels), {"H": 0.5})
+    for j, label in enumerate(labels):
+        vector = np.sort(centers[label] + rng.normal(scale=0.01, size=3))
+        features.append(np.array([j, 1]), vector, {"H": 3})
+    np.random.seed(0)
+    index = DatasetBuilder._clusterdatastream(
+        features, n_clusters=n_clusters, n_each=2, chunksize=64
+    )
+    assert len(index) == 2 * n_clusters
+    assert set(labels[index].tolist()) == set(range(n_clusters))
+
+
+def test_clusterbondtype(tmp_path):
+    """Test clustering a bond type from saved features."""
+    rng = np.random.default_rng(1)
+    X = rng.random((200, 4))
+    filename = str(tmp_path / "features.npy")
+    np.save(filename, X)
+    itype, index = _clusterbondtype((3, filename, 10, 1, None, 1))
+    assert itype == 3
+    assert len(index) <= 10
+    assert np.all((index >= 0) & (index < len(X)))
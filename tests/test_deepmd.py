@@ -0,0 +1,48 @@
+"""Test DeePMD-kit data."""
+
+import os
+
+import dpdata
+import numpy as np
+import pytest
+
+from mddatasetbuilder.deepmd import DeePMDWriter
+
+
+@pytest.mark.parametrize("fmt", ["deepmd/npy", "deepmd/hdf5"])
+def test_deepmd_writer(tmp_path, fmt):
+    """Test structures are grouped by formula and read by dpdata."""
+    if fmt == "deepmd/hdf5":
+        pytest.importorskip("h5py")
+    path = str(tmp_path / ("data.hdf5" if fmt == "deepmd/hdf5" else "data"))
+    rng = np.random.default_rng(0)
+    with DeePMDWriter(path, ["C", "H", "O"], fmt=fmt, set_size=2) as writer:
+        for ii in range(5):
+            # H2O in different atom orders, and CH4
+            types = np.array([1, 2, 1]) if ii % 2 else np.array([2, 1, 1])
+            writer.append(types, rng.random((3, 3)), np.array([1, 0, 0]))
+        writer.append(np.array([0, 1, 1, 1, 1]), rng.random((5, 3)), np.zeros(5))
+    if fmt == "deepmd/npy":
+        assert sorted(os.listdir(path)) == ["C0H2O1", "C1H4O0"]
+        system = dpdata.System(os.path.join(path, "C0H2O1"), fmt=fmt)
+        assert sorted(os.listdir(os.path.join(path, "C0H2O1"))) == [
+            "nopbc",
+            "set.000",
+            "set.001",
+            "set.002",
+            "type.raw",
+            "type_map.raw",
+        ]
+        assert sorted(os.listdir(os.path.join(path, "C0H2O1", "set.000"))) == [
+            "atom_pref.npy",
+            "coord.npy",
+        ]
+        tags = np.load(os.path.join(path, "C0H2O1", "set.000", "atom_pref.npy"))
+        np.testing.assert_array_equal(tags, [[0, 0, 1], [1, 0, 0]])
+    else:
+        systems = dpdata.MultiSystems().load_systems_from_file(
+            path, fmt=fmt, labeled=False
+        )
+        system = systems["C0H2O1"]
+    assert len(system) == 5
+    np.testing.assert_array_equal(system["atom_types"], [1, 1, 2])
@@ -0,0 +1,142 @@
+"""Test reading trajectories."""
+
+import struct
+
+import numpy as np
+import pytest
+
+from mddatasetbuilder.detect import DetectBinaryDump, DetectDump
+from mddatasetbuilder.frameindex import BinaryFrame
+
+dump = """ITEM: TIMESTEP
+0
+ITEM: NUMBER OF ATOMS
+3
+ITEM: BOX BOUNDS xy xz yz pp pp pp
+0.0 10.5 0.5
+0.0 10.0 0.0
+0.0 10.0 0.0
+ITEM: ATOMS id type q x y z
+3 1 0.1 1.0 2.0 3.0
+1 2 -0.2 4.5 5.25 6.125
+2 1 0.1 7.0 8.0 9.0
+"""
+
+
+def test_readcrd(tmp_path):
+    """Test reading coordinates from the dump file."""
+    filename = tmp_path / "dump.test"
+    filename.write_text(dump * 2)
+    detector = DetectDump(
+        filename=str(filename), atomname=np.array(["H", "O"]), pbc=True
+    )
+    assert detector.steplinenum == 12
+    lines = dump.splitlines(keepends=True)
+    step_atoms, ids = detector.readcrd(lines)
+    np.testing.assert_array_equal(ids, [3, 1, 2])
+    assert step_atoms.get_chemical_symbols() == ["O", "H", "H"]
+    np.testing.assert_array_equal(
+        step_atoms.positions, [[4.5, 5.25, 6.125], [7.0, 8.0, 9.0], [1.0, 2.0, 3.0]]
+    )
+    np.testing.assert_array_equal(
+        step_atoms.cell, [[10.0, 0.0, 0.0], [0.5, 10.0, 0.0], [0.0, 0.0, 10.0]]
+    )
+    assert step_atoms.pbc.all()
+
+
+def _binarydump(frames, columns=None, triclinic=True, nchunk=2):
+    """Write frames in the LAMMPS binary dump format.
+
+    If `columns` is given, the new format with the magic string is written.
+    """
+    content = b""
+    for timestep, data, bounds in frames:
+        if columns is not None:
+            magic = b"DUMPCUSTOM"
+            content += struct.pack("=q", -len(magic)) + magic
+            content += struct.pack("=ii", 1, 2)
+        content += struct.pack("=qqi", timestep, len(data), int(triclinic))
+        content += struct.pack("=6i", *([0] * 6))
+        content += np.asarray(bounds, dtype=np.float64).tobytes()
+        content += struct.pack("=i", data.shape[1])
+        if columns is not None:
+            units = b"real"
+            content += struct.pack("=i", len(units)) + units
+            content += struct.pack("=b", 1) + struct.pack("=d", timestep * 0.1)
+            names = " ".join(columns).encode()
+            content += struct.pack("=i", len(names)) + names
+        content += struct.pack("=i", nchunk)
+        for chunk in np.array_split(data, nchunk):
+            content += struct.pack("=i", chunk.size) + chunk.tobytes()
+    return content
+
+
+def test_readbinarydump(tmp_path):
+    """Test reading the binary dump file in the new format."""
+    data = np.array(
+        [
+            [3, 1, 0.1, 1.0, 2.0, 3.0],
+            [1, 2, -0.2, 4.5, 5.25, 6.125],
+            [2, 1, 0.1, 7.0, 8.0, 9.0],
+        ]
+    )
+    # xlo xhi ylo yhi zlo zhi xy xz yz
+    bounds = [0.0, 10.5, 0.0, 10.0, 0.0, 10.0, 0.5, 0.0, 0.0]
+    filename = tmp_path / "dump.bin"
+    filename.write_bytes(
+        _binarydump(
+            [(0, data, bounds), (100, data[::-1], bounds)],
+            columns=["id", "type", "q", "x", "y", "z"],
+        )
+    )
+    detector = DetectBinaryDump(
+        filename=str(filename), atomname=np.array(["H", "O"]), pbc=True
+    )
+    (tmp_path / "dump.test").write_text(dump * 2)
+    text = DetectDump(
+        filename=str(tmp_path / "dump.test"), atomname=np.array(["H", "O"]), pbc=True
+    )
+    expected, _ = text.readcrd(dump.splitlines(keepends=True))
+    with open(filename, "rb") as f:
+        frames = list(detector.iterframes(f))
+    assert len(frames) == 2
+    assert frames[1][0] == len(frames[0][1])
+    assert all(isinstance(frame, BinaryFrame) for _, frame in frames)
+    assert [detector.readtimestep(frame) for _, frame in frames] == [0, 100]
+    for (_, frame), expected_ids in zip(frames, ([3, 1, 2], [2, 1, 3])):
+        step_atoms, ids = detector.readcrd(frame)
+        np.testing.assert_array_equal(ids, expected_ids)
+        assert step_atoms.get_chemical_symbols() == expected.get_chemical_symbols()
+        np.testing.assert_array_equal(step_atoms.positions, expected.positions)
+        np.testing.assert_array_equal(step_atoms.cell, expected.cell)
+
+
+def test_readbinarydump_columns(tmp_path):
+    """Test reading the binary dump file in the old format with given columns."""
+    data = np.array([[1.0, 2.0, 3.0, 2, 1], [4.0, 5.0, 6.0, 1, 2]])
+    filename = tmp_path / "dump.bin"
+    filename.write_bytes(
+        _binarydump(
+            [(5, data, [0.0, 10.0, 0.0, 11.0, 0.0, 12.0])], triclinic=False, nchunk=1
+        )
+    )
+    with pytest.raises(RuntimeError):
+        DetectBinaryDump(
+            filename=str(filename), atomname=np.array(["H", "O"]), pbc=True
+        )
+    detector = DetectBinaryDump(
+        filename=str(filename),
+        atomname=np.array(["H", "O"]),
+        pbc=True,
+        columns=["x", "y", "z", "id", "type"],
+    )
+    with open(filename, "rb") as f:
+        ((_, frame),) = detector.iterframes(f)
+    assert detector.readtimestep(frame) == 5
+    step_atoms, ids = detector.readcrd(frame)
+    np.testing.assert_array_equal(ids, [2, 1])
+    assert step_atoms.get_chemical_symbols() == ["O", "H"]
+    np.testing.assert_array_equal(
+        step_atoms.positions, [[4.0, 5.0, 6.0], [1.0, 2.0, 3.0]]
+    )
+    np.testing.assert_array_equal(step_atoms.cell, np.diag([10.0, 11.0, 12.0]))
@@ -0,0 +1,63 @@
+"""Test connecting molecules."""
+
+import numpy as np
+import pytest
+
+from mddatasetbuilder.dps import dps, dps_csr
+
+
+def _reference(bonds):
+    # the stack-based search of the previous implementation
+    visited = [False] * len(bonds)
+    molecules = []
+    for i in range(len(bonds)):
+        if visited[i]:
+            continue
+        mol = []
+        stack = [i]
+        while stack:
+            s = stack.pop()
+            if visited[s]:
+                continue
+            mol.append(s)
+            stack.extend(b for b in bonds[s] if not visited[b])
+            visited[s] = True
+        molecules.append(mol)
+    return molecules
+
+
+def _randombonds(rng, natoms, nbonds):
+    bonds = [[] for _ in range(natoms)]
+    for i, j in rng.integers(natoms, size=(nbonds, 2)).tolist():
+        if i != j and j not in bonds[i]:
+            bonds[i].append(j)
+            bonds[j].append(i)
+    return bonds
+
+
+def test_dps():
+    """Test molecules are the same as the previous implementation."""
+    rng = np.random.default_rng(0)
+    for natoms, nbonds in ((1, 0), (10, 5), (200, 150), (500, 1000)):
+        bonds = _randombonds(rng, natoms, nbonds)
+        assert dps(bonds) == _reference(bonds)
+    assert dps([]) == []
+
+
+def test_dps_csr():
+    """Test labels and members in the CSR format."""
+    rng = np.random.default_rng(1)
+    bonds = _randombonds(rng, 300, 200)
+    indptr = np.cumsum([0] + [len(bond) for bond in bonds])
+    indices = np.concatenate(bonds)
+    labels, molptr, members = dps_csr(indptr, indices)
+    expected = _reference(bonds)
+    assert labels.dtype == molptr.dtype == members.dtype == np.int32
+    assert len(molptr) == len(expected) + 1
+    for ii, mol in enumerate(expected):
+        assert members[molptr[ii] : molptr[ii + 1]].tolist() == mol
+        assert (labels[mol] == ii).all()
+    with pytest.raises(RuntimeError):
+        dps_csr([0, 1], [1])
+    with pytest.raises(RuntimeError):
+        dps_csr([0, 2], [0])
@@ -0,0 +1,165 @@
+"""Test features."""
+
+from collections import Counter, defaultdict
+
+import numpy as np
+import pytest
+from ase import Atoms
+
+from mddatasetbuilder.features import DiskFeatureMatrix, FeatureMatrix, coulumbspectra
+from mddatasetbuilder.neighbor import NeighborList
+
+
+def _pad_features(samples, coulumbdiag):
+    """Assemble features by padding one column at a time."""
+    max_counter = Counter()
+    feedvector = np.zeros((len(samples), 0))
+    vector_elements = defaultdict(list)
+    for j, (vector, symbols_counter) in enumerate(samples):
+        for element in (symbols_counter - max_counter).elements():
+            vector_elements[element].append(feedvector.shape[1])
+            feedvector = np.pad(
+                feedvector,
+                ((0, 0), (0, 1)),
+                "constant",
+                constant_values=(0, coulumbdiag[element]),
+            )
+        feedvector[
+            j,
+            sum((vector_elements[x[0]][: x[1]] for x in symbols_counter.items()), []),
+        ] = vector
+        max_counter |= symbols_counter
+    return np.sort(feedvector), max_counter
+
+
+def test_feature_matrix():
+    """Test FeatureMatrix gives the same features as padding."""
+    rng = np.random.default_rng(1)
+    # symbols from a NumPy array, as the atom names of the builder
+    coulumbdiag = dict(zip(np.array(["C", "H", "O"]), [36.858, 0.5, 73.517]))
+    samples = []
+    for _ in range(200):
+        symbols_counter = Counter(
+            {
+                element: int(count)
+                for element, count in zip("CHO", rng.integers(0, 12, size=3))
+                if count
+            }
+        )
+        samples.append(
+            (rng.normal(size=sum(symbols_counter.values())), symbols_counter)
+        )
+    features = FeatureMatrix(len(samples), coulumbdiag, capacity=2)
+    for j, (vector, symbols_counter) in enumerate(samples):
+        features.append(np.array([j, j + 1]), vector, symbols_counter)
+    expected, max_counter = _pad_features(samples, coulumbdiag)
+    assert features.max_counter == max_counter
+    assert all(type(element) is str for element in features.max_counter)
+    np.testing.assert_allclose(features.assemble(chunksize=64), expected)
+    np.testing.assert_array_equal(features.stepatom[:, 0], np.arange(len(samples)))
+
+
+def test_disk_feature_matrix(tmp_path):
+    """Test DiskFeatureMatrix gives the same features as FeatureMatrix."""
+    rng = np.random.default_rng(3)
+    coulumbdiag = {"C": 36.858, "H": 0.5, "O": 73.517}
+    features = FeatureMatrix(100, coulumbdiag)
+    disk_features = DiskFeatureMatrix(100, coulumbdiag, str(tmp_path / "features"))
+    for j in range(100):
+        symbols_counter = Counter(
+            {
+                element: int(count)
+                for element, count in zip("CHO", rng.integers(0, 6, size=3))
+                if count
+            }
+        )
+        vector = rng.normal(size=sum(symbols_counter.values()))
+        features.append(np.array([j, 1]), vector, symbols_counter)
+        disk_features.append(np.array([j, 1]), vector, symbols_counter)
+    expected = features.assemble()
+    for _ in range(2):
+        np.testing.assert_array_equal(
+            np.concatenate(list(disk_features.iterchunks(chunksize=7))), expected
+        )
+    np.testing.assert_array_equal(disk_features.assemble(chunksize=7), expected)
+    disk_features.close()
+
+
+def test_disk_feature_matrix_merge(tmp_path):
+    """Test merging saved stores gives the same features as one store."""
+    rng = np.random.default_rng(5)
+    coulumbdiag = {"C": 36.858, "H": 0.5, "O": 73.517}
+    features = FeatureMatrix(60, coulumbdiag)
+    parts = [
+        DiskFeatureMatrix(30, coulumbdiag, str(tmp_path / f"features.{ii}"))
+        for ii in range(2)
+    ]
+    for j in range(60):
+        # each part has a different maximum of each element
+        symbols_counter = Counter(
+            {
+                element: int(count)
+                for element, count in zip("CHO", rng.integers(0, 3 + 3 * (j % 2), 3))
+                if count
+            }
+        )
+        vector = rng.normal(size=sum(symbols_counter.values()))
+        features.append(np.array([j, 1]), vector, symbols_counter)
+        parts[j % 2].append(np.array([j, 1]), vector, symbols_counter)
+    for part in parts:
+        part.save()
+    merged = DiskFeatureMatrix(60, coulumbdiag, str(tmp_path / "features"))
+    for ii in range(2):
+        merged.extend(
+            DiskFeatureMatrix.load(str(tmp_path / f"features.{ii}"), coulumbdiag)
+        )
+    merged.close()
+    with pytest.raises(RuntimeError, match="not opened"):
+        merged.extend(parts[0])
+    order = np.concatenate((np.arange(0, 60, 2), np.arange(1, 60, 2)))
+    np.testing.assert_array_equal(merged.stepatom[:, 0], order)
+    np.testing.assert_array_equal(
+        merged.assemble(chunksize=7), features.assemble()[order]
+    )
+
+
+def _coulumbmatrix(atoms, coulumbdiag):
+    """Calculate the eigenvalues of the Coulumb matrix of one cluster."""
+    top = np.outer(atoms.numbers, atoms.numbers).astype(np.float64)
+    r = atoms.get_all_distances(mic=True)
+    diag = np.array([coulumbdiag[symbol] for symbol in atoms.get_chemical_symbols()])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(top, r, top)
+        np.fill_diagonal(top, diag)
+    top[np.isinf(top)] = 0
+    top[np.isnan(top)] = 0
+    return np.linalg.eigh(top)[0]
+
+
+@pytest.mark.parametrize(
+    "cell,pbc",
+    [
+        (np.diag([10.0, 11.0, 12.0]), True),
+        (np.diag([10.0, 11.0, 12.0]), False),
+        ([[10.0, 0.0, 0.0], [3.0, 9.0, 0.0], [-2.0, 1.5, 8.0]], True),
+    ],
+)
+def test_coulumbspectra(cell, pbc):
+    """Test coulumbspectra gives the same eigenvalues as each single cluster."""
+    rng = np.random.default_rng(2)
+    coulumbdiag = {"C": 36.858, "H": 0.5, "O": 73.517}
+    atoms = Atoms(
+        rng.choice(list("CHO"), size=150).tolist(),
+        positions=rng.random((150, 3)) @ np.array(cell),
+        cell=cell,
+        pbc=pbc,
+    )
+    # duplicate an atom to test zero distances
+    atoms += atoms[:1]
+    clusters = NeighborList(atoms, 3.5).query(range(len(atoms)))
+    spectra = coulumbspectra(atoms, clusters, coulumbdiag, chunksize=256)
+    assert len(spectra) == len(clusters)
+    for cluster, eigvals in zip(clusters, spectra):
+        np.testing.assert_allclose(
+            eigvals, _coulumbmatrix(atoms[cluster], coulumbdiag), atol=1e-10
+        )
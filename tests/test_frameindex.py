@@ -0,0 +1,48 @@
+"""Test the frame index."""
+
+import io
+
+import numpy as np
+
+from mddatasetbuilder.detect import DetectDump
+from mddatasetbuilder.frameindex import FrameIndex, decodeframe, iterframes
+
+
+def _frame(timestep):
+    return (
+        f"ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n2\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0.0 10.0\n0.0 10.0\n0.0 10.0\n"
+        f"ITEM: ATOMS id type x y z\n1 1 0.0 0.0 {timestep}.0\n2 2 1.0 1.0 1.0\n"
+    )
+
+
+def test_iterframes():
+    """Test splitting frames with chunks smaller than a frame."""
+    frames = [_frame(ii * 10).encode() for ii in range(5)]
+    content = b"".join(frames)
+    for chunksize in (1, 7, 64, len(content)):
+        result = list(iterframes(io.BytesIO(content), 11, chunksize=chunksize))
+        assert [data for _, data in result] == frames
+        assert [offset for offset, _ in result] == list(
+            np.cumsum([0] + [len(x) for x in frames[:-1]])
+        )
+
+
+def test_frameindex(tmp_path):
+    """Test building, saving, loading and reading the frame index."""
+    filename = str(tmp_path / "dump")
+    with open(filename, "w") as f:
+        f.write("".join(_frame(ii * 10) for ii in range(5)))
+    detector = DetectDump(filename=filename, atomname=np.array(["H", "O"]), pbc=True)
+    index = FrameIndex.build(filename, detector)
+    np.testing.assert_array_equal(index.timesteps, [0, 10, 20, 30, 40])
+    index.save(str(tmp_path))
+    loaded = FrameIndex.load(str(tmp_path), filename)
+    assert loaded is not None
+    np.testing.assert_array_equal(loaded.offsets, index.offsets)
+    with open(filename, "rb") as f:
+        assert decodeframe(loaded.read(f, 3)) == _frame(30).splitlines(keepends=True)
+    # the index is invalid after the file is modified
+    with open(filename, "a") as f:
+        f.write(_frame(50))
+    assert FrameIndex.load(str(tmp_path), filename) is None
@@ -0,0 +1,33 @@
+"""Test manifest."""
+
+from mddatasetbuilder.manifest import Manifest, fileinfo
+
+
+def test_manifest(tmp_path):
+    """Test Manifest keeps finished steps with unchanged parameters."""
+    inputfile = tmp_path / "dump"
+    inputfile.write_text("1\n")
+    parameters = [{"inputs": fileinfo([str(inputfile)])}, {"cutoff": 5.0}, {}]
+    manifest = Manifest(str(tmp_path), parameters)
+    manifest.complete({"nstep": 1})
+    manifest.checkpoint({"ntype": 2})
+
+    manifest = Manifest(str(tmp_path), parameters)
+    manifest.load()
+    assert manifest.stages == [{"nstep": 1}]
+    assert manifest.progress == {"ntype": 2}
+
+    # changed parameters of the second step
+    manifest = Manifest(str(tmp_path), [parameters[0], {"cutoff": 6.0}, {}])
+    manifest.load()
+    assert manifest.stages == [{"nstep": 1}]
+    assert manifest.progress == {}
+
+    # changed input file
+    inputfile.write_text("12\n")
+    manifest = Manifest(
+        str(tmp_path), [{"inputs": fileinfo([str(inputfile)])}, {"cutoff": 5.0}, {}]
+    )
+    manifest.load()
+    assert manifest.stages == []
+    assert manifest.progress == {}
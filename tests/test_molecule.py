@@ -0,0 +1,23 @@
+"""Test molecule index."""
+
+import numpy as np
+
+from mddatasetbuilder.molecule import MoleculeIndex
+
+
+def test_molecule_index():
+    """Test molecules are taken in the same order as looping over them."""
+    rng = np.random.default_rng(0)
+    atoms = rng.permutation(100)
+    molecules = [
+        atoms[start:end].tolist()
+        for start, end in zip([0, 1, 5, 30, 31, 60], [1, 5, 30, 31, 60, 100])
+    ]
+    index = MoleculeIndex(molecules, 100)
+    for _ in range(20):
+        cutoffatomid = rng.choice(100, size=rng.integers(1, 10), replace=False)
+        expected = [mo for mo in molecules if np.isin(mo, cutoffatomid).any()]
+        idx, ranges = index.take(cutoffatomid)
+        np.testing.assert_array_equal(idx, np.concatenate(expected))
+        assert [len(r) for r in ranges] == [len(mo) for mo in expected]
+        assert ranges[0].start == 0 and ranges[-1].stop == len(idx)
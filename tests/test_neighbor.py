@@ -0,0 +1,56 @@
+"""Test neighbor search."""
+
+import numpy as np
+import pytest
+from ase import Atoms
+
+from mddatasetbuilder.neighbor import NeighborList
+
+
+@pytest.mark.parametrize(
+    "cell,pbc,cutoff",
+    [
+        (np.diag([10.0, 11.0, 12.0]), True, 3.0),
+        (np.diag([10.0, 11.0, 12.0]), True, 6.0),
+        (np.diag([10.0, 11.0, 12.0]), False, 3.0),
+        (np.diag([10.0, 11.0, 12.0]), [True, False, True], 3.0),
+        ([[10.0, 0.0, 0.0], [3.0, 9.0, 0.0], [-2.0, 1.5, 8.0]], True, 3.0),
+        ([[10.0, 0.0, 0.0], [3.0, 9.0, 0.0], [-2.0, 1.5, 8.0]], True, 5.0),
+    ],
+)
+def test_neighbor_list(cell, pbc, cutoff):
+    """Test NeighborList gives the same atoms as ase.Atoms.get_distances."""
+    rng = np.random.default_rng(0)
+    atoms = Atoms(
+        "H200",
+        positions=(rng.random((200, 3)) * 1.4 - 0.2) @ np.array(cell),
+        cell=cell,
+        pbc=pbc,
+    )
+    centers = np.arange(0, 200, 7)
+    neighbors = NeighborList(atoms, cutoff).query(centers)
+    for center, result in zip(centers, neighbors):
+        distances = atoms.get_distances(center, range(len(atoms)), mic=True)
+        np.testing.assert_array_equal(result, np.flatnonzero(distances < cutoff))
+
+
+@pytest.mark.parametrize(
+    "cell,pbc",
+    [
+        (np.diag([10.0, 11.0, 12.0]), True),
+        (np.diag([10.0, 11.0, 12.0]), False),
+        ([[10.0, 0.0, 0.0], [3.0, 9.0, 0.0], [-2.0, 1.5, 8.0]], True),
+    ],
+)
+def test_neighbor_pairs(cell, pbc):
+    """Test NeighborList.pairs gives the same pairs as ase.Atoms.get_all_distances."""
+    rng = np.random.default_rng(1)
+    atoms = Atoms(
+        "H100", positions=rng.random((100, 3)) @ np.array(cell), cell=cell, pbc=pbc
+    )
+    i, j, vectors = NeighborList(atoms, 3.0).pairs()
+    distances = atoms.get_all_distances(mic=True)
+    expected_i, expected_j = np.nonzero(np.triu(distances < 3.0, k=1))
+    np.testing.assert_array_equal(i, expected_i)
+    np.testing.assert_array_equal(j, expected_j)
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), distances[i, j])
@@ -0,0 +1,61 @@
+"""Test the profiler."""
+
+import json
+
+from mddatasetbuilder import profiler
+from mddatasetbuilder.datasetbuilder import DatasetBuilder
+from mddatasetbuilder.utils import WorkerPool
+
+
+@profiler.timed("square")
+def _square(x):
+    profiler.count("items")
+    return x * x
+
+
+def test_profiler_workers():
+    """Test gathering the stats of workers."""
+    profiler.enable()
+    try:
+        with WorkerPool(2) as pool, profiler.stage("test"):
+            assert sorted(pool.imap_unordered(_square, range(10))) == [
+                x * x for x in range(10)
+            ]
+            _square(3)
+        stats = profiler._stages.pop()
+    finally:
+        profiler.enable(False)
+    assert stats["name"] == "test"
+    assert stats["functions"]["square"]["calls"] == 11
+    assert stats["peak_rss"]["workers"] >= 0
+    # disabled
+    _square(3)
+    assert profiler.collect() == {"timers": {}, "counters": {}, "gauges": {}}
+
+
+def test_profile_builder(tmp_path, monkeypatch, water_frame):
+    """Test writing the report of a run."""
+    monkeypatch.chdir(tmp_path)
+    with open("dump", "w") as f:
+        f.write("".join(water_frame(ii) for ii in range(5)))
+    DatasetBuilder(
+        dumpfilename="dump",
+        atomname=["H", "O"],
+        n_clusters=5,
+        nproc=2,
+        bondbackend="native",
+        profile="profile.json",
+    ).builddataset()
+    with open("profile.json") as f:
+        report = json.load(f)
+    stages = {stage["name"]: stage for stage in report["stages"]}
+    assert list(stages) == ["step 1", "step 2", "step 3"]
+    assert stages["step 1"]["frames"] == 5
+    assert stages["step 1"]["read_bytes"] == len("".join(map(water_frame, range(5))))
+    # parsing and bond perception in workers
+    assert stages["step 1"]["functions"]["readcrd"]["calls"] == 5
+    assert stages["step 1"]["functions"]["_crd2bond"]["calls"] == 5
+    assert "eigh" in stages["step 2"]["functions"]
+    assert stages["step 2"]["queue_depth"]["max"] >= 1
+    assert stages["step 3"]["write_bytes"] > 0
+    assert not profiler.enabled()
@@ -0,0 +1,60 @@
+"""Test building a dataset in shards."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from mddatasetbuilder.datasetbuilder import DatasetBuilder
+
+
+def test_shard_merge(tmp_path, monkeypatch, water_frame):
+    """Test merging shards selects the structures of all frames."""
+    monkeypatch.chdir(tmp_path)
+    with open("dump.0", "w") as f:
+        f.write("".join(water_frame(ii) for ii in range(3)))
+    with open("dump.1", "w") as f:
+        f.write("".join(water_frame(ii) for ii in range(3, 5)))
+
+    def builder(**kwargs):
+        return DatasetBuilder(
+            dumpfilename=["dump.0", "dump.1"],
+            atomname=["H", "O"],
+            n_clusters=5,
+            nproc=1,
+            bondbackend="native",
+            **kwargs,
+        )
+
+    with pytest.raises(RuntimeError, match="whole files"):
+        builder(shard=(0, 3))
+    builder(shard=(0, 2), profile="profile.json").builddataset()
+    with open("profile.json") as f:
+        stages = {stage["name"]: stage for stage in json.load(f)["stages"]}
+    # the shard only reads its own file
+    assert stages["step 1"]["frames"] == 3
+    assert stages["step 1"]["read_bytes"] == os.path.getsize("dump.0")
+    assert stages["step 2"]["read_bytes"] <= os.path.getsize("dump.0")
+    with pytest.raises(RuntimeError, match=r"Shards \[1\] of 2"):
+        builder().mergeshards()
+    with pytest.raises(RuntimeError, match="different inputs"):
+        builder(cutoff=4.0).mergeshards()
+    builder(shard=(1, 2)).builddataset()
+    builder().mergeshards()
+    paths = {
+        name: os.path.join(root, name)
+        for root, _, files in os.walk("dataset_md")
+        for name in files
+        if name.endswith(".xyz")
+    }
+    # all 5 oxygen atoms are taken, and 10 hydrogen atoms are clustered
+    oxygens = [path for name, path in paths.items() if name.startswith("md_O")]
+    assert len(oxygens) == 5
+    assert 1 <= len([name for name in paths if name.startswith("md_H")]) <= 5
+    # the steps of the second shard follow the first one
+    z = []
+    for path in oxygens:
+        with open(path) as f:
+            z.append(float(f.readlines()[2].split()[3]))
+    np.testing.assert_allclose(sorted(z), [1.0, 1.1, 1.2, 1.3, 1.4])
@@ -0,0 +1,148 @@
+"""Test utils."""
+
+import io
+
+import numpy as np
+import pytest
+
+from mddatasetbuilder import utils
+from mddatasetbuilder.frameindex import BinaryFrame
+from mddatasetbuilder.utils import (
+    ArrayWriter,
+    FrameRing,
+    Scheduler,
+    WorkerPool,
+    _unshare,
+    read_array,
+    run_mp,
+)
+
+
+def test_deprecated_compress():
+    """Test the deprecated lz4 helpers still read compressed blocks."""
+    pytest.importorskip("lz4")
+    with pytest.deprecated_call():
+        data = utils.listtobytes([1, 2]) + utils.compress("line")
+    with pytest.deprecated_call():
+        blocks = list(utils.read_compressed_block(io.BytesIO(data)))
+    with pytest.deprecated_call():
+        assert utils.bytestolist(blocks[0]) == [1, 2]
+    with pytest.deprecated_call():
+        assert utils.decompress(blocks[1]) == "line"
+
+
+def test_array_writer(tmp_path):
+    """Test rows written by ArrayWriter are read back in order."""
+    filename = str(tmp_path / "stepatom")
+    rows = []
+    with ArrayWriter(filename, 2, buffersize=5) as writer:
+        for step in range(10):
+            atomids = np.arange(step % 3 + 1) + step
+            writer.append(np.column_stack((np.full(len(atomids), step), atomids)))
+            rows.extend([step, atomid] for atomid in atomids)
+    np.testing.assert_array_equal(read_array(filename, 2), rows)
+    np.testing.assert_array_equal(read_array(filename, 2, mmap=True), rows)
+    assert read_array(filename, 2).dtype == np.int32
+
+
+@pytest.mark.skipif(utils.shared_memory is None, reason="requires shared memory")
+def test_frame_ring():
+    """Test frames are handed over and slots are reused."""
+    ring = FrameRing(2, maxslotsize=100)
+    try:
+        slots, item = ring.share((1, (b"a\nb\n", b"c\n"), "d"))
+        assert len(slots) == 2
+        assert _unshare(item) == (1, (["a\n", "b\n"], ["c\n"]), "d")
+        ring.release(slots)
+        # a larger frame grows the slot
+        slots, item = ring.share(b"e\n" * 20)
+        assert _unshare(item) == ["e\n"] * 20
+        ring.release(slots)
+        # oversized frames are sent directly
+        slots, item = ring.share(b"f\n" * 60)
+        assert slots == []
+        assert _unshare(item) == ["f\n"] * 60
+        # binary frames are not decoded
+        slots, item = ring.share(BinaryFrame(b"\0\n\1"))
+        assert len(slots) == 1
+        frame = _unshare(item)
+        assert isinstance(frame, BinaryFrame)
+        assert frame == b"\0\n\1"
+        ring.release(slots)
+    finally:
+        ring.close()
+
+
+def test_run_mp_shared():
+    """Test run_mp decodes shared frames in workers."""
+    frames = [b"line\n" * (i + 1) for i in range(50)]
+    results = run_mp(2, func=len, l=iter(frames), shared=True, bar=False)
+    assert sorted(results) == list(range(1, 51))
+
+
+class _Offset:
+    def __init__(self, offset):
+        self.offset = offset
+
+    def add(self, x):
+        return x + self.offset
+
+
+def test_run_mp_state():
+    """Test run_mp calls the method of the state installed in workers."""
+    results = run_mp(2, func="add", state=_Offset(100), l=range(50), bar=False)
+    assert sorted(results) == list(range(100, 150))
+
+
+def test_worker_pool(tmp_path):
+    """Test a worker pool is reused by stages with different states."""
+    with WorkerPool(2, tmpdir=str(tmp_path)) as pool:
+        results = run_mp(2, func="add", state=_Offset(100), pool=pool, l=range(50))
+        assert sorted(results) == list(range(100, 150))
+        workers = pool.pool
+        results = run_mp(2, func="add", state=_Offset(200), pool=pool, l=range(50))
+        assert sorted(results) == list(range(200, 250))
+        # the state of running workers is passed by a file
+        assert len(list(tmp_path.iterdir())) == 1
+        results = run_mp(2, func=abs, pool=pool, l=range(-10, 0), bar=False)
+        assert sorted(results) == list(range(1, 11))
+        assert pool.pool is workers
+    assert not list(tmp_path.iterdir())
+
+
+def test_worker_pool_recycle():
+    """Test workers exceeding the memory limit are restarted."""
+    with WorkerPool(2, maxmemory=0) as pool:
+        assert sorted(run_mp(2, func=abs, pool=pool, l=range(-3, 0))) == [1, 2, 3]
+        workers = pool.pool
+        # a worker reports its PID when started, before taking any task
+        assert 1 <= len(pool.pids) <= 2
+        memory = max(utils._residentmemory(pid) for pid in pool.pids)
+        assert sorted(run_mp(2, func=abs, pool=pool, l=range(-3, 0))) == [1, 2, 3]
+        # the memory is unknown except on Linux
+        assert (pool.pool is not workers) == bool(memory)
+
+
+def test_scheduler():
+    """Test chunks and items in flight are sized from the items."""
+    # small frames: chunks are limited by the total
+    scheduler = Scheduler(4, total=160)
+    scheduler.start((0, b"x" * 100))
+    assert scheduler.chunksize == 10
+    assert scheduler.limit == scheduler.maxitems == 600
+    # large frames: the budget limits the items in flight
+    scheduler = Scheduler(4, maxinflight=100 << 20)
+    scheduler.start(b"x" * (1 << 20))
+    assert scheduler.chunksize == 4
+    assert scheduler.limit == 100
+    # the limit follows the average size
+    for _ in range(3):
+        scheduler.measure(b"x" * (4 << 20))
+    assert scheduler.limit == 2 * 4 * 4
+
+
+def test_run_mp_maxinflight():
+    """Test run_mp finishes with a tiny memory budget."""
+    frames = [b"line\n" * (i + 1) for i in range(50)]
+    results = run_mp(2, func=len, l=iter(frames), shared=True, maxinflight=1, bar=False)
+    assert sorted(results) == list(range(1, 51))